@@ -31,6 +31,7 @@ setup(
     install_requires=[
         'crate>=2.1.2',
         'cr8>=0.29.1',
+        'numpy',
         'Cython',
         'asyncpg>=0.21',
         'pyodbc',
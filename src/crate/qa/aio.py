@@ -0,0 +1,156 @@
+"""
+Thread-backed asyncio adapters of NodeProvider and the wait helpers
+
+This module is not asyncio-native: nodes are still cr8 processes with
+blocking pipes, and the crate client is blocking. Every blocking call,
+like starting or stopping a node, a readiness query or a blocking poll
+condition, runs in the default executor of the loop with
+`asyncio.to_thread`. Only the waiting between polls, and coroutine
+conditions, run on the loop itself. This lets one event loop drive several
+clusters, workloads and waits at once, but each blocking call holds one of
+the executor's threads while it runs. The polling logic and readiness
+conditions are shared with the blocking functions in crate.qa.tests.
+
+    class UpgradeTest(AsyncNodeProvider, unittest.IsolatedAsyncioTestCase):
+
+        async def test_upgrade(self):
+            clusters = await asyncio.gather(
+                self._new_cluster_async('5.9.x', 3),
+                self._new_cluster_async('5.10.x', 3))
+            await asyncio.gather(*(self.start_cluster(c) for c in clusters))
+"""
+
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, List, Optional
+
+from cr8.run_crate import CrateNode
+from crate.qa.tests import (
+    DEBUG,
+    NODE_STOP_TIMEOUT,
+    CrateCluster,
+    DataTemplate,
+    NodeProvider,
+    Poll,
+    _caller,
+    _cluster_readiness,
+    _print_shards,
+    shards_active,
+    spans,
+    stop_node as _stop_node,
+)
+
+
+async def poll_until(condition: Callable[[], Any],
+                     timeout: float,
+                     name: str = 'poll_until',
+                     interval: float = 0.05,
+                     max_interval: float = 1.0,
+                     f: float = 1.5) -> Any:
+    """Like `crate.qa.tests.poll_until`, without blocking the event loop
+
+    `condition` can return an awaitable. Plain functions are called in the
+    default executor, as they usually run blocking queries.
+    """
+    poll = Poll(timeout, name, interval, max_interval, f, _caller(__file__))
+    while True:
+        try:
+            if inspect.iscoroutinefunction(condition):
+                result = await condition()
+            else:
+                result = await asyncio.to_thread(condition)
+                if inspect.isawaitable(result):
+                    result = await result
+            error = None
+        except AssertionError as e:
+            result = None
+            error = e
+        delay = poll.next_delay(result, error)
+        if delay is None:
+            return result
+        await asyncio.sleep(delay)
+
+
+async def assert_busy(assertion, timeout=120, f=2.0):
+    """Call `assertion` until it doesn't raise an AssertionError anymore"""
+    async def succeeded():
+        result = await asyncio.to_thread(assertion)
+        if inspect.isawaitable(result):
+            await result
+        return True
+    await poll_until(succeeded, timeout, name='assert_busy', interval=0.1, max_interval=2.0, f=f)
+
+
+async def wait_for_cluster(cursor, num_active=0, health: Optional[str] = 'GREEN', settled=True, timeout=60, num_nodes=0):
+    """Wait until `cluster_ready` holds, see there for the arguments"""
+    try:
+        with spans.span('wait_for_cluster') as tags:
+            await poll_until(_cluster_readiness(cursor, tags, num_active, health, settled, num_nodes),
+                             timeout, name='wait_for_cluster')
+    except TimeoutError:
+        if DEBUG:
+            await asyncio.to_thread(_print_shards, cursor)
+        raise TimeoutError(f"Cluster didn't become ready (nodes {num_nodes}, shards {num_active}, "
+                           f"health {health}) within {timeout}s.") from None
+
+
+async def wait_for_active_shards(cursor, num_active=0, timeout=60, f=1.2):
+    """Wait for shards to become active, see `crate.qa.tests.wait_for_active_shards`"""
+    try:
+        with spans.span('wait_for_active_shards', num_active=num_active):
+            await poll_until(lambda: shards_active(cursor, num_active), timeout, name='wait_for_active_shards', f=f)
+    except TimeoutError:
+        if DEBUG:
+            await asyncio.to_thread(_print_shards, cursor)
+        raise TimeoutError(f"Shards {num_active} didn't become active within {timeout}s.") from None
+
+
+async def start_node(node: CrateNode):
+    await asyncio.to_thread(node.start)
+
+
+async def stop_node(node: CrateNode, timeout: float = NODE_STOP_TIMEOUT, discard: bool = False):
+    """Stop a node, see `crate.qa.tests.stop_node`"""
+    await asyncio.to_thread(_stop_node, node, timeout, discard)
+
+
+async def stop_nodes(nodes, timeout: float = NODE_STOP_TIMEOUT, discard: bool = False):
+    await asyncio.gather(*(stop_node(node, timeout, discard) for node in nodes))
+
+
+class AsyncNodeProvider(NodeProvider):
+    """NodeProvider with coroutines to create, start, stop and upgrade nodes
+
+    Meant to be mixed with `unittest.IsolatedAsyncioTestCase`. The blocking
+    methods of NodeProvider remain available, tearDown stops all nodes as usual.
+    """
+
+    async def _new_cluster_async(self,
+                                 version,
+                                 num_nodes: int,
+                                 data_paths: Optional[List[str]] = None,
+                                 settings: Optional[Dict[str, Any]] = None,
+                                 env=None,
+                                 explicit_discovery=True,
+                                 template: Optional[DataTemplate] = None) -> CrateCluster:
+        """Like `_new_cluster`, fetching CrateDB (and seeding the template) doesn't block the loop"""
+        return await asyncio.to_thread(
+            self._new_cluster, version, num_nodes, data_paths, settings, env, explicit_discovery, template)
+
+    async def start_cluster(self, cluster: CrateCluster):
+        """Start all nodes of a cluster concurrently"""
+        await asyncio.gather(*(start_node(node) for node in cluster))
+
+    async def stop_cluster(self, cluster: CrateCluster, discard: bool = False):
+        await stop_nodes(cluster, discard=discard)
+
+    async def upgrade_node_async(self, old_node: CrateNode, new_version: str) -> CrateNode:
+        """Like `upgrade_node`, several nodes of different clusters can be upgraded at once"""
+        with spans.span('upgrade_node', version=new_version, node=str(old_node.addresses.http.port)):
+            env = await asyncio.to_thread(self._upgrade_env, old_node, new_version)
+            await stop_node(old_node)
+            new_node = await asyncio.to_thread(self._replacement_node, old_node, new_version, env)
+            mark = self.log_events.mark()
+            await start_node(new_node)
+            await asyncio.to_thread(self._wait_for_master, new_node, mark)
+            return new_node
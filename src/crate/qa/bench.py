@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Compare the wall time of tests between node profiles
+
+Every test is run in a fresh worker process per profile and repetition, the
+profiles alternate so that a slowly changing host load affects all of them
+alike. The median duration per test and the change relative to the first
+profile are printed, and written to a JSON report if requested.
+
+    python -m crate.qa.bench -s tests -n 3 bwc.test_upgrade.MetaDataCompatibilityTest
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import unittest
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+from crate.qa.tests import PROFILES
+
+
+def _test_ids(names: List[str]) -> List[str]:
+    def flatten(suite):
+        for test in suite:
+            if isinstance(test, unittest.TestSuite):
+                yield from flatten(test)
+            else:
+                yield test.id()
+    return list(flatten(unittest.defaultTestLoader.loadTestsFromNames(names)))
+
+
+def run_test(test_id: str, profile: str, start_dir: str) -> Dict[str, Any]:
+    """Run a single test in a worker process of the runner and return its record"""
+    env = os.environ.copy()
+    env['CRATE_QA_PROFILE'] = profile
+    with tempfile.TemporaryDirectory() as tmp:
+        result_file = os.path.join(tmp, 'result.json')
+        cmd = [sys.executable, '-m', 'crate.qa.runner', '--worker', result_file, test_id]
+        subprocess.run(cmd, cwd=start_dir, env=env, stdin=subprocess.DEVNULL, check=False)
+        try:
+            with open(result_file) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return {'id': test_id, 'outcome': 'error', 'duration': None}
+    for record in records:
+        if record['id'] == test_id:
+            return record
+    return {'id': test_id, 'outcome': 'error', 'duration': None}
+
+
+def benchmark(test_ids: List[str], profiles: List[str], repetitions: int, start_dir: str) -> Dict[str, Any]:
+    durations: Dict[str, Dict[str, List[float]]] = {t: {p: [] for p in profiles} for t in test_ids}
+    failures = []
+    skipped = []
+    for test_id in test_ids:
+        for i in range(repetitions):
+            for profile in profiles:
+                record = run_test(test_id, profile, start_dir)
+                print(f'# {test_id} [{profile} {i + 1}/{repetitions}]: {record["outcome"]} {record["duration"]}s')
+                if record['outcome'] == 'success':
+                    durations[test_id][profile].append(record['duration'])
+                elif record['outcome'] == 'skipped':
+                    # A skipped test didn't do the work that is compared
+                    skipped.append(f'{test_id} [{profile}]')
+                else:
+                    failures.append(f'{test_id} [{profile}]')
+    report: Dict[str, Any] = {
+        'profiles': profiles,
+        'repetitions': repetitions,
+        'tests': {},
+        'failures': failures,
+        'skipped': list(dict.fromkeys(skipped)),
+    }
+    baseline = profiles[0]
+    for test_id, by_profile in durations.items():
+        medians = {p: statistics.median(d) for p, d in by_profile.items() if d}
+        entry: Dict[str, Any] = {'median': medians}
+        if baseline in medians and medians[baseline] > 0:
+            entry['change'] = {
+                p: (m - medians[baseline]) / medians[baseline] for p, m in medians.items() if p != baseline}
+        report['tests'][test_id] = entry
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    profiles = report['profiles']
+    print('\n' + ' | '.join(['test'] + profiles))
+    for test_id, entry in report['tests'].items():
+        cols = [test_id]
+        for profile in profiles:
+            median = entry['median'].get(profile)
+            col = '-' if median is None else f'{median:.1f}s'
+            change = entry.get('change', {}).get(profile)
+            if change is not None:
+                col += f' ({change:+.0%})'
+            cols.append(col)
+        print(' | '.join(cols))
+    for failure in report['failures']:
+        print(f'FAILED: {failure}')
+    for skipped in report['skipped']:
+        print(f'SKIPPED: {skipped}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--start-dir', default='.')
+    parser.add_argument('-p', '--profile', action='append', choices=sorted(PROFILES),
+                        help='Profiles to compare, the first one is the baseline (default: default, fast)')
+    parser.add_argument('-n', '--repetitions', type=int, default=3)
+    parser.add_argument('-o', '--output', help='Write the report as JSON to this file')
+    parser.add_argument('tests', nargs='+', help='Test modules, classes or methods')
+    args = parser.parse_args()
+    output = args.output and os.path.abspath(args.output)
+    sys.path.insert(0, os.path.abspath(args.start_dir))
+    os.chdir(args.start_dir)
+    report = benchmark(_test_ids(args.tests), args.profile or ['default', 'fast'], args.repetitions, '.')
+    print_report(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Columnar fake data generation
+
+cr8's row generator calls Faker for every single cell. `ColumnarGenerator`
+generates a whole batch per column with NumPy instead, deterministically
+derived from a seed, the offset of the batch and the column position. Batches of
+seeded generators can be stored in a cache directory and are memory-mapped
+from there when they are needed again.
+
+NumPy is a dependency of crate-qa, `HAS_NUMPY` tells if the generator can be
+used anyway. Without it cr8 generates the rows and seeds have no effect.
+"""
+
+import os
+import csv
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from cr8.insert_fake_data import Column, DataFaker
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+
+# Timestamps are spread over the two years before a fixed date, so that a
+# seed always yields the same data
+TIMESTAMP_END = 1735689600000  # 2025-01-01T00:00:00Z
+TIMESTAMP_RANGE = 2 * 365 * 24 * 60 * 60 * 1000
+# Scalar timestamp types only, arrays of them are generated per cell
+TIMESTAMP_TYPES = ('timestamp', 'timestamp with time zone', 'timestamp without time zone')
+
+INT_RANGES = {
+    'byte': ('int8', -128, 127),
+    'char': ('int8', -128, 127),
+    'short': ('int16', -32768, 32767),
+    'smallint': ('int16', -32768, 32767),
+    'integer': ('int32', -2147483648, 2147483647),
+    'int': ('int32', -2147483648, 2147483647),
+    'long': ('int64', -9223372036854775808, 9223372036854775807),
+    'bigint': ('int64', -9223372036854775808, 9223372036854775807),
+}
+
+_words = None
+
+
+def _word_list():
+    global _words
+    if _words is None:
+        from faker.providers.lorem.en_US import Provider
+        _words = np.array(Provider.word_list)
+    return _words
+
+
+def _uuids(rng, size: int):
+    raw = rng.integers(0, 256, size=(size, 16), dtype=np.uint8)
+    return np.array([str(uuid.UUID(bytes=row.tobytes(), version=4)) for row in raw], dtype='U36')
+
+
+def _generate_column(column: Column, rng, offset: int, size: int):
+    """Return the values of a column as array, or None if there is no vectorized generator for it"""
+    type_name = column.type_name
+    if column.name == 'id':
+        if type_name in ('integer', 'long', 'bigint'):
+            # Like cr8's auto_inc, continuing over batches
+            return np.arange(offset + 1, offset + size + 1, dtype=np.int64)
+        if type_name in ('string', 'text'):
+            return _uuids(rng, size)
+    if type_name in INT_RANGES:
+        dtype, low, high = INT_RANGES[type_name]
+        return rng.integers(low, high, size=size, endpoint=True, dtype=dtype)
+    if type_name in ('float', 'real'):
+        return (rng.standard_normal(size) * 1e4).astype(np.float32)
+    if type_name in ('double', 'double precision'):
+        return rng.standard_normal(size) * 1e6
+    if type_name == 'boolean':
+        return rng.integers(0, 2, size=size).astype(bool)
+    if type_name in TIMESTAMP_TYPES:
+        return TIMESTAMP_END - rng.integers(0, TIMESTAMP_RANGE, size=size, dtype=np.int64)
+    if type_name in ('string', 'text', 'character varying'):
+        words = _word_list()[rng.integers(0, len(_word_list()), size=size)]
+        return words.astype(f'U{column.max_len}') if column.max_len else words
+    if type_name == 'ip':
+        octets = rng.integers(0, 256, size=(4, size)).astype(str)
+        ip = octets[0]
+        for octet in octets[1:]:
+            ip = np.char.add(np.char.add(ip, '.'), octet)
+        return ip
+    if type_name == 'geo_point':
+        return np.stack([rng.uniform(-180, 180, size), rng.uniform(-90, 90, size)], axis=1)
+    if type_name == 'bit':
+        length = column.max_len or 8
+        bits = rng.integers(0, 2, size=(size, length), dtype=np.uint8) + ord('0')
+        return bits.view(f'S{length}').ravel().astype(f'U{length}')
+    return None
+
+
+class ColumnarGenerator:
+    """Generates batches of rows for the given columns
+
+    Columns whose name matches a Faker provider, arrays, objects and shapes
+    are generated per cell with cr8's providers, seeded per batch.
+    """
+
+    def __init__(self, columns: List[Column], seed: int, cache_dir: Optional[Path] = None):
+        self.columns = columns
+        self.seed = seed
+        faker = DataFaker().fake
+        # cr8 prefers the Faker provider named like the column (`name`, `email`, ...)
+        self._per_cell = [
+            i for i, c in enumerate(columns)
+            if c.name != 'id' and getattr(faker, c.name, None) is not None
+        ]
+        self._cache_dir = None
+        if cache_dir:
+            key = hashlib.sha1(json.dumps(
+                [[c.name, c.type_name, c.max_len] for c in columns] + [seed]).encode('utf-8')).hexdigest()
+            self._cache_dir = cache_dir / key
+
+    def _generate(self, offset: int, size: int) -> Dict[int, Any]:
+        arrays = {}
+        for i, column in enumerate(self.columns):
+            if i in self._per_cell:
+                continue
+            rng = np.random.default_rng([self.seed, offset, i])
+            values = _generate_column(column, rng, offset, size)
+            if values is not None:
+                arrays[i] = values
+        return arrays
+
+    def _load(self, batch_dir: Path) -> Optional[Dict[int, Any]]:
+        try:
+            with open(batch_dir / 'columns.json') as f:
+                positions = json.load(f)
+            return {i: np.load(batch_dir / f'{i}.npy', mmap_mode='r') for i in positions}
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, batch_dir: Path, arrays: Dict[int, Any]):
+        batch_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=batch_dir.parent))
+        for i, values in arrays.items():
+            np.save(tmp_dir / f'{i}.npy', values)
+        with open(tmp_dir / 'columns.json', 'w') as f:
+            json.dump(list(arrays), f)
+        try:
+            os.rename(tmp_dir, batch_dir)
+        except OSError:
+            # Another process stored the same batch in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def batch(self, offset: int, size: int) -> List[List[Any]]:
+        """Return `size` rows starting at row `offset`"""
+        arrays = None
+        if self._cache_dir:
+            batch_dir = self._cache_dir / f'{offset}-{size}'
+            arrays = self._load(batch_dir)
+            if arrays is None:
+                arrays = self._generate(offset, size)
+                self._store(batch_dir, arrays)
+            else:
+                os.utime(self._cache_dir)
+        if arrays is None:
+            arrays = self._generate(offset, size)
+        data_faker = DataFaker()
+        data_faker.fake.seed_instance(hash((self.seed, offset)))
+        columns = []
+        for i, column in enumerate(self.columns):
+            if i in arrays:
+                columns.append(arrays[i].tolist())
+            else:
+                provider = data_faker.provider_for_column(column)
+                columns.append([provider() for x in range(size)])
+        return [list(row) for row in zip(*columns)]
+
+
+def remove_old_batches(cache_dir: Path, max_age=7 * 24 * 60 * 60):
+    """Remove the cached batches of generators which weren't used recently"""
+    oldest = time.time() - max_age
+    if not cache_dir.exists():
+        return
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and entry.stat().st_mtime < oldest:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (dict, list)):
+        raise ValueError(f'Cannot write {value!r} to a CSV file, use JSON for non-scalar columns')
+    return value
+
+
+def write_data_file(path: str,
+                    fmt: str,
+                    names: List[str],
+                    row_batch: Callable[[int, int], List[List[Any]]],
+                    offset: int,
+                    size: int,
+                    batch_size: int = 10000):
+    """Write `size` rows starting at row `offset` to a JSON lines or CSV file
+
+    The rows are written to a temporary file which is renamed to `path` once
+    it is complete.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = None
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(names)
+        for start in range(offset, offset + size, batch_size):
+            rows = row_batch(start, min(batch_size, offset + size - start))
+            if writer:
+                writer.writerows([_csv_value(v) for v in row] for row in rows)
+            else:
+                f.writelines(json.dumps(dict(zip(names, row)), default=str) + '\n' for row in rows)
+    os.rename(tmp_path, path)
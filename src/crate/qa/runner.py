@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+"""
+Parallel test runner for the CrateDB QA suites
+
+Test classes (and the shards of test methods listed in a class's
+`SUBTEST_SHARDS`) are run as jobs in separate worker processes; classes
+with `SHARED_CLUSTER = 'module'` are run together per module. A job is
+only started if the memory and cores it needs, derived from the class's
+`NUM_NODES` and the heap size of a node, fit into the budget of the host.
+The results of all jobs are merged into one JSON and one JUnit report.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import unittest
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+
+from crate.qa.tests import NODE_POOL_SIZE, NodeProvider, summarize_spans
+
+NODE_OVERHEAD_MB = 512
+
+
+def parse_size_mb(size: str) -> int:
+    """ Parse a JVM heap size like '1024m' or '2g' into megabytes
+
+    >>> parse_size_mb('2g')
+    2048
+    >>> parse_size_mb('512m')
+    512
+    """
+    size = size.strip().lower()
+    units = {'k': 1 / 1024, 'm': 1, 'g': 1024, 't': 1024 * 1024}
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size) // (1024 * 1024)
+
+
+def available_memory_mb() -> int:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+class Job(NamedTuple):
+    name: str
+    test_ids: Tuple[str, ...]
+    num_nodes: int
+    resources: Tuple[str, ...]
+    shard: Optional[str] = None
+
+    def memory_mb(self, node_memory_mb: int) -> int:
+        return self.num_nodes * node_memory_mb
+
+
+def _iter_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _iter_tests(test)
+        else:
+            yield test
+
+
+def create_jobs(suite: unittest.TestSuite) -> Tuple[List[Job], List[unittest.TestCase]]:
+    """ Group the tests of `suite` into jobs
+
+    Returns the jobs and the tests which cannot be run by name in a worker,
+    like the placeholders for modules that failed to import.
+    """
+    tests_by_class: Dict[type, List[unittest.TestCase]] = {}
+    unloadable = []
+    for test in _iter_tests(suite):
+        if type(test).__module__.startswith('unittest.'):
+            unloadable.append(test)
+        else:
+            tests_by_class.setdefault(type(test), []).append(test)
+
+    jobs = []
+    # Classes sharing a cluster per module run in one job, so that they share
+    # it within one worker process
+    module_jobs: Dict[str, Job] = {}
+    for cls, tests in tests_by_class.items():
+        name = f'{cls.__module__}.{cls.__qualname__}'
+        skipped = getattr(cls, '__unittest_skip__', False)
+        num_nodes = 0 if skipped else getattr(cls, 'NUM_NODES', NodeProvider.NUM_NODES)
+        if num_nodes and NODE_POOL_SIZE > 0 and issubclass(cls, NodeProvider):
+            # Next to a leased node the pool keeps up to NODE_POOL_SIZE nodes,
+            # including the one it starts in the background for a pristine lease
+            num_nodes = max(num_nodes, 1 + NODE_POOL_SIZE)
+        resources = tuple(getattr(cls, 'EXCLUSIVE_RESOURCES', ()))
+        shards = {} if skipped else getattr(cls, 'SUBTEST_SHARDS', {})
+        rest = []
+        for test in tests:
+            method = test.id().rsplit('.', 1)[-1]
+            num_shards = shards.get(method, 1)
+            if num_shards > 1:
+                for i in range(num_shards):
+                    jobs.append(Job(f'{test.id()}[{i}/{num_shards}]', (test.id(),), num_nodes, resources, f'{i}/{num_shards}'))
+            else:
+                rest.append(test.id())
+        if not rest:
+            continue
+        if not skipped and getattr(cls, 'SHARED_CLUSTER', None) == 'module':
+            job = module_jobs.get(cls.__module__)
+            if job:
+                module_jobs[cls.__module__] = job._replace(
+                    test_ids=job.test_ids + tuple(rest),
+                    num_nodes=max(job.num_nodes, num_nodes),
+                    resources=job.resources + tuple(r for r in resources if r not in job.resources))
+            else:
+                module_jobs[cls.__module__] = Job(cls.__module__, tuple(rest), num_nodes, resources)
+        else:
+            jobs.append(Job(name, tuple(rest), num_nodes, resources))
+    jobs.extend(module_jobs.values())
+    return jobs, unloadable
+
+
+class RecordingTestResult(unittest.TestResult):
+    """ Records the outcome and duration of every test and subtest """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records: List[Dict[str, Any]] = []
+        self._started: Dict[str, float] = {}
+
+    def _record(self, test, outcome: str, details: Optional[str] = None):
+        started = self._started.get(test.id(), time.monotonic())
+        self.records.append({
+            'id': test.id(),
+            'outcome': outcome,
+            'duration': round(time.monotonic() - started, 3),
+            'details': details,
+        })
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started[test.id()] = time.monotonic()
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'success')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failure', self._exc_info_to_string(err, test))
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', self._exc_info_to_string(err, test))
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skipped', reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'success', 'expected failure')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'failure', 'unexpected success')
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        self._started.setdefault(subtest.id(), self._started.get(test.id(), time.monotonic()))
+        if err is None:
+            self._record(subtest, 'success')
+        elif issubclass(err[0], test.failureException):
+            self._record(subtest, 'failure', self._exc_info_to_string(err, test))
+        else:
+            self._record(subtest, 'error', self._exc_info_to_string(err, test))
+        self._started[subtest.id()] = time.monotonic()
+
+
+def run_worker(result_file: str, test_ids: List[str]) -> int:
+    suite = unittest.defaultTestLoader.loadTestsFromNames(test_ids)
+    result = RecordingTestResult()
+    suite.run(result)
+    with open(result_file, 'w') as f:
+        json.dump(result.records, f)
+    return 0 if result.wasSuccessful() else 1
+
+
+class Scheduler:
+    """ Runs jobs in worker processes as long as they fit into the budget """
+
+    def __init__(self,
+                 jobs: List[Job],
+                 start_dir: str,
+                 report_dir: Path,
+                 memory_mb: int,
+                 cores: int,
+                 node_memory_mb: int,
+                 max_workers: int):
+        # Start the most expensive jobs first, the small ones fill the gaps
+        self.pending = sorted(jobs, key=lambda j: j.num_nodes, reverse=True)
+        self.start_dir = start_dir
+        self.report_dir = report_dir
+        self.memory_mb = memory_mb
+        self.cores = cores
+        self.node_memory_mb = node_memory_mb
+        self.max_workers = max_workers
+        self.running: List[Tuple[Job, subprocess.Popen, float]] = []
+        self.records: List[Dict[str, Any]] = []
+
+    def _used(self) -> Tuple[int, int, set]:
+        memory = sum(j.memory_mb(self.node_memory_mb) for j, _, _ in self.running)
+        cores = sum(j.num_nodes for j, _, _ in self.running)
+        resources = {r for j, _, _ in self.running for r in j.resources}
+        return memory, cores, resources
+
+    def _fits(self, job: Job) -> bool:
+        if not self.running:
+            # A job that exceeds the whole budget still has to run at some point
+            return True
+        if len(self.running) >= self.max_workers:
+            return False
+        memory, cores, resources = self._used()
+        return all([
+            not resources.intersection(job.resources),
+            memory + job.memory_mb(self.node_memory_mb) <= self.memory_mb,
+            cores + job.num_nodes <= self.cores,
+        ])
+
+    def _files(self, job: Job) -> Tuple[Path, Path]:
+        name = job.name.replace('/', '-')
+        return self.report_dir / 'logs' / f'{name}.log', self.report_dir / 'results' / f'{name}.json'
+
+    def _spans_file(self, job: Job) -> Path:
+        return self.report_dir / 'spans' / f'{job.name.replace("/", "-")}.jsonl'
+
+    def _start(self, job: Job):
+        log_file, result_file = self._files(job)
+        env = os.environ.copy()
+        if job.shard:
+            env['CRATE_QA_SUBTEST_SHARD'] = job.shard
+        env['CRATE_QA_SPANS_FILE'] = str(self._spans_file(job))
+        cmd = [sys.executable, '-m', 'crate.qa.runner', '--worker', str(result_file), *job.test_ids]
+        with open(log_file, 'w') as log:
+            proc = subprocess.Popen(
+                cmd, cwd=self.start_dir, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        self.running.append((job, proc, time.monotonic()))
+        print(f'# started {job.name} ({job.num_nodes} nodes, {len(self.running)} running)')
+
+    def _finish(self, job: Job, proc: subprocess.Popen, started: float):
+        log_file, result_file = self._files(job)
+        try:
+            with open(result_file) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            records = [{
+                'id': job.name,
+                'outcome': 'error',
+                'duration': round(time.monotonic() - started, 3),
+                'details': f'Worker exited with {proc.returncode} without results, see {log_file}',
+            }]
+        for record in records:
+            record['log'] = str(log_file)
+        self.records.extend(records)
+        ok = proc.returncode == 0
+        print(f'# {"ok" if ok else "FAILED"} {job.name} in {time.monotonic() - started:.0f}s')
+
+    def run(self) -> List[Dict[str, Any]]:
+        (self.report_dir / 'logs').mkdir(parents=True, exist_ok=True)
+        (self.report_dir / 'results').mkdir(parents=True, exist_ok=True)
+        (self.report_dir / 'spans').mkdir(parents=True, exist_ok=True)
+        # Workers append to their span files, drop the ones of an earlier run
+        for path in (self.report_dir / 'spans').glob('*.jsonl'):
+            path.unlink()
+        while self.pending or self.running:
+            for job in list(self.pending):
+                if self._fits(job):
+                    self.pending.remove(job)
+                    self._start(job)
+            time.sleep(0.5)
+            for entry in list(self.running):
+                job, proc, started = entry
+                if proc.poll() is not None:
+                    self.running.remove(entry)
+                    self._finish(job, proc, started)
+        return self.records
+
+
+def write_junit_report(records: List[Dict[str, Any]], path: Path):
+    root = ElementTree.Element('testsuites')
+    suites: Dict[str, ElementTree.Element] = {}
+    for record in records:
+        test_id = record['id']
+        # Subtest ids look like `module.Class.method (params)`
+        name_part, _, params = test_id.partition(' ')
+        classname, _, method = name_part.rpartition('.')
+        suite = suites.get(classname)
+        if suite is None:
+            suite = suites[classname] = ElementTree.SubElement(root, 'testsuite', name=classname)
+        case = ElementTree.SubElement(
+            suite, 'testcase',
+            classname=classname,
+            name=f'{method} {params}'.strip(),
+            time=str(record['duration']))
+        outcome = record['outcome']
+        if outcome in ('failure', 'error', 'skipped'):
+            ElementTree.SubElement(case, outcome).text = record['details']
+        if record.get('log'):
+            ElementTree.SubElement(case, 'system-out').text = record['log']
+    for suite in suites.values():
+        cases = list(suite)
+        suite.set('tests', str(len(cases)))
+        for outcome, attribute in (('failure', 'failures'), ('error', 'errors'), ('skipped', 'skipped')):
+            suite.set(attribute, str(sum(1 for c in cases if c.find(outcome) is not None)))
+    ElementTree.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def write_spans_report(report_dir: Path) -> Dict[str, Dict[str, float]]:
+    """Merge the timing spans of all workers into spans.json and return the totals per phase"""
+    spans: List[Dict[str, Any]] = []
+    for path in sorted((report_dir / 'spans').glob('*.jsonl')):
+        with open(path) as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    phases = summarize_spans(spans)
+    with open(report_dir / 'spans.json', 'w') as f:
+        json.dump({'phases': phases, 'spans': spans}, f, indent=2)
+    return phases
+
+
+def run(start_dir: str,
+        pattern: str = 'test_*.py',
+        report_dir: str = 'test-reports',
+        memory_mb: Optional[int] = None,
+        cores: Optional[int] = None,
+        max_workers: Optional[int] = None) -> bool:
+    start_dir = os.path.abspath(start_dir)
+    sys.path.insert(0, start_dir)
+    suite = unittest.TestLoader().discover(start_dir, pattern=pattern, top_level_dir=start_dir)
+    jobs, unloadable = create_jobs(suite)
+
+    reports = Path(report_dir).absolute()
+    node_memory_mb = parse_size_mb(NodeProvider.CRATE_HEAP_SIZE) + NODE_OVERHEAD_MB
+    scheduler = Scheduler(
+        jobs,
+        start_dir,
+        reports,
+        memory_mb=memory_mb or available_memory_mb(),
+        cores=cores or os.cpu_count() or 1,
+        node_memory_mb=node_memory_mb,
+        max_workers=max_workers or os.cpu_count() or 1,
+    )
+    print(f'# {len(jobs)} jobs, budget: {scheduler.memory_mb}MB, {scheduler.cores} cores, {node_memory_mb}MB per node')
+    records = scheduler.run()
+
+    result = RecordingTestResult()
+    unittest.TestSuite(unloadable).run(result)
+    records.extend(result.records)
+
+    with open(reports / 'report.json', 'w') as f:
+        json.dump(records, f, indent=2)
+    write_junit_report(records, reports / 'junit.xml')
+    phases = write_spans_report(reports)
+
+    failed = [r for r in records if r['outcome'] in ('failure', 'error')]
+    for record in failed:
+        print('=' * 70)
+        print(f'{record["outcome"].upper()}: {record["id"]}')
+        print('-' * 70)
+        print(record['details'])
+        if record.get('log'):
+            print(f'Output: {record["log"]}')
+    print('-' * 70)
+    for phase, entry in sorted(phases.items(), key=lambda p: p[1]['total'], reverse=True):
+        print(f'# {phase}: {entry["total"]:.1f}s in {entry["count"]} spans (max {entry["max"]:.1f}s)')
+    print(f'Ran {len(records)} tests, {len(failed)} failed. Reports in {reports}')
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker', metavar='RESULT_FILE', help=argparse.SUPPRESS)
+    parser.add_argument('-s', '--start-dir', default='.')
+    parser.add_argument('-p', '--pattern', default='test_*.py')
+    parser.add_argument('--report-dir', default='test-reports')
+    parser.add_argument('--memory', type=int, help='Memory budget in MB (default: available memory)')
+    parser.add_argument('--cores', type=int, help='Number of cores (default: all cores)')
+    parser.add_argument('-j', '--max-workers', type=int, help='Maximum number of concurrent jobs')
+    parser.add_argument('test_ids', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        sys.exit(run_worker(args.worker, args.test_ids))
+    ok = run(args.start_dir, args.pattern, args.report_dir, args.memory, args.cores, args.max_workers)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,187 @@
 import os
+import re
 import sys
+import atexit
 import time
+import fcntl
+import errno
+import codecs
+import locale
+import selectors
 import signal
+import ctypes
+import faulthandler
 import shutil
 import string
+import gzip
+import json
+import socket
+import hashlib
+import inspect
+import weakref
 import tempfile
+import unittest
+import subprocess
 import functools
+import contextlib
+from pathlib import Path
+from types import FrameType
+from collections import deque
 from pprint import pformat
-from threading import Thread
+from threading import BoundedSemaphore, Condition, Event, Lock, Thread, get_ident as threading_get_ident, local as thread_local
+from concurrent.futures import ThreadPoolExecutor
 from collections.abc import Iterator
-from typing import Dict, Any, NamedTuple, Iterable, List, Optional, Tuple
+from typing import Dict, Any, Callable, NamedTuple, Iterable, List, Optional, Tuple
 
 from faker.generator import random
-from cr8.run_crate import CrateNode, get_crate, _extract_version, parse_version
+from cr8.run_crate import CrateNode, get_crate, _crates_cache, _extract_tarball, _extract_version, _lookup_uri, parse_version, BRANCH_VERSION_RE, VERSION_RE
 from cr8.insert_fake_data import SELLECT_COLS, Column, create_row_generator
 from cr8.insert_json import to_insert
+from crate.client import connect
+from crate.client.exceptions import ConnectionError as ClientConnectionError, Error as ClientError, ProgrammingError
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
+from crate.qa.fake_data import HAS_NUMPY, ColumnarGenerator, remove_old_batches, write_data_file
 
 DEBUG = os.environ.get('DEBUG', 'false').lower() == 'true'
 
 CRATEDB_0_57 = (0, 57, 0)
 
+CACHE_ROOT = Path(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')))
+DATA_TEMPLATES_DIR = CACHE_ROOT / 'crate-tests' / 'data-templates'
+LOCKS_DIR = CACHE_ROOT / 'crate-tests' / 'locks'
+FAKE_DATA_DIR = CACHE_ROOT / 'crate-tests' / 'fake-data'
+
+PREFETCH_WORKERS = int(os.environ.get('CRATE_QA_PREFETCH_WORKERS', 4))
+
+VERSION_INDEX = CACHE_ROOT / 'crate-tests' / 'versions.json'
+VERSION_INDEX_TTL = int(os.environ.get('CRATE_QA_VERSION_INDEX_TTL', 24 * 60 * 60))
+OFFLINE = os.environ.get('CRATE_QA_OFFLINE', 'false').lower() == 'true'
+
+# ioctl request to share the data blocks of two files (linux/fs.h)
+FICLONE = 0x40049409
+
+# Leased ports stay below the ephemeral port range of the OS
+PORT_RANGE_START = int(os.environ.get('CRATE_QA_PORT_RANGE_START', 14200))
+PORT_RANGE_END = int(os.environ.get('CRATE_QA_PORT_RANGE_END', 32000))
+PORTS_PER_PROTOCOL = 10
+PORT_REGISTRY = Path(os.environ.get(
+    'CRATE_QA_PORT_REGISTRY', os.path.join(tempfile.gettempdir(), 'crate-qa-ports.json')))
+
+# tmpfs for the data of test classes with the 'memory' storage class
+SHM_DIR = os.environ.get('CRATE_QA_SHM_DIR', '/dev/shm')
+
+# Bulk requests of insert_data: rows per request and requests in flight
+INSERT_BATCH_SIZE = int(os.environ.get('CRATE_QA_INSERT_BATCH_SIZE', 1000))
+INSERT_CONCURRENCY = int(os.environ.get('CRATE_QA_INSERT_CONCURRENCY', 4))
+INSERT_RETRIES = 5
+# Only rows rejected for these reasons may succeed when they are sent again
+TRANSIENT_INSERT_ERRORS = re.compile(
+    r'UnavailableShards|NoShardAvailable|ShardNotFound|shards? (?:are |is )?not available|'
+    r'NodeNotConnected|NodeDisconnected|RejectedExecution|\b503\b', re.IGNORECASE)
+
+# File based loading with COPY FROM
+COPY_FILES_PER_NODE = int(os.environ.get('CRATE_QA_COPY_FILES_PER_NODE', 4))
+# Seconds between the checks whether a running COPY FROM still imports rows
+COPY_PROGRESS_INTERVAL = 5.0
+UPGRADE_DATASET_ROWS = int(os.environ.get('CRATE_QA_UPGRADE_ROWS', 0))
+
+# Timing spans of the test phases are appended to this file as JSON lines
+SPANS_FILE = os.environ.get('CRATE_QA_SPANS_FILE')
+
+# Lines of output kept in memory per node, older lines are spilled into a
+# compressed file which is kept in CRATE_QA_LOG_DIR if the test fails
+LOG_TAIL_LINES = int(os.environ.get('CRATE_QA_LOG_TAIL_LINES', 500))
+LOG_ARCHIVE_DIR = os.environ.get('CRATE_QA_LOG_DIR', os.path.join(tempfile.gettempdir(), 'crate-qa-logs'))
+
+# Directories are renamed into this directory next to them and deleted in the background
+TRASH_DIR_NAME = 'crate-qa-trash'
+
+# Seconds without progress after which `timeout(..., stall_timeout=STALL_TIMEOUT)` gives up
+STALL_TIMEOUT = int(os.environ.get('CRATE_QA_STALL_TIMEOUT', 300))
+
+# Time a node gets to shut down gracefully before it is killed
+NODE_STOP_TIMEOUT = int(os.environ.get('CRATE_QA_NODE_STOP_TIMEOUT', 120))
+
+# Number of started single nodes kept ready for `NodeProvider._lease_node`, 0 disables the pool
+NODE_POOL_SIZE = int(os.environ.get('CRATE_QA_NODE_POOL_SIZE', 1))
+
+# Dynamic AppCDS archives need JDK 13+, all CrateDB releases since 5.0 bundle a newer JDK
+CDS_ENABLED = os.environ.get('CRATE_QA_CDS', 'true').lower() == 'true'
+CDS_MIN_VERSION = (5, 0, 0)
+CDS_ARCHIVES_DIR = CACHE_ROOT / 'crate-tests' / 'cds'
+# A node dumping an archive which didn't stop within this time likely crashed
+CDS_CLAIM_TTL = 60 * 60
+
 
 print_error = functools.partial(print, file=sys.stderr)
 
 
+class Span(NamedTuple):
+    phase: str
+    test: Optional[str]
+    version: Optional[str]
+    node: Optional[str]
+    start: float
+    duration: float
+    error: Optional[str]
+    tags: Dict[str, Any]
+
+
+class SpanRecorder:
+    """Times the phases of tests: fetching CrateDB, starting nodes, waiting, loading data, ...
+
+    Spans are tagged with the id of the running test (set by NodeProvider.setUp)
+    and written to `path` as JSON lines as soon as they end.
+    """
+
+    def __init__(self, path: Optional[str] = SPANS_FILE):
+        self.path = path
+        self.test_id: Optional[str] = None
+        self.spans: List[Span] = []
+        self._lock = Lock()
+
+    @contextlib.contextmanager
+    def span(self, phase: str, version: Optional[str] = None, node: Optional[str] = None, **tags):
+        start = time.time()
+        started = time.monotonic()
+        error = None
+        try:
+            # Tags can still be added while the span is open
+            yield tags
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(Span(phase, self.test_id, version, node, start, time.monotonic() - started, error, tags))
+
+    def record(self, span: Span):
+        report_progress(f'span:{span.phase}')
+        with self._lock:
+            self.spans.append(span)
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(span._asdict()) + '\n')
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return summarize_spans(s._asdict() for s in self.spans)
+
+
+def summarize_spans(spans: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Return the count, total and maximum duration per phase"""
+    result: Dict[str, Dict[str, float]] = {}
+    for span in spans:
+        entry = result.setdefault(span['phase'], {'count': 0, 'total': 0.0, 'max': 0.0})
+        entry['count'] += 1
+        entry['total'] += span['duration']
+        entry['max'] = max(entry['max'], span['duration'])
+    return result
+
+
+spans = SpanRecorder()
+
+
 class UpgradePath(NamedTuple):
     from_version: str
     to_version: str
@@ -54,35 +212,677 @@ def test_settings(version: Tuple[int, int, int]) -> Dict[str, Any]:
     return s
 
 
+class Profile(NamedTuple):
+    """Node settings and JVM options that test classes opt into with `NodeProvider.PROFILE`"""
+    name: str
+    settings: Callable[[Tuple[int, int, int]], Dict[str, Any]]
+    java_opts: Callable[[Tuple[int, int, int]], List[str]]
+
+
+def _fast_settings(version: Tuple[int, int, int]) -> Dict[str, Any]:
+    # Test data is tiny, there is no point in throttling recoveries
+    s = {
+        'indices.recovery.max_bytes_per_sec': '1gb',
+        'cluster.routing.allocation.node_initial_primaries_recoveries': 16,
+        'cluster.routing.allocation.node_concurrent_recoveries': 8,
+        'cluster.routing.allocation.cluster_concurrent_rebalance': 8,
+    }
+    if version >= (3, 0, 0):
+        s.update({
+            'cluster.routing.allocation.node_concurrent_incoming_recoveries': 8,
+            'cluster.routing.allocation.node_concurrent_outgoing_recoveries': 8,
+        })
+    return s
+
+
+def _fast_java_opts(version: Tuple[int, int, int]) -> List[str]:
+    # Nodes live for seconds to minutes: C1 compiled code is good enough and
+    # pre-touching the whole heap only delays the startup
+    return ['-XX:TieredStopAtLevel=1', '-XX:-AlwaysPreTouch', '-XX:-UsePerfData']
+
+
+PROFILES = {
+    'default': Profile('default', lambda version: {}, lambda version: []),
+    'fast': Profile('fast', _fast_settings, _fast_java_opts),
+}
+
+
 def remove_unsupported_settings(version: Tuple[int, int, int], settings: dict) -> Dict[str, Any]:
     new_settings = dict(settings)
     if version >= (4, 0, 0):
         new_settings.pop('license.enterprise', None)
     else:
-        new_settings.pop("discovery.seed_hosts", None)
+        seed_hosts = new_settings.pop("discovery.seed_hosts", None)
+        if seed_hosts:
+            new_settings["discovery.zen.ping.unicast.hosts"] = seed_hosts
         new_settings.pop("cluster.initial_master_nodes", None)
 
     return new_settings
 
 
+_connection_versions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _connection_version(conn) -> Tuple[int, int, int]:
+    """Return the (cached) minimum version of the nodes a connection talks to"""
+    version = _connection_versions.get(conn)
+    if version is None:
+        c = conn.cursor()
+        c.execute("SELECT min(version['number']) FROM sys.nodes")
+        version = _connection_versions[conn] = parse_version(c.fetchone()[0])
+    return version
+
+
 def columns_for_table(conn, schema, table) -> list[Column]:
     c = conn.cursor()
-    c.execute("SELECT min(version['number']) FROM sys.nodes")
-    version = parse_version(c.fetchone()[0])
+    version = _connection_version(conn)
     stmt = SELLECT_COLS.format(
         schema_column_name='table_schema' if version >= CRATEDB_0_57 else 'schema_name')
     c.execute(stmt, (schema, table, ))
     return [Column(*row) for row in c.fetchall()]
 
 
-def insert_data(conn, schema, table, num_rows):
-    cols = columns_for_table(conn, schema, table)
-    columns_dict = {r.name: r.type_name for r in cols}
-    stmt, args = to_insert(f'"{schema}"."{table}"', columns_dict)
+class LoadStats(NamedTuple):
+    rows: int
+    seconds: float
+    batches: int
+    retries: int
+    failed_rows: int
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f'{self.rows} rows in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s), '
+                f'{self.batches} batches, {self.retries} retries, {self.failed_rows} failed rows')
+
+
+def _is_transient(error: Optional[str]) -> bool:
+    return bool(error) and TRANSIENT_INSERT_ERRORS.search(error or '') is not None
+
+
+def _bulk_error(result: Dict[str, Any]) -> Optional[str]:
+    """Return the reason a row of a bulk request was rejected, if the node tells"""
+    error = result.get('error')
+    if isinstance(error, dict):
+        return error.get('message')
+    return result.get('error_message') or error
+
+
+def _is_unsent(error: ClientConnectionError) -> bool:
+    """Whether a request failed before any node received it"""
+    cause = error.__cause__ or error.__context__
+    if isinstance(cause, MaxRetryError):
+        cause = cause.reason
+    # Includes NewConnectionError, the connection was refused
+    return isinstance(cause, ConnectTimeoutError)
+
+
+def _insert_batch(conn, stmt: str, rows: List[Any], retries: int = INSERT_RETRIES) -> Tuple[int, int]:
+    """Insert rows with a bulk request and re-send the ones rejected for transient reasons
+
+    Returns the number of retries and of rows which failed. Unavailable
+    shards and rejected executions are retried, rows rejected for any other
+    (or an unknown) reason, like duplicate keys, fail at once. A request that
+    failed with a connection error is only sent again if no node received
+    it, a node could have inserted its rows otherwise. Failed rows don't
+    raise an error, errors of the request do.
+    """
+    cursor = conn.cursor()
+    failed = 0
+    for attempt in range(retries + 1):
+        try:
+            results = cursor.executemany(stmt, rows)
+        except ClientConnectionError as e:
+            if attempt == retries or not _is_unsent(e):
+                raise
+        except ProgrammingError as e:
+            if attempt == retries or not _is_transient(str(e)):
+                raise
+        else:
+            report_progress('insert_batch')
+            rejected = [(row, _bulk_error(result)) for row, result in zip(rows, results) if result.get('rowcount', 0) < 0]
+            rows = [row for row, error in rejected if _is_transient(error)]
+            failed += len(rejected) - len(rows)
+            if not rows or attempt == retries:
+                return attempt, failed + len(rows)
+        time.sleep(0.1 * 2 ** attempt)
+    return retries, failed + len(rows)
+
+
+def _row_batches(cols: List[Column], seed: Optional[int]) -> Callable[[int, int], List[List[Any]]]:
+    """Return a function generating `size` rows starting at row `offset`"""
+    if HAS_NUMPY:
+        if seed is None:
+            return ColumnarGenerator(cols, random.getrandbits(63)).batch
+        remove_old_batches(FAKE_DATA_DIR)
+        return ColumnarGenerator(cols, seed, FAKE_DATA_DIR).batch
     gen_row = create_row_generator(cols)
-    c = conn.cursor()
-    c.executemany(stmt, [gen_row() for x in range(num_rows)])
-    c.execute(f'REFRESH TABLE "{schema}"."{table}"')
+    return lambda offset, size: [gen_row() for x in range(size)]
+
+
+def insert_data(conn,
+                schema,
+                table,
+                num_rows,
+                batch_size=INSERT_BATCH_SIZE,
+                concurrency=INSERT_CONCURRENCY,
+                seed: Optional[int] = None,
+                servers: Optional[List[str]] = None) -> LoadStats:
+    """Insert `num_rows` rows of fake data
+
+    Rows are generated lazily and sent as bulk requests of `batch_size` rows
+    over `concurrency` connections to `servers` (by default the active
+    servers of `conn`). At most two batches per connection are held in
+    memory.
+
+    Rows are generated per column with NumPy. With a `seed` the same rows
+    are generated every time and cached on disk.
+    """
+    with spans.span('insert_data', table=f'{schema}.{table}', rows=num_rows) as tags:
+        cols = columns_for_table(conn, schema, table)
+        columns_dict = {r.name: r.type_name for r in cols}
+        stmt, args = to_insert(f'"{schema}"."{table}"', columns_dict)
+        row_batch = _row_batches(cols, seed)
+        local = thread_local()
+        if servers is None:
+            servers = conn.client.active_servers
+
+        def insert_batch(rows):
+            if not hasattr(local, 'conn'):
+                client = conn.client
+                local.conn = connect(
+                    servers,
+                    username=client.username,
+                    password=client.password,
+                    schema=client.schema,
+                    error_trace=True)
+                connections.append(local.conn)
+            return _insert_batch(local.conn, stmt, rows)
+
+        connections: List[Any] = []
+        slots = BoundedSemaphore(concurrency * 2)
+        started = time.monotonic()
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for offset in range(0, num_rows, batch_size):
+                    slots.acquire()
+                    rows = row_batch(offset, min(batch_size, num_rows - offset))
+                    future = executor.submit(insert_batch, rows)
+                    future.add_done_callback(lambda f: slots.release())
+                    futures.append(future)
+                results = [f.result() for f in futures]
+        finally:
+            for c in connections:
+                c.close()
+        stats = LoadStats(
+            rows=num_rows,
+            seconds=time.monotonic() - started,
+            batches=len(futures),
+            retries=sum(r[0] for r in results),
+            failed_rows=sum(r[1] for r in results))
+        conn.cursor().execute(f'REFRESH TABLE "{schema}"."{table}"')
+        tags['rows_per_second'] = round(stats.rows_per_second)
+        tags['retries'] = stats.retries
+        if DEBUG:
+            print(f'# Inserted into {schema}.{table}: {stats}')
+        return stats
+
+
+def _data_files_key(cols: List[Column], seed: int, num_rows: int, num_files: int, fmt: str) -> str:
+    spec = [[c.name, c.type_name, c.max_len] for c in cols] + [seed, num_rows, num_files, fmt]
+    return hashlib.sha1(json.dumps(spec).encode('utf-8')).hexdigest()
+
+
+def write_data_files(cols: List[Column],
+                     path: str,
+                     num_rows: int,
+                     num_files: int,
+                     fmt: str = 'json',
+                     seed: Optional[int] = None,
+                     concurrency: int = INSERT_CONCURRENCY):
+    """Write `num_rows` rows of fake data, split evenly into `num_files` files"""
+    row_batch = _row_batches(cols, seed)
+    names = [c.name for c in cols]
+    rows_per_file = -(-num_rows // num_files)
+    with spans.span('write_data_files', rows=num_rows, files=num_files, format=fmt):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    write_data_file,
+                    os.path.join(path, f'{i:05d}.{fmt}'),
+                    fmt,
+                    names,
+                    row_batch,
+                    offset,
+                    min(rows_per_file, num_rows - offset))
+                for i, offset in enumerate(range(0, num_rows, rows_per_file))
+            ]
+            for future in futures:
+                future.result()
+                report_progress('write_data_file')
+
+
+def _cached_data_files(cols: List[Column], num_rows: int, num_files: int, fmt: str, seed: int) -> str:
+    """Return a directory with the data files of a seed, writing them if they don't exist yet"""
+    remove_old_batches(FAKE_DATA_DIR)
+    path = FAKE_DATA_DIR / f'files-{_data_files_key(cols, seed, num_rows, num_files, fmt)}'
+    if path.exists():
+        os.utime(path)
+        return str(path)
+    FAKE_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=FAKE_DATA_DIR)
+    write_data_files(cols, tmp_dir, num_rows, num_files, fmt, seed)
+    try:
+        os.rename(tmp_dir, path)
+    except OSError:
+        # Another process wrote the same files in the meantime
+        discard_dir(tmp_dir)
+    return str(path)
+
+
+@contextlib.contextmanager
+def _copy_progress(conn, schema: str, table: str, interval: float = COPY_PROGRESS_INTERVAL):
+    """Report progress while a COPY FROM into a table is running
+
+    COPY FROM is a single blocking request. A helper thread checks the highest
+    sequence numbers of the table's shards, which grow with every imported row
+    without a refresh, and reports progress whenever they grew.
+    """
+    stopped = Event()
+
+    def watch():
+        c = conn.cursor()
+        imported = None
+        while not stopped.wait(interval):
+            try:
+                c.execute("SELECT sum(seq_no_stats['max_seq_no']) FROM sys.shards "
+                          "WHERE schema_name = ? AND table_name = ?", (schema, table))
+                current = c.fetchone()[0]
+            except ClientError:
+                continue
+            if imported is not None and current is not None and current > imported:
+                report_progress('copy_data')
+            imported = current
+
+    thread = Thread(target=watch, name='crate-qa-copy-progress', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def copy_data(conn,
+              schema,
+              table,
+              num_rows,
+              fmt: str = 'json',
+              num_files: Optional[int] = None,
+              seed: Optional[int] = None) -> LoadStats:
+    """Load `num_rows` rows of fake data with `COPY FROM`
+
+    The rows are written to `num_files` JSON or CSV files (by default
+    `COPY_FILES_PER_NODE` per node). All nodes run on this host and see the
+    same files, `shared = true` makes every node import a distinct subset of
+    them, so that the import is spread over the whole cluster.
+
+    With a `seed` the files are kept in the fake data cache and reused by
+    later runs, otherwise they are removed once they are imported.
+    `LoadStats.seconds` only covers the import.
+    """
+    if fmt not in ('json', 'csv'):
+        raise ValueError(f'Unsupported format: {fmt}')
+    with spans.span('copy_data', table=f'{schema}.{table}', rows=num_rows) as tags:
+        c = conn.cursor()
+        if num_files is None:
+            c.execute('SELECT count(*) FROM sys.nodes')
+            num_files = c.fetchone()[0] * COPY_FILES_PER_NODE
+        num_files = max(1, min(num_files, num_rows))
+        cols = columns_for_table(conn, schema, table)
+        path = _cached_data_files(cols, num_rows, num_files, fmt, seed) if seed is not None else None
+        try:
+            if path is None:
+                path = tempfile.mkdtemp(prefix=_tmp_prefix())
+                write_data_files(cols, path, num_rows, num_files, fmt)
+            num_bytes = _dir_size(path)
+            uri = 'file://' + os.path.join(path, f'*.{fmt}').replace("'", "''")
+            options = "shared = true, format = 'csv'" if fmt == 'csv' else 'shared = true'
+            started = time.monotonic()
+            with _copy_progress(conn, schema, table):
+                c.execute(f'COPY "{schema}"."{table}" FROM \'{uri}\' WITH ({options})')
+            imported = c.rowcount
+            stats = LoadStats(
+                rows=num_rows,
+                seconds=time.monotonic() - started,
+                batches=num_files,
+                retries=0,
+                failed_rows=num_rows - imported)
+        finally:
+            if seed is None and path:
+                discard_dir(path)
+        c.execute(f'REFRESH TABLE "{schema}"."{table}"')
+        tags['rows_per_second'] = round(stats.rows_per_second)
+        tags['mb_per_second'] = round(num_bytes / 2**20 / stats.seconds, 1) if stats.seconds > 0 else 0.0
+        tags['failed_rows'] = stats.failed_rows
+        if DEBUG:
+            print(f'# Copied {num_bytes / 2**20:.0f} MB into {schema}.{table}: {stats}')
+        return stats
+
+
+def _is_immutable_data_file(path: str) -> bool:
+    """ Lucene never modifies a file of an index once it has been written """
+    return os.path.basename(os.path.dirname(path)) == 'index' and not path.endswith('write.lock')
+
+
+def _copy_data_file(src: str, dst: str):
+    if _is_immutable_data_file(src):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                raise
+            shutil.copyfileobj(fsrc, fdst, length=1024 * 1024)
+    shutil.copystat(src, dst)
+
+
+def copy_data_dir(src: str, dst: str, max_workers: int = 8):
+    """Copy the data directory of a stopped node
+
+    Immutable Lucene files are hardlinked, all other files are reflinked if the
+    filesystem supports it. Otherwise the files are copied in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for dirpath, _, filenames in os.walk(src):
+            target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+            os.makedirs(target_dir, exist_ok=True)
+            for filename in filenames:
+                futures.append(executor.submit(
+                    _copy_data_file,
+                    os.path.join(dirpath, filename),
+                    os.path.join(target_dir, filename)))
+        for future in futures:
+            future.result()
+
+
+def _stable_repr(value: Any) -> str:
+    """ repr() without the memory addresses of objects that don't define it """
+    return re.sub(r' at 0x[0-9a-fA-F]+', '', repr(value))
+
+
+class DataTemplate(NamedTuple):
+    """Seed data that is created once per CrateDB build and then re-used
+
+    `seed` is called with a connection to a new cluster. The data paths of the
+    cluster are cached afterwards and cloned for every test that uses the
+    same template, CrateDB build, number of nodes and node settings.
+    """
+    name: str
+    seed: Callable[[Any], None]
+
+    def digest(self, num_nodes: int, settings: Dict[str, Any]) -> str:
+        """Identify the data of the template seeded into `num_nodes` nodes with `settings`
+
+        Besides the source of `seed`, the values it closes over and its
+        default arguments (or the arguments of a `functools.partial`) count.
+        """
+        seed = self.seed
+        try:
+            source = inspect.getsource(seed)
+        except (OSError, TypeError):
+            source = getattr(seed, '__qualname__', None) or _stable_repr(seed)
+        closure = [cell.cell_contents for cell in getattr(seed, '__closure__', None) or ()]
+        values = [num_nodes, sorted(settings.items()), closure, getattr(seed, '__defaults__', None)]
+        return hashlib.sha1((self.name + source + _stable_repr(values)).encode('utf-8')).hexdigest()
+
+
+def _remove_old_data_templates(path: Path, max_age=7 * 24 * 60 * 60):
+    oldest = time.time() - max_age
+    if not path.exists():
+        return
+    for entry in os.scandir(path):
+        if entry.is_dir() and entry.stat().st_mtime < oldest:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class WaitRecord(NamedTuple):
+    name: str
+    caller: str
+    duration: float
+    polls: int
+    succeeded: bool
+
+
+class WaitStats:
+    """Records how long the waiters of crate.qa.tests were idle"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.records: List[WaitRecord] = []
+
+    def record(self, record: WaitRecord):
+        with self._lock:
+            if DEBUG and not self.records:
+                atexit.register(self.print_report)
+            self.records.append(record)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Return the number, total and maximum duration of the waits per caller"""
+        result: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for r in self.records:
+                entry = result.setdefault(f'{r.name} {r.caller}', {'waits': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0})
+                entry['waits'] += 1
+                entry['total'] += r.duration
+                entry['max'] = max(entry['max'], r.duration)
+                entry['timeouts'] += 0 if r.succeeded else 1
+        return result
+
+    def print_report(self):
+        entries = sorted(self.report().items(), key=lambda e: e[1]['total'], reverse=True)
+        for name, e in entries:
+            print_error(f'# Waited {e["total"]:.1f}s in {e["waits"]} waits (max {e["max"]:.1f}s, '
+                        f'{e["timeouts"]} timeouts): {name}')
+
+
+wait_stats = WaitStats()
+
+
+def _caller(*skip: str) -> str:
+    """Return the location of the first caller outside of this module (and the `skip` files)"""
+    files = (__file__, ) + skip
+    frame: Optional[FrameType] = sys._getframe(1)
+    while frame and frame.f_code.co_filename in files:
+        frame = frame.f_back
+    if not frame:
+        return '?'
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}'
+
+
+def poll_until(condition: Callable[[], Any],
+               timeout: float,
+               name: str = 'poll_until',
+               interval: float = 0.05,
+               max_interval: float = 1.0,
+               f: float = 1.5) -> Any:
+    """Call `condition` until it returns a truthy value and return that value
+
+    The interval between the calls starts at `interval` and grows by `f` up to
+    `max_interval`. The last sleep is cut short so that `condition` is
+    evaluated one last time at the deadline. An AssertionError raised by
+    `condition` counts as not ready; the last one is re-raised on timeout.
+    Raises TimeoutError otherwise.
+    """
+    poll = Poll(timeout, name, interval, max_interval, f, _caller())
+    while True:
+        try:
+            result = condition()
+            error = None
+        except AssertionError as e:
+            result = None
+            error = e
+        delay = poll.next_delay(result, error)
+        if delay is None:
+            return result
+        time.sleep(delay)
+
+
+class Poll:
+    """The state of `poll_until`, shared with its asyncio variant in crate.qa.aio"""
+
+    def __init__(self, timeout: float, name: str, interval: float, max_interval: float, f: float, caller: str):
+        self.timeout = timeout
+        self.name = name
+        self.interval = interval
+        self.max_interval = max_interval
+        self.f = f
+        self.caller = caller
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.polls = 0
+
+    def next_delay(self, result: Any, error: Optional[AssertionError]) -> Optional[float]:
+        """Return the time to sleep before the next poll, or None if `result` is ready
+
+        Raises `error` or TimeoutError once the deadline has passed.
+        """
+        self.polls += 1
+        if result:
+            report_progress(f'poll:{self.name}')
+            wait_stats.record(WaitRecord(self.name, self.caller, time.monotonic() - self.started, self.polls, True))
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            wait_stats.record(WaitRecord(self.name, self.caller, time.monotonic() - self.started, self.polls, False))
+            if error:
+                raise error
+            raise TimeoutError(f'{self.name} did not succeed within {self.timeout}s')
+        delay = min(self.interval, remaining)
+        self.interval = min(self.interval * self.f, self.max_interval)
+        return delay
+
+
+def _cluster_version(cursor) -> Tuple[int, int, int]:
+    cursor.execute("SELECT min(version['number']) FROM sys.nodes")
+    return parse_version(cursor.fetchone()[0])
+
+
+# Queries on system tables which the nodes of a version turned out not to have
+_unsupported_queries: set = set()
+
+
+def cluster_ready(cursor,
+                  version: Tuple[int, int, int],
+                  num_active: int = 0,
+                  health: Optional[str] = 'GREEN',
+                  settled: bool = True,
+                  num_nodes: int = 0) -> bool:
+    """Evaluate the combined readiness condition of a cluster
+
+    :param num_active: if > 0, the number of shards which must be `STARTED`
+    :param health: the minimum health (`GREEN` or `YELLOW`) of all tables
+    :param settled: require that no shard is initializing or relocating
+    :param num_nodes: if > 0, the number of nodes which must have joined
+    """
+    def count(stmt: str, fallback: Optional[str] = None) -> int:
+        # sys.health and sys.allocations were added in the course of 4.x,
+        # without them the same is derived from sys.shards
+        if fallback is None or (version, stmt) not in _unsupported_queries:
+            try:
+                cursor.execute(stmt)
+                return int(cursor.fetchone()[0])
+            except ProgrammingError:
+                if fallback is None:
+                    raise
+                _unsupported_queries.add((version, stmt))
+        cursor.execute(fallback)
+        return int(cursor.fetchone()[0])
+
+    if num_nodes > 0 and count("SELECT count(*) FROM sys.nodes") != num_nodes:
+        return False
+    if num_active > 0 and count("SELECT count(*) FROM sys.shards WHERE state = 'STARTED'") != num_active:
+        return False
+    if health == 'GREEN':
+        shards = "SELECT count(*) FROM sys.shards WHERE state <> 'STARTED'"
+        if version < (4, 0, 0):
+            if count(shards) > 0:
+                return False
+        elif count("SELECT count(*) FROM sys.health WHERE health <> 'GREEN'", shards) > 0:
+            return False
+    elif health == 'YELLOW':
+        shards = "SELECT count(*) FROM sys.shards WHERE \"primary\" = true AND state <> 'STARTED'"
+        if version < (4, 0, 0):
+            if count(shards) > 0:
+                return False
+        elif count("SELECT count(*) FROM sys.health WHERE health NOT IN ('GREEN', 'YELLOW')", shards) > 0:
+            return False
+    if settled:
+        shards = "SELECT count(*) FROM sys.shards WHERE state IN ('INITIALIZING', 'RELOCATING')"
+        if version < (4, 0, 0):
+            if count(shards) > 0:
+                return False
+        elif count("SELECT count(*) FROM sys.allocations WHERE current_state IN ('INITIALIZING', 'RELOCATING')", shards) > 0:
+            return False
+    return True
+
+
+def _print_shards(cursor):
+    print('-' * 70)
+    cursor.execute('SELECT count(*), table_name, state FROM sys.shards GROUP BY 2, 3 ORDER BY 2')
+    rs = cursor.fetchall()
+    print(f'=== {rs}')
+    print('-' * 70)
+
+
+def _cluster_readiness(cursor, tags: Dict[str, Any], num_active, health, settled, num_nodes) -> Callable[[], bool]:
+    """Return the condition of `wait_for_cluster`, shared with its asyncio variant"""
+    version: Optional[Tuple[int, int, int]] = None
+
+    def ready() -> bool:
+        nonlocal version
+        try:
+            if version is None:
+                version = _cluster_version(cursor)
+                tags['version'] = '.'.join(map(str, version))
+            return cluster_ready(cursor, version, num_active, health, settled, num_nodes)
+        except ClientError:
+            # The node isn't ready to answer yet, e.g. it didn't recover the cluster state
+            return False
+    return ready
+
+
+def wait_for_cluster(cursor, num_active=0, health: Optional[str] = 'GREEN', settled=True, timeout=60, num_nodes=0):
+    """Wait until `cluster_ready` holds, see there for the arguments"""
+    try:
+        with spans.span('wait_for_cluster') as tags:
+            poll_until(_cluster_readiness(cursor, tags, num_active, health, settled, num_nodes),
+                       timeout, name='wait_for_cluster')
+    except TimeoutError:
+        if DEBUG:
+            _print_shards(cursor)
+        raise TimeoutError(f"Cluster didn't become ready (nodes {num_nodes}, shards {num_active}, "
+                           f"health {health}) within {timeout}s.") from None
+
+
+def shards_active(cursor, num_active: int = 0) -> bool:
+    """Whether `num_active` shards are started, or all shards if it is 0"""
+    if num_active > 0:
+        cursor.execute(
+            "SELECT count(*) FROM sys.shards where state = 'STARTED'")
+        return int(cursor.fetchone()[0]) == num_active
+    cursor.execute(
+        "SELECT count(*) FROM sys.shards WHERE state != 'STARTED'")
+    return int(cursor.fetchone()[0]) == 0
 
 
 def wait_for_active_shards(cursor, num_active=0, timeout=60, f=1.2):
@@ -93,31 +893,464 @@ def wait_for_active_shards(cursor, num_active=0, timeout=60, f=1.2):
     If `num_active > 0` this will wait until there are `num_active` shards with
     the state `STARTED`
     """
-    waited = 0
-    duration = 0.1
-    while waited < timeout:
-        if num_active > 0:
-            cursor.execute(
-                "SELECT count(*) FROM sys.shards where state = 'STARTED'")
-            if int(cursor.fetchone()[0]) == num_active:
-                return
+    try:
+        with spans.span('wait_for_active_shards', num_active=num_active):
+            poll_until(lambda: shards_active(cursor, num_active), timeout, name='wait_for_active_shards', f=f)
+    except TimeoutError:
+        if DEBUG:
+            _print_shards(cursor)
+        raise TimeoutError(f"Shards {num_active} didn't become active within {timeout}s.") from None
+
+
+class LogPump:
+    """Reads the output of all nodes in a single thread
+
+    cr8 starts a thread per node to read its output. With many nodes these
+    threads compete for the GIL with the test itself; the pump instead waits
+    on all pipes at once and dispatches complete lines to the consumers of
+    the node's monitor.
+
+    The pipes belong to the processes: the pump stops reading at the end of
+    the output or on `unregister`, closing them is left to their owner.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._pending: List[Tuple[str, Any, Any]] = []
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def register(self, monitor: 'PumpedOutputMonitor', proc: subprocess.Popen):
+        self._submit(('add', monitor, proc))
+
+    def unregister(self, proc: subprocess.Popen, timeout: float = 5) -> bool:
+        """Stop reading the output of `proc`, returns once the pump no longer uses its pipe"""
+        done = Event()
+        self._submit(('remove', proc, done))
+        return done.wait(timeout)
+
+    def _submit(self, command: Tuple[str, Any, Any]):
+        with self._lock:
+            # Only the pump thread touches the selector, it picks up the commands after a wakeup
+            self._pending.append(command)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='crate-qa-log-pump', daemon=True)
+                self._thread.start()
+        os.write(self._wakeup_w, b'x')
+
+    def _run(self):
+        encoding = locale.getpreferredencoding(False)
+        while True:
+            for key, _ in self._selector.select():
+                try:
+                    if key.data is None:
+                        self._process_commands(encoding)
+                    else:
+                        self._read(key)
+                except Exception as e:
+                    # The pump must keep reading the output of the other nodes
+                    print_error(f'# Log pump failed: {e!r}')
+                    if key.data is not None:
+                        self._remove(key)
+
+    def _process_commands(self, encoding: str):
+        os.read(self._wakeup_r, 1024)
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for command, target, arg in pending:
+            if command == 'remove':
+                for key in list(self._selector.get_map().values()):
+                    if key.data is not None and key.data[1] is target:
+                        self._remove(key)
+                arg.set()
+                continue
+            monitor, proc = target, arg
+            if proc.stdout is None or proc.stdout.closed:
+                monitor.closed.set()
+                continue
+            fd = proc.stdout.fileno()
+            stale = self._selector.get_map().get(fd)
+            if stale is not None:
+                # The pipe of another process was closed without unregistering it, and its fd got reused
+                self._remove(stale)
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            self._selector.register(fd, selectors.EVENT_READ, [monitor, proc, decoder, ''])
+
+    def _remove(self, key: selectors.SelectorKey):
+        self._selector.unregister(key.fd)
+        key.data[0].closed.set()
+
+    def _read(self, key: selectors.SelectorKey):
+        monitor, proc, decoder, partial = key.data
+        try:
+            data = os.read(key.fd, 64 * 1024)
+        except OSError:
+            # Closed by its owner, whatever is left can't be read anymore
+            data = b''
+        text = partial + decoder.decode(data, final=not data).replace('\r\n', '\n')
+        *lines, rest = text.split('\n')
+        if not data and rest:
+            lines.append(rest)
+            rest = ''
+        key.data[3] = rest
+        for line in lines:
+            monitor.dispatch(line + '\n')
+        if not data:
+            self._remove(key)
+
+
+# `[<timestamp>][<level>][<logger>] [<node>] <message>`
+LOG_LINE_RE = re.compile(r'^\[[^\]]*\]\[(?P<level>[A-Z]+)\s*\](?P<message>.*)')
+
+
+class PumpedOutputMonitor:
+    """A replacement for cr8's OutputMonitor that reads through the shared LogPump
+
+    Lines of `node` are reported as its progress, except for warnings and
+    errors (and their stack traces) it logged before.
+    """
+
+    def __init__(self, pump: LogPump, node: Optional[CrateNode] = None):
+        self.consumers: List[Any] = []
+        self.closed = Event()
+        self.node = node
+        self._pump = pump
+        self._problems: deque = deque(maxlen=16)
+        self._progressing = True
+
+    def start(self, proc: subprocess.Popen):
+        self.closed.clear()
+        self._pump.register(self, proc)
+
+    def _is_progress(self, line: str) -> bool:
+        match = LOG_LINE_RE.match(line)
+        if not match:
+            # Continuation lines, like stack traces, count like the line they belong to
+            return self._progressing
+        if match.group('level') in ('WARN', 'ERROR'):
+            # Timestamps, terms, durations, ... change with every repetition
+            message = re.sub(r'\d+', '#', match.group('message'))
+            self._progressing = message not in self._problems
+            if self._progressing:
+                self._problems.append(message)
         else:
-            cursor.execute(
-                "SELECT count(*) FROM sys.shards WHERE state != 'STARTED'")
-            if int(cursor.fetchone()[0]) == 0:
-                return
-        time.sleep(duration)
-        waited += duration
-        duration *= f
+            self._progressing = True
+        return self._progressing
+
+    def dispatch(self, line: str):
+        if self._is_progress(line):
+            report_progress('log', self.node)
+        for consumer in list(self.consumers):
+            try:
+                if callable(consumer):
+                    consumer(line)
+                else:
+                    consumer.send(line)
+            except Exception as e:
+                # A failing consumer must not stop the output of the other nodes
+                print_error(f'# Log consumer {consumer} failed: {e}')
 
-    if DEBUG:
-        print('-' * 70)
-        print(f'waited: {waited} last duration: {duration} timeout: {timeout}')
-        cursor.execute('SELECT count(*), table_name, state FROM sys.shards GROUP BY 2, 3 ORDER BY 2')
-        rs = cursor.fetchall()
-        print(f'=== {rs}')
-        print('-' * 70)
-    raise TimeoutError(f"Shards {num_active} didn't become active within {timeout}s.")
+
+log_pump = LogPump()
+
+
+class LogBuffer:
+    """Keeps the last lines of a node's output in memory
+
+    Lines which drop out of the buffer are written to a gzip file. `archive`
+    completes the file with the lines still in memory and keeps it, `discard`
+    deletes it.
+    """
+
+    def __init__(self, path: str, max_lines: int = LOG_TAIL_LINES):
+        self.path = path
+        self._lines: deque = deque(maxlen=max_lines)
+        self._spill: Optional[gzip.GzipFile] = None
+        self._archived = False
+        self._lock = Lock()
+
+    def _spill_file(self) -> gzip.GzipFile:
+        if self._spill is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Appending after `archive` adds a new gzip member, which readers concatenate
+            self._spill = gzip.open(self.path, 'ab', compresslevel=1)
+        return self._spill
+
+    def append(self, line: str):
+        with self._lock:
+            if self._archived:
+                self._spill_file().write(line.encode('utf-8', 'replace'))
+            elif len(self._lines) == self._lines.maxlen:
+                self._spill_file().write(self._lines[0].encode('utf-8', 'replace'))
+            self._lines.append(line)
+
+    def tail(self) -> List[str]:
+        with self._lock:
+            return [line.rstrip('\n') for line in self._lines]
+
+    def archive(self) -> str:
+        """Write the complete output into the compressed file and return its path"""
+        with self._lock:
+            if not self._archived:
+                f = self._spill_file()
+                for line in self._lines:
+                    f.write(line.encode('utf-8', 'replace'))
+                self._archived = True
+            if self._spill:
+                self._spill.close()
+                self._spill = None
+            return self.path
+
+    def discard(self):
+        with self._lock:
+            if self._spill:
+                self._spill.close()
+                self._spill = None
+            if not self._archived:
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+
+
+class LogEvent(NamedTuple):
+    name: str
+    node: CrateNode
+    fields: Dict[str, str]
+    line: str
+    time: float
+
+
+class LogMatcher(NamedTuple):
+    """Turns log lines into events
+
+    `needle` is a plain substring every matching line contains, it spares the
+    regular expression for the vast majority of lines.
+    """
+    name: str
+    needle: str
+    pattern: re.Pattern
+
+
+# The messages of the cluster coordination changed with 4.0, both variants are covered
+LOG_MATCHERS = [
+    LogMatcher('node_started', ' started', re.compile(r'\] started\s*$')),
+    LogMatcher('master_elected', 'elected-as-master', re.compile(r'elected-as-master')),
+    LogMatcher('master_changed', 'master', re.compile(
+        r'(?:master node changed \{previous \[[^\]]*\], current \[|new_master |detected_master )'
+        r'\{(?P<master>[^}]+)\}')),
+    LogMatcher('node_joined', 'added {', re.compile(r'added \{\{(?P<node>[^}]+)\}')),
+    LogMatcher('node_left', 'removed {', re.compile(r'removed \{\{(?P<node>[^}]+)\}')),
+    LogMatcher('state_recovered', 'recovered [', re.compile(r'recovered \[(?P<indices>\d+)\] indices into cluster_state')),
+    LogMatcher('health_changed', 'health status changed', re.compile(
+        r'health status changed from \[(?P<previous>\w+)\] to \[(?P<current>\w+)\]')),
+    # Shard starts are only logged at INFO level as reason of a health change
+    LogMatcher('shards_started', 'shards started', re.compile(r'shards started \[(?P<shards>.*?\])\]')),
+]
+
+
+class LogEventBus:
+    """Publishes the events found in the output of nodes
+
+    Every event is kept, so that `wait_for` also finds events which were
+    published before it was called. Use `mark` to only wait for newer events.
+    """
+
+    def __init__(self, matchers: Iterable[LogMatcher] = LOG_MATCHERS):
+        self._matchers = list(matchers)
+        self._condition = Condition()
+        self._consumers: Dict[int, Tuple[CrateNode, Callable[[str], None]]] = {}
+        self._subscribers: List[Callable[[LogEvent], None]] = []
+        self.events: List[LogEvent] = []
+
+    def attach(self, node: CrateNode):
+        consumer = functools.partial(self._consume, node)
+        node.monitor.consumers.append(consumer)
+        self._consumers[id(node)] = (node, consumer)
+
+    def detach(self, node: CrateNode):
+        entry = self._consumers.pop(id(node), None)
+        if entry and entry[1] in node.monitor.consumers:
+            node.monitor.consumers.remove(entry[1])
+
+    def detach_all(self):
+        for node, _ in list(self._consumers.values()):
+            self.detach(node)
+
+    def _consume(self, node: CrateNode, line: str):
+        for matcher in self._matchers:
+            if matcher.needle not in line:
+                continue
+            m = matcher.pattern.search(line)
+            if m:
+                self.publish(LogEvent(matcher.name, node, m.groupdict(), line.rstrip(), time.monotonic()))
+
+    def publish(self, event: LogEvent):
+        with self._condition:
+            self.events.append(event)
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        for subscriber in subscribers:
+            subscriber(event)
+
+    def subscribe(self, callback: Callable[[LogEvent], None]) -> Callable[[], None]:
+        """Call `callback` with every new event, returns a function to unsubscribe"""
+        with self._condition:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._condition:
+                self._subscribers.remove(callback)
+        return unsubscribe
+
+    def mark(self) -> int:
+        with self._condition:
+            return len(self.events)
+
+    def wait_for(self,
+                 name: str,
+                 predicate: Optional[Callable[[LogEvent], bool]] = None,
+                 count: int = 1,
+                 since: int = 0,
+                 timeout: float = 60) -> List[LogEvent]:
+        """Block until `count` events named `name` (and matching `predicate`) were published"""
+        caller = _caller()
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._condition:
+            while True:
+                found = [e for e in self.events[since:] if e.name == name and (predicate is None or predicate(e))]
+                if len(found) >= count:
+                    wait_stats.record(WaitRecord(f'log_event:{name}', caller, time.monotonic() - started, 1, True))
+                    return found[:count]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    wait_stats.record(WaitRecord(f'log_event:{name}', caller, time.monotonic() - started, 1, False))
+                    raise TimeoutError(f'{count} {name} events were not logged within {timeout}s, got {len(found)}')
+                self._condition.wait(remaining)
+
+
+class PortBlock(NamedTuple):
+    """A range of ports leased for the nodes of one cluster
+
+    Node `i` of the cluster listens on `http + i`, `transport + i` and
+    `psql + i`. `debug + i` is reserved for the jdwp agent.
+    """
+    start: int
+
+    @property
+    def http(self) -> int:
+        return self.start
+
+    @property
+    def transport(self) -> int:
+        return self.start + PORTS_PER_PROTOCOL
+
+    @property
+    def psql(self) -> int:
+        return self.start + 2 * PORTS_PER_PROTOCOL
+
+    @property
+    def debug(self) -> int:
+        return self.start + 3 * PORTS_PER_PROTOCOL
+
+    def ports(self) -> range:
+        return range(self.start, self.start + 4 * PORTS_PER_PROTOCOL)
+
+    def node_ports(self, protocol: str) -> range:
+        """The ports of the nodes for 'http', 'transport', 'psql' or 'debug'"""
+        start = getattr(self, protocol)
+        return range(start, start + PORTS_PER_PROTOCOL)
+
+    def node_settings(self, idx: int) -> Dict[str, int]:
+        assert idx < PORTS_PER_PROTOCOL, f"A port block only has ports for {PORTS_PER_PROTOCOL} nodes"
+        return {
+            'http.port': self.http + idx,
+            'transport.tcp.port': self.transport + idx,
+            'psql.port': self.psql + idx,
+        }
+
+
+def _is_port_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(('127.0.0.1', port))
+            return True
+        except OSError:
+            return False
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _update_port_leases(update: Callable[[Dict[str, int]], Any]) -> Any:
+    """ Apply `update` to the leases of all processes while holding the registry lock.
+
+    Leases of processes which no longer exist are dropped.
+    """
+    PORT_REGISTRY.parent.mkdir(parents=True, exist_ok=True)
+    with open(PORT_REGISTRY, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            leases = json.loads(content) if content else {}
+            leases = {start: pid for start, pid in leases.items() if _is_process_alive(pid)}
+            result = update(leases)
+            f.seek(0)
+            f.truncate()
+            json.dump(leases, f)
+            f.flush()
+            return result
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def lease_ports() -> PortBlock:
+    """Lease a block of ports that no other test process on this host uses
+
+    The lease is registered in a file shared by all processes, so that several
+    test processes can run clusters side by side.
+    """
+    def lease(leases: Dict[str, int]) -> PortBlock:
+        for start in range(PORT_RANGE_START, PORT_RANGE_END, 4 * PORTS_PER_PROTOCOL):
+            block = PortBlock(start)
+            if str(start) not in leases and all(_is_port_free(p) for p in block.ports()):
+                leases[str(start)] = os.getpid()
+                return block
+        raise RuntimeError(f"No free port block between {PORT_RANGE_START} and {PORT_RANGE_END}")
+    return _update_port_leases(lease)
+
+
+def release_ports(block: PortBlock):
+    _update_port_leases(lambda leases: leases.pop(str(block.start), None))
+
+
+def subtest_shard(items: Iterable[Any]) -> Iterator[Any]:
+    """Yield the share of `items` that the current test process should test
+
+    The parallel runner (crate.qa.runner) splits the test methods listed in
+    `NodeProvider.SUBTEST_SHARDS` into several processes, each with a
+    different `CRATE_QA_SUBTEST_SHARD=<index>/<count>`. Without the variable
+    all items are yielded.
+    """
+    shard = os.environ.get('CRATE_QA_SUBTEST_SHARD')
+    if not shard:
+        yield from items
+        return
+    index, count = map(int, shard.split('/'))
+    for i, item in enumerate(items):
+        if i % count == index:
+            yield item
 
 
 class VersionDef(NamedTuple):
@@ -125,22 +1358,694 @@ class VersionDef(NamedTuple):
     java_home: Iterable[str]
 
 
+def crate_versions(*paths) -> List[str]:
+    """ Collect the distinct version specs used by (nested) upgrade paths """
+    versions = []
+    for path in paths:
+        for item in path:
+            if isinstance(item, VersionDef):
+                versions.append(item.version)
+            elif isinstance(item, UpgradePath):
+                versions.extend(item)
+            elif isinstance(item, str):
+                versions.append(item)
+            else:
+                versions.extend(crate_versions(item))
+    return list(dict.fromkeys(versions))
+
+
+class FetchTiming(NamedTuple):
+    version: str
+    artifact: str
+    crate_dir: str
+    resolve_seconds: float
+    fetch_seconds: float
+
+    def __str__(self):
+        return (f'{self.version} -> {os.path.basename(self.crate_dir)}: '
+                f'resolve {self.resolve_seconds:.1f}s, download/extract {self.fetch_seconds:.1f}s')
+
+
+class CrateDist(NamedTuple):
+    """ An extracted CrateDB distribution """
+    artifact: str
+    crate_dir: str
+    version: Tuple[int, int, int]
+    resolved_at: float
+
+
+_crate_dists: Dict[str, CrateDist] = {}
+_crate_dists_lock = Lock()
+
+
+def _is_branch(version: str) -> bool:
+    return bool(BRANCH_VERSION_RE.match(version)) or version.startswith('branch:')
+
+
+def _resolve_artifact(version: str) -> str:
+    """ Resolve a version spec to the artifact get_crate downloads or builds """
+    if _is_branch(version):
+        return version
+    return _lookup_uri(version)
+
+
+def _lock_file(name: str):
+    LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return open(LOCKS_DIR / f'{digest}.lock', 'a')
+
+
+def _keep_branch_build(crate_dir: str) -> str:
+    """Return a copy of a branch build that outlives the next branch build
+
+    cr8 extracts a fresh build inside its source checkout, which the next
+    build of another branch wipes with `git clean`. The build tarball is also
+    cached as `builds/<revision>.tar.gz`, so extract that one instead.
+    """
+    crates = Path(_crates_cache()).resolve()
+    src_repo = crates / 'sources_tmp'
+    if not Path(crate_dir).resolve().is_relative_to(src_repo):
+        return crate_dir
+    revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=src_repo, check=True, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, encoding='utf-8').stdout.strip()
+    return _extract_tarball(crates / 'builds' / f'{revision}.tar.gz')
+
+
+def _fetch_artifact(artifact: str) -> str:
+    # cr8 doesn't guard its cache against concurrent extraction, and
+    # all branch builds share one source checkout
+    with _lock_file('build' if _is_branch(artifact) else artifact) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with spans.span('get_crate', version=artifact):
+                crate_dir = get_crate(artifact)
+                if _is_branch(artifact):
+                    crate_dir = _keep_branch_build(crate_dir)
+                return crate_dir
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_version_index() -> Dict[str, CrateDist]:
+    try:
+        with open(VERSION_INDEX) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {
+        spec: CrateDist(e['artifact'], e['crate_dir'], tuple(e['version']), e['resolved_at'])  # type: ignore
+        for spec, e in index.items()
+    }
+
+
+def _update_version_index(version: str, dist: CrateDist):
+    with _lock_file('version-index') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            index = {spec: e._asdict() for spec, e in _read_version_index().items()}
+            index[version] = dist._asdict()
+            tmp = VERSION_INDEX.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp, VERSION_INDEX)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _lookup_version_index(version: str) -> Optional[CrateDist]:
+    """ Return the indexed distribution of a version spec unless it expired
+
+    Concrete versions never expire. In offline mode nothing expires.
+    """
+    dist = _read_version_index().get(version)
+    if dist is None or not os.path.isdir(dist.crate_dir):
+        return None
+    expired = time.time() - dist.resolved_at > VERSION_INDEX_TTL
+    if expired and not OFFLINE and not VERSION_RE.match(version):
+        return None
+    # Keep cr8 from removing the distribution as unused
+    os.utime(dist.crate_dir)
+    return dist
+
+
+def _known_dist(version: str) -> Optional[CrateDist]:
+    """ Return the distribution resolved in this process unless its directory is gone """
+    dist = _crate_dists.get(version)
+    if dist is None or not os.path.isdir(dist.crate_dir):
+        return None
+    return dist
+
+
+def _fetch_dist(version: str, artifact: str) -> CrateDist:
+    crate_dir = _fetch_artifact(artifact)
+    dist = CrateDist(artifact, crate_dir, _extract_version(crate_dir), time.time())
+    _update_version_index(version, dist)
+    return dist
+
+
+def resolve_crate(version: str) -> CrateDist:
+    """Return the extracted CrateDB distribution for a version spec
+
+    Resolved specs are kept in a persistent index for `CRATE_QA_VERSION_INDEX_TTL`
+    seconds, so repeated runs use the same distributions without asking the
+    release feed. With `CRATE_QA_OFFLINE=true` only the index is used.
+    """
+    dist = _known_dist(version)
+    if dist is None:
+        dist = _lookup_version_index(version)
+        if dist is None:
+            if OFFLINE:
+                raise RuntimeError(f"CrateDB {version} is not in the version index {VERSION_INDEX}")
+            dist = _fetch_dist(version, _resolve_artifact(version))
+        with _crate_dists_lock:
+            _crate_dists[version] = dist
+    return dist
+
+
+def fetch_crate(version: str) -> str:
+    return resolve_crate(version).crate_dir
+
+
+def prefetch_crates(versions: Iterable[str], max_workers: int = PREFETCH_WORKERS) -> List[FetchTiming]:
+    """Resolve, download and extract the distributions of all versions concurrently
+
+    Versions that resolve to the same artifact are only fetched once. Call
+    this before starting any cluster, so that `fetch_crate` never has to
+    download a distribution in the middle of a test.
+    """
+    versions = [v for v in dict.fromkeys(versions) if _known_dist(v) is None]
+    if not versions:
+        return []
+
+    def resolve(version: str) -> Tuple[str, Optional[CrateDist], str, float]:
+        started = time.monotonic()
+        dist = _lookup_version_index(version)
+        if dist is not None:
+            return version, dist, dist.artifact, 0.0
+        if OFFLINE:
+            raise RuntimeError(f"CrateDB {version} is not in the version index {VERSION_INDEX}")
+        return version, None, _resolve_artifact(version), time.monotonic() - started
+
+    def fetch(version: str, artifact: str) -> Tuple[CrateDist, float]:
+        started = time.monotonic()
+        return _fetch_dist(version, artifact), time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        resolved = list(executor.map(resolve, versions))
+        fetches = {}
+        dist_versions = {}
+        for version, dist, artifact, _ in resolved:
+            if dist is None and artifact not in fetches:
+                fetches[artifact] = executor.submit(fetch, version, artifact)
+                dist_versions[artifact] = version
+        timings = []
+        for version, dist, artifact, resolve_seconds in resolved:
+            fetch_seconds = 0.0
+            if dist is None:
+                dist, fetch_seconds = fetches[artifact].result()
+                if version != dist_versions[artifact]:
+                    _update_version_index(version, dist)
+            with _crate_dists_lock:
+                _crate_dists[version] = dist
+            timings.append(FetchTiming(version, artifact, dist.crate_dir, resolve_seconds, fetch_seconds))
+    for timing in timings:
+        print(f'# Prefetched {timing}')
+    if fetches:
+        stats = compact_crates([d.crate_dir for d in _read_version_index().values()])
+        print(f'# Compacted CrateDB distributions: {stats}')
+    return timings
+
+
+class CompactionStats(NamedTuple):
+    linked_files: int
+    saved_bytes: int
+
+    def __str__(self):
+        return f'{self.linked_files} duplicate files hardlinked, {self.saved_bytes / 1024 / 1024:.0f}MB saved'
+
+
+def _file_digest(path: str, stat: os.stat_result, digests: Dict[str, Any]) -> str:
+    # Hardlinked files share an inode, so every inode is only hashed once
+    key = f'{stat.st_dev}:{stat.st_ino}'
+    cached = digests.get(key)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, 1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    digests[key] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def compact_crates(crate_dirs: Iterable[str]) -> CompactionStats:
+    """Replace files that are identical across CrateDB distributions with hardlinks
+
+    Most jars and the bundled JDK don't change between patch releases. Sharing
+    them saves disk space and page cache when several versions run at once.
+    Only the read-only parts of the distributions (`lib`, `jdk`, `plugins`)
+    are compacted.
+    """
+    digests_file = CACHE_ROOT / 'crate-tests' / 'file-digests.json'
+    with _lock_file('compact') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(digests_file) as f:
+                    digests = json.load(f)
+            except (OSError, ValueError):
+                digests = {}
+            by_size: Dict[Tuple[int, int], List[Tuple[str, os.stat_result]]] = {}
+            for crate_dir in dict.fromkeys(crate_dirs):
+                for subdir in ('lib', 'jdk', 'plugins'):
+                    for dirpath, _, filenames in os.walk(os.path.join(crate_dir, subdir)):
+                        for filename in filenames:
+                            path = os.path.join(dirpath, filename)
+                            stat = os.lstat(path)
+                            if stat.st_size > 0 and os.path.isfile(path) and not os.path.islink(path):
+                                by_size.setdefault((stat.st_dev, stat.st_size), []).append((path, stat))
+            linked_files = 0
+            saved_bytes = 0
+            for candidates in by_size.values():
+                if len(candidates) < 2:
+                    continue
+                originals: Dict[Tuple[str, int], Tuple[str, os.stat_result]] = {}
+                for path, stat in candidates:
+                    key = (_file_digest(path, stat, digests), stat.st_mode)
+                    original = originals.setdefault(key, (path, stat))
+                    if original[1].st_ino == stat.st_ino:
+                        continue
+                    tmp = f'{path}.{os.getpid()}.link'
+                    os.link(original[0], tmp)
+                    os.replace(tmp, path)
+                    linked_files += 1
+                    if stat.st_nlink == 1:
+                        saved_bytes += stat.st_size
+            digests_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(digests_file, 'w') as f:
+                json.dump(digests, f)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return CompactionStats(linked_files, saved_bytes)
+
+
+class CdsArchive(NamedTuple):
+    """An AppCDS archive of the classes a CrateDB distribution loads on startup
+
+    The first node started for a distribution dumps the archive when it stops,
+    all later nodes map it instead of loading and verifying the classes again.
+    """
+    path: Path
+    mode: str  # one of 'use', 'dump' or 'none'
+
+    def java_opts(self) -> str:
+        # The JVM picked via JAVA_HOME may not know the options, it must still start
+        opts = '-XX:+IgnoreUnrecognizedVMOptions'
+        if self.mode == 'use':
+            return f'{opts} -XX:SharedArchiveFile={self.path}'
+        if self.mode == 'dump':
+            return f'{opts} -XX:ArchiveClassesAtExit={self.path}.dump'
+        return ''
+
+
+def cds_archive(crate_dir: str, java_home: str = '') -> CdsArchive:
+    """Return the AppCDS archive for a CrateDB distribution and JVM
+
+    If the archive doesn't exist yet, only one node (across processes) is
+    allowed to dump it. Dumps are written next to the archive and promoted once
+    complete, so that nodes never map a partially written archive.
+    """
+    key = hashlib.sha1(f'{crate_dir}:{java_home}'.encode('utf-8')).hexdigest()[:12]
+    archive = CDS_ARCHIVES_DIR / f'{os.path.basename(crate_dir)}-{key}.jsa'
+    dump = Path(f'{archive}.dump')
+    claim = Path(f'{archive}.claim')
+    CDS_ARCHIVES_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        stat = dump.stat()
+        # The JVM writes the dump while exiting, give it time to finish
+        if stat.st_size > 0 and time.time() - stat.st_mtime > 30:
+            os.replace(dump, archive)
+            claim.unlink(missing_ok=True)
+    except FileNotFoundError:
+        pass
+    if archive.exists():
+        return CdsArchive(archive, 'use')
+    try:
+        os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return CdsArchive(archive, 'dump')
+    except FileExistsError:
+        try:
+            if time.time() - claim.stat().st_mtime > CDS_CLAIM_TTL:
+                claim.unlink()
+        except FileNotFoundError:
+            pass
+        return CdsArchive(archive, 'none')
+
+
+class CdsStartups:
+    """Collects node startup durations with and without an AppCDS archive"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._durations: Dict[str, Dict[bool, List[float]]] = {}
+
+    def record(self, crate_dir: str, archive: CdsArchive, duration: float):
+        with self._lock:
+            if not self._durations:
+                atexit.register(self.print_report)
+            by_mode = self._durations.setdefault(os.path.basename(crate_dir), {})
+            by_mode.setdefault(archive.mode == 'use', []).append(duration)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Return the mean startup time per distribution and the saving per start"""
+        result = {}
+        with self._lock:
+            for name, by_mode in sorted(self._durations.items()):
+                entry: Dict[str, Any] = {}
+                for with_archive, durations in by_mode.items():
+                    key = 'with_archive' if with_archive else 'without_archive'
+                    entry[key] = {'starts': len(durations), 'mean': sum(durations) / len(durations)}
+                if 'with_archive' in entry and 'without_archive' in entry:
+                    entry['saving'] = entry['without_archive']['mean'] - entry['with_archive']['mean']
+                result[name] = entry
+        return result
+
+    def print_report(self):
+        for name, entry in self.report().items():
+            line = f'# Startup of {name}:'
+            for key in ('without_archive', 'with_archive'):
+                if key in entry:
+                    line += f' {entry[key]["mean"]:.2f}s {key.replace("_", " ")} ({entry[key]["starts"]} starts),'
+            if 'saving' in entry:
+                line += f' {entry["saving"]:.2f}s saved per start'
+            print(line.rstrip(','), file=sys.stderr)
+
+
+cds_startups = CdsStartups()
+
+
+class TimedCrateNode(CrateNode):
+    """A CrateNode which measures how long it takes to start"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_duration: Optional[float] = None
+        self.start_listeners: List[Callable[[float], None]] = []
+        # Set if the node must not be killed even if its data is discarded,
+        # e.g. because it dumps an AppCDS archive on exit
+        self.graceful_stop = False
+
+    def start(self):
+        started = time.monotonic()
+        version = '.'.join(map(str, self.version))
+        with spans.span('start', version=version, node=str(self.settings.get('http.port', ''))):
+            super().start()
+        self.start_duration = time.monotonic() - started
+        for listener in self.start_listeners:
+            listener(self.start_duration)
+
+    def stop(self):
+        """Stop the process, the log pump reads its output up to the end
+
+        CrateNode.stop drains the output with `communicate`, which would read
+        and close the pipe while the pump still uses it.
+        """
+        process = self.process
+        if process and isinstance(self.monitor, PumpedOutputMonitor):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=NODE_STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            # The output ends once all processes holding the pipe exited
+            if not self.monitor.closed.wait(5):
+                log_pump.unregister(process)
+            if process.stdout:
+                process.stdout.close()
+        # The process has exited, this only resets the state of the CrateNode
+        super().stop()
+
+
+def stop_node(node: CrateNode, timeout: float = NODE_STOP_TIMEOUT, discard: bool = False):
+    """Stop a node and kill it if it didn't exit within `timeout` seconds
+
+    With `discard` the node is killed right away, which is only safe if its
+    data directories are not used again.
+    """
+    _invalidate_connections(node)
+    process = node.process
+    if process and process.poll() is None:
+        if discard and not getattr(node, 'graceful_stop', False):
+            process.kill()
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print_error(f'# Node {node.http_url} did not stop within {timeout}s, killing it')
+            process.kill()
+            process.wait()
+    # The process has exited, this releases its output and resets the state of the CrateNode
+    node.stop()
+
+
+def stop_nodes(nodes: Iterable[CrateNode], timeout: float = NODE_STOP_TIMEOUT, discard: bool = False):
+    """Stop nodes concurrently, see `stop_node`"""
+    nodes = list(nodes)
+    if len(nodes) == 1:
+        # Also used by the node pool at exit, when no new threads can be started by executors
+        stop_node(nodes[0], timeout, discard)
+        return
+    if not nodes:
+        return
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = [executor.submit(stop_node, node, timeout, discard) for node in nodes]
+        for future in futures:
+            future.result()
+
+
+class _NodeConnection(NamedTuple):
+    node: CrateNode
+    pid: Optional[int]
+    url: Optional[str]
+    conn: Any
+
+
+class NodeConnections:
+    """Keeps one HTTP (crate client) and one psql connection per node and user
+
+    A connection is only handed out while the node still runs the process it
+    was opened for: connections of nodes which were stopped, restarted or
+    replaced by `NodeProvider.upgrade_node` are closed and opened again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._connections: Dict[Tuple[str, int, Optional[str]], _NodeConnection] = {}
+        _connection_managers.add(self)
+
+    def _get(self, kind: str, node: CrateNode, user: Optional[str], open_conn: Callable[[], Any]) -> Any:
+        key = (kind, id(node), user)
+        pid = node.process.pid if node.process else None
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry and entry.node is node and entry.pid == pid and entry.url == node.http_url:
+                return entry.conn
+            conn = open_conn()
+            self._connections[key] = _NodeConnection(node, pid, node.http_url, conn)
+        if entry:
+            _close_quietly(entry.conn)
+        return conn
+
+    def http(self, node: CrateNode, username: Optional[str] = None, password: Optional[str] = None):
+        """Return a crate client connection to `node`"""
+        return self._get('http', node, username, lambda: connect(
+            node.http_url, username=username, password=password, error_trace=True))
+
+    def psql(self, node: CrateNode, user: str = 'crate', password: Optional[str] = None, dbname: str = 'doc'):
+        """Return a psycopg connection in autocommit mode to `node`"""
+        import psycopg
+        addr = node.addresses.psql
+        return self._get('psql', node, user, lambda: psycopg.connect(
+            host=addr.host, port=addr.port, user=user, password=password, dbname=dbname, autocommit=True))
+
+    def on_all(self,
+               nodes: Iterable[CrateNode],
+               fn: Callable[[CrateNode, Any], Any],
+               username: Optional[str] = None,
+               password: Optional[str] = None) -> List[Any]:
+        """Call `fn(node, connection)` for all nodes in parallel, return the results in the order of `nodes`"""
+        nodes = list(nodes)
+        if not nodes:
+            return []
+
+        def call(node):
+            result = fn(node, self.http(node, username, password))
+            report_progress('query')
+            return result
+
+        with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+            futures = [executor.submit(call, node) for node in nodes]
+            return [f.result() for f in futures]
+
+    def query_all(self, nodes: Iterable[CrateNode], stmt: str, args=None, **kwargs) -> List[List[Any]]:
+        """Run a query on all nodes in parallel, return the rows per node"""
+        def query(node, conn):
+            c = conn.cursor()
+            c.execute(stmt, args)
+            return c.fetchall()
+        return self.on_all(nodes, query, **kwargs)
+
+    def invalidate(self, node: CrateNode):
+        """Close all connections to `node`"""
+        with self._lock:
+            stale = [k for k, e in self._connections.items() if e.node is node]
+            entries = [self._connections.pop(k) for k in stale]
+        for entry in entries:
+            _close_quietly(entry.conn)
+
+    def close(self):
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+        for entry in entries:
+            _close_quietly(entry.conn)
+
+
+_connection_managers: weakref.WeakSet = weakref.WeakSet()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _invalidate_connections(node: CrateNode):
+    for manager in list(_connection_managers):
+        manager.invalidate(node)
+
+
+def _tmp_prefix(pid: Optional[int] = None) -> str:
+    return f'crate-qa-{pid or os.getpid()}-'
+
+
+def _reaper_cmd() -> List[str]:
+    cmd = []
+    if shutil.which('ionice'):
+        # Idle I/O class: only uses the disk when no one else does
+        cmd += ['ionice', '-c', '3']
+    if shutil.which('nice'):
+        cmd += ['nice', '-n', '19']
+    return cmd + ['rm', '-rf', '--']
+
+
+def _reap(paths: List[str]):
+    if not paths:
+        return
+    # A separate session, so that the deletion continues if the tests are interrupted
+    subprocess.Popen(
+        _reaper_cmd() + paths,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def discard_dir(path: str):
+    """Delete a directory without waiting for it
+
+    The directory is renamed into a trash directory on the same file system
+    and deleted by a low priority process in the background.
+    """
+    trash = os.path.join(os.path.dirname(path), TRASH_DIR_NAME)
+    target = os.path.join(trash, f'{os.path.basename(path)}-{gen_id()}')
+    try:
+        os.makedirs(trash, exist_ok=True)
+        os.rename(path, target)
+    except FileNotFoundError:
+        return
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    _reap([target])
+
+
+def _is_orphan(entry: str) -> bool:
+    """Whether a directory was created by `NodeProvider.mkdtemp` of a process which no longer exists"""
+    parts = entry.split('-')
+    if not entry.startswith('crate-qa-') or len(parts) < 3 or not parts[2].isdigit():
+        return False
+    return not _is_process_alive(int(parts[2]))
+
+
+def _dir_size(path: str) -> int:
+    """Return the bytes allocated by the files in a directory"""
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_blocks * 512
+            except OSError:
+                pass
+    return size
+
+
+_reaped_roots: set = set()
+_reaped_roots_lock = Lock()
+
+
+def reap_leftovers(root: str):
+    """Delete what test processes which died before their tearDown left in `root`
+
+    Runs once per process and root. This covers the trash of earlier runs and
+    temporary directories of processes which no longer exist.
+    """
+    with _reaped_roots_lock:
+        if root in _reaped_roots:
+            return
+        _reaped_roots.add(root)
+    trash = os.path.join(root, TRASH_DIR_NAME)
+    try:
+        # Trash of live processes is already being deleted by their reapers
+        _reap([os.path.join(trash, e) for e in os.listdir(trash) if _is_orphan(e)])
+    except OSError:
+        pass
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+    for entry in filter(_is_orphan, entries):
+        discard_dir(os.path.join(root, entry))
+
+
 class CrateCluster:
 
-    def __init__(self, nodes: list[CrateNode]):
+    def __init__(self, nodes: list[CrateNode], ports: Optional[PortBlock] = None):
         self._nodes = nodes
+        # The ports leased for the nodes, if the cluster was created by NodeProvider
+        self.ports = ports
 
-    def start(self):
+    def start(self, wait: bool = False):
+        """Start all nodes, with `wait` also wait until they formed the cluster"""
         threads = []
         for node in self._nodes:
             t = Thread(target=node.start)
             t.start()
             threads.append(t)
-        [t.join() for t in threads]
+        for t in threads:
+            t.join()
+        if wait and len(self._nodes) > 1 and all(node.http_url for node in self._nodes):
+            with connect(self.node().http_url, error_trace=True) as conn:
+                wait_for_cluster(conn.cursor(), health=None, settled=False, num_nodes=len(self._nodes))
 
-    def stop(self):
-        for node in self._nodes:
-            node.stop()
+    def stop(self, discard: bool = False):
+        stop_nodes(self._nodes, discard=discard)
 
     def node(self) -> CrateNode:
         return random.choice(self._nodes)
@@ -164,50 +2069,170 @@ class NodeProvider:
     CRATE_HEAP_SIZE = os.environ.get('CRATE_HEAP_SIZE', '1024m')
     DEBUG = os.environ.get('DEBUG', 'false').lower() == 'true'
 
+    # Used by the parallel runner (crate.qa.runner) to schedule test classes:
+    # the maximum number of nodes running at once, resources like the Minio
+    # server which only one test process can use at a time, and the number of
+    # processes that test methods iterating with `subtest_shard` are split into.
+    NUM_NODES = 1
+    EXCLUSIVE_RESOURCES: Tuple[str, ...] = ()
+    SUBTEST_SHARDS: Dict[str, int] = {}
+
+    # Name of the entry in PROFILES applied to all nodes of the test class,
+    # CRATE_QA_PROFILE overrides it for all classes (e.g. for crate.qa.bench)
+    PROFILE = 'default'
+
+    # Kill the remaining nodes in tearDown instead of shutting them down
+    # gracefully. Only for classes whose nodes only use temporary data directories.
+    DISCARD_ON_TEARDOWN = False
+
+    # Where the data and log paths of nodes are placed: 'disk' or 'memory'
+    # (tmpfs). Memory is used as long as all memory backed directories of a
+    # test stay within STORAGE_BUDGET_MB, further directories fall back to disk.
+    STORAGE_CLASS = 'disk'
+    STORAGE_BUDGET_MB = int(os.environ.get('CRATE_QA_STORAGE_BUDGET_MB', 512))
+
+    # Share one cluster between all tests of the class ('class'), or between
+    # the classes of a module with the same cluster configuration ('module').
+    # Tests get it as `self.cluster` and a schema of their own as `self.schema`,
+    # which is dropped in tearDown. Tests which restart nodes start their own.
+    SHARED_CLUSTER: Optional[str] = None
+    SHARED_CLUSTER_NODES = 1
+    SHARED_CLUSTER_SETTINGS: Dict[str, Any] = {}
+
+    # Provided by unittest.TestCase, which NodeProvider is mixed with
+    id: Callable[[], str]
+
     def __init__(self, *args, **kwargs):
         self.tmpdirs = []
+        self.connections = NodeConnections()
+        self._leased_nodes: List[Tuple['_PooledNode', bool]] = []
         super().__init__(*args, **kwargs)
 
-    def mkdtemp(self, *args) -> str:
-        tmp = tempfile.mkdtemp()
+    def mkdtemp(self, *args, storage: str = 'disk', size: int = 0) -> str:
+        """Create a temporary directory which is removed in tearDown
+
+        With the 'memory' storage class the directory is placed on tmpfs if
+        `size` more bytes fit into the storage budget of the test.
+        """
+        root = None
+        if storage == 'memory' and self._fits_memory_storage(size):
+            root = SHM_DIR
+        reap_leftovers(root or tempfile.gettempdir())
+        tmp = tempfile.mkdtemp(prefix=_tmp_prefix(), dir=root)
         self.tmpdirs.append(tmp)
         return os.path.join(tmp, *args)
 
+    def _fits_memory_storage(self, size: int) -> bool:
+        if not os.path.isdir(SHM_DIR):
+            return False
+        budget = self.STORAGE_BUDGET_MB * 1024 * 1024
+        used = sum(_dir_size(tmp) for tmp in self.tmpdirs if tmp.startswith(SHM_DIR + os.sep))
+        # The rest of the budget must be available, the nodes still write into the directories
+        if used + size > budget or shutil.disk_usage(SHM_DIR).free < budget - used:
+            if self.DEBUG:
+                print(f'# Memory storage budget of {self.STORAGE_BUDGET_MB}MB exhausted, using disk')
+            return False
+        return True
+
+    def _snapshot_data_paths(self, data_paths: List[str]) -> List[str]:
+        """ Copy the data paths of a stopped cluster into new temporary directories.
+
+        The copies can be passed as `data_paths` to `_new_cluster` to continue
+        from the same state without modifying the original data paths.
+        """
+        snapshots = []
+        for path in data_paths:
+            snapshot = self.mkdtemp('data', storage=self.STORAGE_CLASS, size=_dir_size(path))
+            copy_data_dir(path, snapshot)
+            snapshots.append(snapshot)
+        return snapshots
+
+    def _data_paths_from_template(self,
+                                  version: str,
+                                  num_nodes: int,
+                                  template: DataTemplate,
+                                  settings: Optional[Dict[str, Any]] = None,
+                                  env=None) -> List[str]:
+        """ Return fresh data paths for a cluster seeded by `template`.
+
+        The first call for a CrateDB build starts a cluster, seeds it and stores
+        its data paths in the template cache. Later calls only clone the cache.
+        """
+        crate_dir = fetch_crate(version)
+        key = hashlib.sha1(
+            f'{os.path.basename(crate_dir)}-{template.digest(num_nodes, settings or {})}'.encode('utf-8')
+        ).hexdigest()
+        template_dir = DATA_TEMPLATES_DIR / f'{template.name}-{key}'
+        if not template_dir.exists():
+            cluster = self._new_cluster(version, num_nodes, settings=settings, env=env)
+            # The seed data is spread over all nodes
+            cluster.start(wait=True)
+            with connect(cluster.node().http_url, error_trace=True) as conn:
+                template.seed(conn)
+                wait_for_cluster(conn.cursor())
+            cluster.stop()
+            _remove_old_data_templates(DATA_TEMPLATES_DIR)
+            os.makedirs(DATA_TEMPLATES_DIR, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=DATA_TEMPLATES_DIR)
+            for i, node in enumerate(cluster):
+                copy_data_dir(node.data_path, os.path.join(tmp_dir, str(i)))
+            try:
+                os.rename(tmp_dir, template_dir)
+            except OSError:
+                # Another process stored the same template in the meantime
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.utime(template_dir)
+        if self.DEBUG:
+            print(f'# Using data template {template_dir}')
+        return self._snapshot_data_paths([str(template_dir / str(i)) for i in range(num_nodes)])
+
     def _new_cluster(self,
                      version,
                      num_nodes: int,
                      data_paths: Optional[List[str]] = None,
                      settings: Optional[Dict[str, Any]] = None,
                      env=None,
-                     explicit_discovery=True) -> CrateCluster:
-        """ data_paths has 'num_nodes' elements and data_paths[i] stores path of the i-th node. 'None' if called first time."""
+                     explicit_discovery=True,
+                     template: Optional[DataTemplate] = None) -> CrateCluster:
+        """ data_paths has 'num_nodes' elements and data_paths[i] stores path of the i-th node. 'None' if called first time.
+
+        If a `template` is given instead of data_paths, the nodes start with a copy of the template's seed data.
+
+        Without `explicit_discovery` the nodes still find each other on their leased transport ports, but
+        `cluster.initial_master_nodes` isn't set: a new cluster of several nodes can only form with zen discovery
+        (CrateDB < 4.0), later versions need the cluster state in existing data paths.
+        """
         assert hasattr(self, '_new_node'), "NodeProvider must have _new_node method"
         settings = settings or {}
         for port in ['transport.tcp.port', 'http.port', 'psql.port']:
             assert port not in settings, f"Must not define {port} in settings"
+        if template is not None and data_paths is None:
+            data_paths = self._data_paths_from_template(
+                version, num_nodes, template, settings, env)
         cluster_name = gen_id()
+        ports = self._lease_ports()
         s = {
             'cluster.name': cluster_name,
             'gateway.recover_after_nodes': num_nodes,
             'gateway.expected_nodes': num_nodes,
         }
+        if explicit_discovery or num_nodes > 1:
+            s["discovery.seed_hosts"] = ",".join(f"127.0.0.1:{ports.transport + x}" for x in range(num_nodes))
         if explicit_discovery:
-            s["discovery.seed_hosts"] = ",".join(f"127.0.0.1:{4300 + x}" for x in range(num_nodes))
             s["cluster.initial_master_nodes"] = ",".join(f"{cluster_name}-{x}" for x in range(num_nodes))
         s.update(settings)
         nodes = []
         for id in range(num_nodes):
             node_settings = s.copy()
             node_settings['node.name'] = cluster_name + '-' + str(id)
-            if explicit_discovery:
-                node_settings["transport.tcp.port"] = 4300 + id
+            node_settings.update(ports.node_settings(id))
             """ We want to preserve data_paths when we start cluster second time during a test.
             Path is taken from the first start.
             """
             if data_paths is not None:
                 node_settings['path.data'] = data_paths[id]
             nodes.append(self._new_node(version, node_settings, env)[0])
-        return CrateCluster(nodes)
+        return CrateCluster(nodes, ports)
 
     def _new_heterogeneous_cluster(self, versions, settings=None):
         self.assertTrue(hasattr(self, '_new_node'))
@@ -215,51 +2240,85 @@ class NodeProvider:
         for port in ['transport.tcp.port', 'http.port', 'psql.port']:
             self.assertNotIn(port, settings)
         num_nodes = len(versions)
+        ports = self._lease_ports()
+        cluster_name = gen_id()
         s = {
-            'cluster.name': gen_id(),
+            'cluster.name': cluster_name,
             'gateway.recover_after_nodes': num_nodes,
-            'gateway.expected_nodes': num_nodes
+            'gateway.expected_nodes': num_nodes,
+            'discovery.seed_hosts': ",".join(f"127.0.0.1:{ports.transport + x}" for x in range(num_nodes)),
+            'cluster.initial_master_nodes': ",".join(f"{cluster_name}-{x}" for x in range(num_nodes)),
         }
         s.update(settings)
         nodes = []
         for i, version in enumerate(versions):
-            s['node.name'] = f"{s['cluster.name']}-{i}"
-            nodes.append(self._new_node(version, s)[0])
-        return CrateCluster(nodes)
+            node_settings = s.copy()
+            node_settings['node.name'] = f"{cluster_name}-{i}"
+            node_settings.update(ports.node_settings(i))
+            nodes.append(self._new_node(version, node_settings)[0])
+        return CrateCluster(nodes, ports)
 
     def upgrade_node(self, old_node: CrateNode, new_version: str) -> CrateNode:
-        port = int(f"5{old_node.addresses.http.port}")
-        old_node.stop()
-        self._on_stop.remove(old_node)
+        with spans.span('upgrade_node', version=new_version, node=str(old_node.addresses.http.port)):
+            env = self._upgrade_env(old_node, new_version)
+            stop_node(old_node)
+            new_node = self._replacement_node(old_node, new_version, env)
+            mark = self.log_events.mark()
+            new_node.start()
+            self._wait_for_master(new_node, mark)
+            return new_node
+
+    def _wait_for_master(self, node: CrateNode, since: int, timeout: float = 60):
+        """Wait until `node` logged that it joined a master (or became it)
+
+        The node answers HTTP requests before it joined the cluster, its log
+        tells when it did without polling it.
+        """
+        self.log_events.wait_for('master_changed', lambda e: e.node is node, since=since, timeout=timeout)
+
+    def _upgrade_env(self, old_node: CrateNode, new_version: str) -> Dict[str, str]:
+        """Return the environment of the node replacing `old_node`, while it still knows its addresses"""
         settings = getattr(old_node, "_settings", {})
+        if 'http.port' in settings:
+            port = old_node.addresses.http.port + 3 * PORTS_PER_PROTOCOL
+        else:
+            port = int(f"5{old_node.addresses.http.port}")
         env = {}
-        crate_dir = get_crate(new_version)
-        version = _extract_version(crate_dir)
+        version = resolve_crate(new_version).version
         # 5,5 and 5,6 didn't bundle the jdwp module
         if os.environ.get("DEBUGPY_RUNNING", "false") == "true" and (version < (5, 5, 0) or version >= (5, 7, 0)):
             jdwp = f"-agentlib:jdwp=transport=dt_socket,server=y,suspend=n,address={port}"
             env["CRATE_JAVA_OPTS"] = jdwp
-        (new_node, _) = self._new_node(new_version, settings=settings, env=env)
-        new_node.start()
+        return env
+
+    def _replacement_node(self, old_node: CrateNode, new_version: str, env: Dict[str, str]) -> CrateNode:
+        """Return a new node with the settings (and data) of the stopped `old_node`"""
+        self._on_stop.remove(old_node)
+        (new_node, _) = self._new_node(new_version, settings=getattr(old_node, "_settings", {}), env=env)
         return new_node
 
     def _new_node(self, version: str, settings=None, env=None) -> tuple[CrateNode, tuple[int, int, int]]:
-        crate_dir = get_crate(version)
-        version_tuple = _extract_version(crate_dir)
-        s = {
+        dist = resolve_crate(version)
+        crate_dir = dist.crate_dir
+        version_tuple = dist.version
+        profile = self._profile()
+        s: Dict[str, Any] = {
             'cluster.name': 'crate-qa',
         }
+        s.update(profile.settings(version_tuple))
         s.update(settings or {})
         s.update(test_settings(version_tuple))
+        if not any(port in s for port in ['transport.tcp.port', 'http.port', 'psql.port']):
+            s.update(self._lease_ports().node_settings(0))
 
         """ After removal of the node.max_local_storage_nodes in 5.0, every node has it's own path.data generated on node creation.
         However, we don't want to re-generate data path if we create a node based on existing settings, for example
         upgrade_node calls this method with old_node._settings
         """
         if "path.data" not in s:
-            s['path.data'] = self.mkdtemp()
+            s['path.data'] = self.mkdtemp(storage=self.STORAGE_CLASS)
         if "path.logs" not in s:
-            s["path.logs"] = self.mkdtemp()
+            s["path.logs"] = self.mkdtemp(storage=self.STORAGE_CLASS)
 
         s = remove_unsupported_settings(version_tuple, s)
         e = {
@@ -268,6 +2327,13 @@ class NodeProvider:
             'CRATE_HOME': crate_dir,
         }
         e.update(env or {})
+        java_opts = [e.get('CRATE_JAVA_OPTS', '')] + profile.java_opts(version_tuple)
+        archive = None
+        if CDS_ENABLED and version_tuple >= CDS_MIN_VERSION:
+            archive = cds_archive(crate_dir, e.get('JAVA_HOME', os.environ.get('JAVA_HOME', '')))
+            java_opts.append(archive.java_opts())
+        if any(java_opts):
+            e['CRATE_JAVA_OPTS'] = ' '.join(filter(None, java_opts))
 
         if self.DEBUG:
             print(f'# Running CrateDB {version} ({version_tuple}) ...')
@@ -276,51 +2342,155 @@ class NodeProvider:
             e_nice = pformat(e)
             print(f'with environment: {e_nice}')
 
-        n = CrateNode(
+        n = TimedCrateNode(
             crate_dir=crate_dir,
             keep_data=True,
             settings=s,
             env=e,
             java_magic=True,
         )
+        if archive:
+            n.start_listeners.append(functools.partial(cds_startups.record, crate_dir, archive))
+            n.graceful_stop = archive.mode == 'dump'
+        n.monitor = PumpedOutputMonitor(log_pump, n)
         setattr(n, "_settings", s)  # CrateNode does not hold its settings
         self._add_log_consumer(n)
         self._on_stop.append(n)
         return (n, version_tuple)
 
+    def _lease_node(self, version: Optional[str] = None, settings=None, reuse=True) -> CrateNode:
+        """Return a started single node from the node pool
+
+        With `reuse` the node may have been used by an earlier test, and it
+        goes back to the pool in tearDown after its tables have been dropped.
+        Otherwise the node was never leased before, and it is stopped and
+        removed in tearDown, so the test can also restart it.
+        """
+        pooled = node_pool.lease(node_pool_key(self, version, settings), pristine=not reuse)
+        self._leased_nodes.append((pooled, reuse))
+        self._add_log_consumer(pooled.node)
+        return pooled.node
+
+    def _test_nodes(self) -> List[CrateNode]:
+        """The nodes the test started or leased"""
+        return list(self._on_stop) + [pooled.node for pooled, _ in self._leased_nodes]
+
+    def _profile(self) -> Profile:
+        return PROFILES[os.environ.get('CRATE_QA_PROFILE', self.PROFILE)]
+
+    def _lease_ports(self) -> PortBlock:
+        ports = lease_ports()
+        self._port_leases.append(ports)
+        return ports
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()  # type: ignore
+        cls._shared_cluster = None
+        if cls.SHARED_CLUSTER:
+            cls._start_shared_cluster()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._close_shared_cluster()
+        node_pool.cancel_warming()
+        super().tearDownClass()  # type: ignore
+
+    @classmethod
+    def _start_shared_cluster(cls):
+        cls._shared_cluster = shared_cluster(cls)
+        # Class cleanups also run if a subclass overrides tearDownClass without calling super()
+        cls.addClassCleanup(cls._close_shared_cluster)  # type: ignore
+
+    @classmethod
+    def _close_shared_cluster(cls):
+        shared = getattr(cls, '_shared_cluster', None)
+        cls._shared_cluster = None
+        if shared and cls.SHARED_CLUSTER == 'class':
+            shared.close()
+
     def setUp(self):
         self._on_stop = []
         self._log_consumers = []
+        self._port_leases = []
+        self.log_events = LogEventBus()
+        spans.test_id = self.id()
+        self.cluster: Optional[CrateCluster] = None
+        self.schema: Optional[str] = None
+        if self.SHARED_CLUSTER and getattr(type(self), '_shared_cluster', None) is None:
+            # setUpClass was overridden without calling super()
+            type(self)._start_shared_cluster()
+        shared = getattr(type(self), '_shared_cluster', None)
+        if shared:
+            self.cluster = shared.cluster
+            self.schema = f'qa_{gen_id().lower()}'
+            for node in self.cluster:
+                self._add_log_consumer(node)
 
     def tearDown(self):
+        with spans.span('teardown'):
+            if self.cluster and self.schema:
+                reset_node(self.cluster.node(), self.schema)
+            self._release_resources(discard=self.DISCARD_ON_TEARDOWN)
+
+    def shared_connection(self):
+        """Connect to the shared cluster, using the schema of the test by default"""
+        assert self.cluster, "SHARED_CLUSTER is not set"
+        return connect(self.cluster.node().http_url, error_trace=True, schema=self.schema)
+
+    def _release_resources(self, discard: bool):
+        has_error = self._has_error()
+        self.connections.close()
         self._crate_logs_on_failure()
-        self._process_on_stop()
+        self._process_on_stop(discard=discard)
+        self.log_events.detach_all()
+        for pooled, reuse in self._leased_nodes:
+            node_pool.release(pooled, reuse and not has_error)
+        self._leased_nodes.clear()
+        for ports in self._port_leases:
+            release_ports(ports)
+        self._port_leases.clear()
         for tmp in self.tmpdirs:
             if DEBUG:
                 print(f'# Removing temporary directory {tmp}')
-            shutil.rmtree(tmp, ignore_errors=True)
+            discard_dir(tmp)
         self.tmpdirs.clear()
 
-    def _process_on_stop(self):
-        for n in self._on_stop:
-            n.stop()
+    def _process_on_stop(self, discard: bool = False):
+        stop_nodes(self._on_stop, discard=discard)
         self._on_stop.clear()
 
     def _add_log_consumer(self, node: CrateNode):
-        lines: List[str] = []
-        node.monitor.consumers.append(lines.append)
-        self._log_consumers.append((node, lines))
+        name = f'{self.id()}-{len(self._log_consumers)}-{gen_id()}.log.gz'
+        buffer = LogBuffer(os.path.join(LOG_ARCHIVE_DIR, name))
+        node.monitor.consumers.append(buffer.append)
+        self._log_consumers.append((node, buffer))
+        self.log_events.attach(node)
+
+    def _crate_logs(self) -> str:
+        """Return the last lines of the output of all nodes of the test
+
+        The complete output of every node is kept in a compressed file, the
+        message contains the paths.
+        """
+        msg = ''
+        for i, (node, buffer) in enumerate(self._log_consumers):
+            lines = buffer.tail()
+            msg += '-' * 70 + '\n'
+            msg += f'node {i} ({node.crate_dir}), last {len(lines)} lines, full log: {buffer.archive()}\n'
+            msg += '-' * 70 + '\n'
+            msg += '\n'.join(lines) + '\n'
+        return msg
 
     def _crate_logs_on_failure(self):
-        for node, lines in self._log_consumers:
-            node.monitor.consumers.remove(lines.append)
-            if self._has_error():
-                print_error('=' * 70)
-                print_error('CrateDB logs for test ' + self.id())
-                print_error('-' * 70)
-                for line in lines:
-                    print_error(line)
-                print_error('-' * 70)
+        if self._has_error():
+            print_error('=' * 70)
+            print_error('CrateDB logs for test ' + self.id())
+            print_error(self._crate_logs())
+        for node, buffer in self._log_consumers:
+            if buffer.append in node.monitor.consumers:
+                node.monitor.consumers.remove(buffer.append)
+            buffer.discard()
         self._log_consumers.clear()
 
     def _has_error(self) -> bool:
@@ -333,41 +2503,529 @@ class NodeProvider:
         return any(error for (_, error) in outcome.errors)  # type: ignore
 
 
-def assert_busy(assertion, timeout=120, f=2.0):
-    waited = 0
-    sleep_interval_sec = 0.1
-    assertion_error = None
-    while waited < timeout:
+class NodePoolKey(NamedTuple):
+    version: str
+    settings: Tuple[Tuple[str, Any], ...]
+    profile: str
+    storage_class: str
+    heap_size: str
+
+
+def node_pool_key(provider, version: Optional[str] = None, settings=None) -> NodePoolKey:
+    """Return the pool key of a node for a NodeProvider class or instance"""
+    settings = settings or {}
+    for port in ['transport.tcp.port', 'http.port', 'psql.port']:
+        assert port not in settings, f"Must not define {port} in settings"
+    return NodePoolKey(
+        version or provider.CRATE_VERSION,
+        tuple(sorted(settings.items())),
+        os.environ.get('CRATE_QA_PROFILE', provider.PROFILE),
+        provider.STORAGE_CLASS,
+        provider.CRATE_HEAP_SIZE)
+
+
+class _DetachedProvider(NodeProvider):
+    """Owns nodes which outlive a single test, with their directories, ports and logs"""
+
+    def __init__(self, name: str, profile: str, storage_class: str, heap_size: str):
+        super().__init__()
+        self.name = name
+        self.PROFILE = profile
+        self.STORAGE_CLASS = storage_class
+        self.CRATE_HEAP_SIZE = heap_size
+        self._on_stop = []
+        self._log_consumers = []
+        self._port_leases = []
+        self.log_events = LogEventBus()
+
+    def id(self):
+        return self.name
+
+    def discard(self):
+        self._release_resources(discard=True)
+
+
+class _PooledNode(_DetachedProvider):
+    """A node of the pool
+
+    `settings` are the cluster settings the node started with, `reset_node`
+    restores them after a lease.
+    """
+
+    def __init__(self, key: NodePoolKey):
+        super().__init__('node-pool', key.profile, key.storage_class, key.heap_size)
+        self.key = key
+        self.leases = 0
+        self.settings: Dict[str, Any] = {}
         try:
-            assertion()
+            self.node, _ = self._new_node(key.version, dict(key.settings))
+        except BaseException:
+            self.discard()
+            raise
+
+    def start(self):
+        try:
+            self.node.start()
+            self.settings = cluster_settings(self.node)
+        except BaseException:
+            self.discard()
+            raise
+
+    def abort(self):
+        """Kill the node, a `start` in progress fails"""
+        if self.node.process:
+            self.node.process.kill()
+
+    def is_alive(self) -> bool:
+        return bool(self.node.process) and self.node.process.poll() is None
+
+
+def _flat_settings(settings: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    result = {}
+    for name, value in settings.items():
+        if isinstance(value, dict):
+            result.update(_flat_settings(value, f'{prefix}{name}.'))
+        else:
+            result[f'{prefix}{name}'] = value
+    return result
+
+
+def cluster_settings(node: CrateNode) -> Dict[str, Any]:
+    """Return the cluster settings of a node by their full names"""
+    with connect(node.http_url, error_trace=True) as conn:
+        c = conn.cursor()
+        c.execute("SELECT settings FROM sys.cluster")
+        return _flat_settings(c.fetchone()[0])
+
+
+def _reset_cluster(c, settings: Dict[str, Any]):
+    """Drop users, roles and repositories and restore the cluster settings to `settings`"""
+    try:
+        c.execute("SELECT name FROM sys.users WHERE superuser = false")
+    except ProgrammingError:
+        # Before user management
+        pass
+    else:
+        # Their privileges are dropped with them
+        for name, in c.fetchall():
+            c.execute(f'DROP USER "{name}"')
+        try:
+            c.execute("SELECT name FROM sys.roles WHERE name NOT IN (SELECT name FROM sys.users)")
+        except ProgrammingError:
+            # Before roles
+            pass
+        else:
+            for name, in c.fetchall():
+                c.execute(f'DROP ROLE "{name}"')
+    # The snapshots of a repository are no longer listed once it is dropped
+    c.execute("SELECT name FROM sys.repositories")
+    for name, in c.fetchall():
+        c.execute(f'DROP REPOSITORY "{name}"')
+    c.execute("SELECT settings FROM sys.cluster")
+    for name, value in _flat_settings(c.fetchone()[0]).items():
+        initial = settings.get(name)
+        if value == initial:
+            continue
+        if name == 'logger':
+            # Logger levels are listed as [{name, level}, ...]
+            for logger in value:
+                if logger not in (initial or []):
+                    c.execute(f'RESET GLOBAL "logger.{logger["name"]}"')
+        else:
+            c.execute(f'RESET GLOBAL "{name}"')
+
+
+def reset_node(node: CrateNode, schema: Optional[str] = None, settings: Optional[Dict[str, Any]] = None) -> bool:
+    """Drop all tables, views and blob tables of a node, or only those of `schema` and the blob tables
+
+    With `settings`, the cluster settings of a node by their full names, also
+    drop its users, roles and repositories and reset the cluster settings which
+    changed since then.
+
+    Returns False if that failed, the node should not be used again then.
+    """
+    args: Tuple[str, ...] = ()
+    if schema is None:
+        where = "table_schema NOT IN ('sys', 'information_schema', 'pg_catalog')"
+    else:
+        # Blob tables all live in the `blob` schema, none of them outlives a test
+        where, args = "table_schema IN (?, 'blob')", (schema, )
+    try:
+        with connect(node.http_url, error_trace=True) as conn:
+            c = conn.cursor()
+            c.execute(f"""
+                SELECT table_schema, table_name, table_type
+                FROM information_schema.tables
+                WHERE {where}
+            """, args)
+            # Views first, they may depend on the tables
+            for schema, name, table_type in sorted(c.fetchall(), key=lambda r: r[2] != 'VIEW'):
+                if table_type == 'VIEW':
+                    c.execute(f'DROP VIEW "{schema}"."{name}"')
+                elif schema == 'blob':
+                    c.execute(f'DROP BLOB TABLE "{name}"')
+                elif table_type == 'FOREIGN':
+                    c.execute(f'DROP FOREIGN TABLE "{schema}"."{name}"')
+                else:
+                    c.execute(f'DROP TABLE "{schema}"."{name}"')
+            if settings is not None:
+                _reset_cluster(c, settings)
+        return True
+    except ClientError as e:
+        if DEBUG:
+            print(f'# Could not reset node {node.http_url}: {e}')
+        return False
+
+
+class SharedCluster:
+    """A cluster shared by the tests of a class or module
+
+    A single node is leased from the node pool and returned to it at the end
+    of the scope, larger clusters are started for the scope.
+    """
+
+    def __init__(self, provider_cls):
+        num_nodes = provider_cls.SHARED_CLUSTER_NODES
+        settings = provider_cls.SHARED_CLUSTER_SETTINGS
+        key = node_pool_key(provider_cls, settings=settings)
+        self._pooled: Optional[_PooledNode] = None
+        self._owner: Optional[_DetachedProvider] = None
+        if num_nodes == 1:
+            self._pooled = node_pool.lease(key, pristine=False)
+            self.cluster = CrateCluster([self._pooled.node])
             return
-        except AssertionError as e:
-            assertion_error = e
-            time.sleep(sleep_interval_sec)
-            waited += sleep_interval_sec
-            sleep_interval_sec *= f
-    if assertion_error:
-        raise assertion_error
+        self._owner = _DetachedProvider(
+            f'{provider_cls.__module__}.{provider_cls.__name__}', key.profile, key.storage_class, key.heap_size)
+        try:
+            self.cluster = self._owner._new_cluster(key.version, num_nodes, settings=dict(settings))
+            self.cluster.start(wait=True)
+        except BaseException:
+            self._owner.discard()
+            raise
+
+    def close(self):
+        if self._pooled:
+            node_pool.release(self._pooled, reuse=True)
+        if self._owner:
+            self._owner.discard()
+
+
+_module_clusters: Dict[Tuple[str, NodePoolKey, int], SharedCluster] = {}
+
+
+def shared_cluster(provider_cls) -> SharedCluster:
+    """Return the shared cluster for a NodeProvider class, see `NodeProvider.SHARED_CLUSTER`"""
+    if provider_cls.SHARED_CLUSTER == 'class':
+        return SharedCluster(provider_cls)
+    assert provider_cls.SHARED_CLUSTER == 'module', f"Invalid SHARED_CLUSTER: {provider_cls.SHARED_CLUSTER}"
+    key = (
+        provider_cls.__module__,
+        node_pool_key(provider_cls, settings=provider_cls.SHARED_CLUSTER_SETTINGS),
+        provider_cls.SHARED_CLUSTER_NODES,
+    )
+    cluster = _module_clusters.get(key)
+    if cluster is None:
+        cluster = _module_clusters[key] = SharedCluster(provider_cls)
+        # Runs once all tests of the module are done
+        unittest.addModuleCleanup(lambda: _module_clusters.pop(key).close())
+    return cluster
+
+
+class NodePool:
+    """Keeps started single nodes ready for `NodeProvider._lease_node`
+
+    Nodes are kept per version, settings, profile, storage class and heap
+    size. Leasing a node which won't come back starts a replacement in the
+    background while the test runs. At most `size` nodes are kept idle; idle
+    nodes of other keys are stopped once a different key is leased, as the
+    test classes run one after another.
+    """
+
+    def __init__(self, size: int = NODE_POOL_SIZE):
+        self.size = size
+        self._lock = Lock()
+        self._idle: List[_PooledNode] = []
+        self._warming: Dict[NodePoolKey, Any] = {}
+        self._starting: Dict[NodePoolKey, _PooledNode] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+
+    def lease(self, key: NodePoolKey, pristine: bool) -> _PooledNode:
+        with spans.span('lease_node', version=key.version) as tags:
+            pooled = self._take(key, pristine)
+            tags['warm'] = pooled is not None
+            if pooled is None:
+                pooled = _PooledNode(key)
+                pooled.start()
+            pooled.leases += 1
+            if pristine:
+                # This node won't come back
+                self._warm(key)
+            return pooled
+
+    def _take(self, key: NodePoolKey, pristine: bool) -> Optional[_PooledNode]:
+        while True:
+            with self._lock:
+                evicted = [p for p in self._idle if p.key != key]
+                candidates = [p for p in self._idle if p.key == key and (p.leases == 0 or not pristine)]
+                # Prefer used nodes, pristine ones are kept for tests which need them
+                pooled = max(candidates, key=lambda p: p.leases, default=None)
+                self._idle = [p for p in self._idle if p.key == key and p is not pooled]
+                warming = self._warming.get(key)
+            for p in evicted:
+                p.discard()
+            if pooled is not None:
+                if pooled.is_alive():
+                    return pooled
+                pooled.discard()
+                continue
+            if warming is None:
+                return None
+            try:
+                warming.result()
+            except (Exception, SystemExit):
+                # cr8 raises SystemExit if the node didn't start or was aborted
+                return None
+
+    def _warm(self, key: NodePoolKey):
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._closed or key in self._warming:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='node-pool')
+            self._warming[key] = self._executor.submit(self._start, key)
+
+    def _start(self, key: NodePoolKey):
+        with progress_muted():
+            self._start_muted(key)
+
+    def _start_muted(self, key: NodePoolKey):
+        try:
+            pooled = _PooledNode(key)
+            with self._lock:
+                aborted = key not in self._warming
+                if not aborted:
+                    self._starting[key] = pooled
+            if aborted:
+                pooled.discard()
+                return
+            pooled.start()
+        except BaseException:
+            with self._lock:
+                self._warming.pop(key, None)
+                self._starting.pop(key, None)
+            raise
+        self._add(pooled, warmed=True)
+
+    def cancel_warming(self):
+        """Abort the nodes being started in the background
+
+        Called once a test class is done: a replacement for its last pristine
+        lease would only occupy memory, or be stopped right away if the next
+        class uses other nodes.
+        """
+        with self._lock:
+            warming = list(self._warming.values())
+            starting = list(self._starting.values())
+            self._warming.clear()
+            self._starting.clear()
+        for future in warming:
+            future.cancel()
+        for pooled in starting:
+            pooled.abort()
+
+    def _add(self, pooled: _PooledNode, warmed: bool = False):
+        with self._lock:
+            aborted = False
+            if warmed:
+                self._warming.pop(pooled.key, None)
+                aborted = self._starting.pop(pooled.key, None) is not pooled
+            if self._closed or aborted:
+                evicted = pooled
+            elif len(self._idle) < self.size:
+                self._idle.append(pooled)
+                return
+            else:
+                # A pristine node can serve every lease, a used one only those that reuse nodes
+                used = [p for p in self._idle if p.leases > 0]
+                evicted = used[0] if used and pooled.leases == 0 else pooled
+                if evicted is not pooled:
+                    self._idle.remove(evicted)
+                    self._idle.append(pooled)
+        evicted.discard()
+
+    def release(self, pooled: _PooledNode, reuse: bool):
+        """Return a node to the pool, or stop and remove it if it can't be reused"""
+        if reuse and self.size > 0 and pooled.is_alive() and reset_node(pooled.node, settings=pooled.settings):
+            self._add(pooled)
+        else:
+            pooled.discard()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            executor = self._executor
+        self.cancel_warming()
+        if executor:
+            executor.shutdown(wait=True)
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for pooled in idle:
+            pooled.discard()
+
+
+node_pool = NodePool()
+atexit.register(node_pool.close)
+
+
+def assert_busy(assertion, timeout=120, f=2.0):
+    """Call `assertion` until it doesn't raise an AssertionError anymore"""
+    poll_until(lambda: assertion() or True, timeout, name='assert_busy', interval=0.1, max_interval=2.0, f=f)
 
 
 class FunctionTimeoutError(Exception):
     pass
 
 
-def timeout(seconds=10, error_message="timed out!"):
-    def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise FunctionTimeoutError(error_message)
+class _WatchdogAbort(FunctionTimeoutError):
+    """Raised asynchronously in the watched thread, replaced by a FunctionTimeoutError with the reason"""
+
+
+_watchdogs: weakref.WeakSet = weakref.WeakSet()
 
+
+_progress_state = thread_local()
+
+
+def report_progress(source: str, node: Optional[CrateNode] = None):
+    """Tell the active watchdogs that the test made progress
+
+    Progress of a `node` only counts for the watchdogs watching that node.
+    """
+    if getattr(_progress_state, 'muted', False):
+        return
+    for watchdog in list(_watchdogs):
+        watchdog.progress(source, node)
+
+
+@contextlib.contextmanager
+def progress_muted():
+    """Don't report the progress of the current thread, e.g. of work in the background"""
+    _progress_state.muted = True
+    try:
+        yield
+    finally:
+        _progress_state.muted = False
+
+
+class Watchdog:
+    """Aborts the code in a `with` block that runs too long or stopped making progress
+
+    Progress is reported with `report_progress`: output of the `nodes` (but
+    not warnings and errors they keep repeating), every finished span
+    (starts, waits, upgrades, ...), successful polls, inserted batches,
+    written data files, rows imported by a running COPY FROM and queries
+    through `NodeConnections.on_all` count.
+    If there was none for `stall_timeout` seconds (None: only
+    the `timeout` applies), the watchdog dumps the Python thread stacks and,
+    through SIGQUIT, the JVM thread stacks of the `nodes` into the node logs,
+    kills the nodes and raises FunctionTimeoutError in the watched thread.
+    Killing the nodes also ends queries the thread is blocked in.
+
+    Unlike SIGALRM, this works in any thread.
+    """
+
+    def __init__(self,
+                 timeout: float,
+                 stall_timeout: Optional[float] = None,
+                 nodes: Callable[[], Iterable[CrateNode]] = lambda: (),
+                 name: str = 'watchdog'):
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.nodes = nodes
+        self.name = name
+        self.reason: Optional[str] = None
+        self._last_progress = time.monotonic()
+        self._last_source = 'start'
+        self._stopped = Event()
+        self._thread_id: Optional[int] = None
+        self._monitor: Optional[Thread] = None
+
+    def progress(self, source: str, node: Optional[CrateNode] = None):
+        if node is not None and not any(n is node for n in self.nodes()):
+            return
+        self._last_progress = time.monotonic()
+        self._last_source = source
+
+    def __enter__(self):
+        self._thread_id = threading_get_ident()
+        self._deadline = time.monotonic() + self.timeout
+        self.progress('start')
+        self._monitor = Thread(target=self._watch, name=f'{self.name}-watchdog', daemon=True)
+        self._monitor.start()
+        _watchdogs.add(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _watchdogs.discard(self)
+        self._stopped.set()
+        assert self._monitor
+        self._monitor.join()
+        if self.reason is None:
+            return False
+        # Clear the exception if it wasn't delivered before the block ended
+        assert self._thread_id is not None
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self._thread_id), None)
+        raise FunctionTimeoutError(self.reason) from (None if exc_type is _WatchdogAbort else exc)
+
+    def _watch(self):
+        interval = min(1.0, self.stall_timeout / 10 if self.stall_timeout else 1.0)
+        while not self._stopped.wait(interval):
+            now = time.monotonic()
+            if now >= self._deadline:
+                self._abort(f'{self.name} timed out after {self.timeout}s')
+                return
+            idle = now - self._last_progress
+            if self.stall_timeout and idle >= self.stall_timeout:
+                self._abort(f'{self.name} made no progress for {idle:.0f}s, last progress: {self._last_source}')
+                return
+
+    def _abort(self, reason: str):
+        self.reason = reason
+        print_error(f'# {reason}, dumping thread stacks')
+        faulthandler.dump_traceback(file=sys.stderr, all_threads=True)
+        nodes = [n for n in self.nodes() if n.process and n.process.poll() is None]
+        for node in nodes:
+            # The JVM prints the stacks of its threads to stdout, they end up in the node logs
+            node.process.send_signal(signal.SIGQUIT)
+        if nodes:
+            self._stopped.wait(2)
+        for node in nodes:
+            node.process.kill()
+        assert self._thread_id is not None
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(
+            ctypes.c_ulong(self._thread_id), ctypes.py_object(_WatchdogAbort))
+
+
+def timeout(seconds=10, error_message="timed out!", stall_timeout: Optional[float] = None):
+    """Decorate a function to raise FunctionTimeoutError if it runs too long
+
+    See `Watchdog` for `stall_timeout`. If the function is a method of a
+    NodeProvider, the watchdog dumps the stacks of its nodes and kills them.
+    """
+    def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
+            provider = args[0] if args and isinstance(args[0], NodeProvider) else None
+            nodes = provider._test_nodes if provider else (lambda: ())
             try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
+                with Watchdog(seconds, stall_timeout, nodes, name=func.__name__):
+                    return func(*args, **kwargs)
+            except FunctionTimeoutError as e:
+                raise FunctionTimeoutError(f'{error_message} ({e})') from None
 
         return wrapper
 
@@ -1,13 +1,14 @@
 import unittest
 import gzip
 from typing import Dict, Any
-from crate.qa.tests import NodeProvider, wait_for_active_shards
+from crate.qa.tests import DataTemplate, NodeProvider, wait_for_active_shards
 from crate.client import connect
 from urllib.request import urlopen
 import json
 
 
-def init_data(c):
+def init_data(conn):
+    c = conn.cursor()
     c.execute(
         """
         create function foo(int)
@@ -27,6 +28,11 @@ def init_data(c):
     c.execute("refresh table tparted")
 
 
+# The primaries and replicas of tbl and tparted on two nodes
+NUM_SHARDS = 8
+HOTFIX_DATA = DataTemplate('hotfix-downgrades', init_data)
+
+
 def fetch_versions() -> Dict[str, Any]:
     with urlopen('https://cratedb.com/releases.json') as r:
         if r.headers.get('Content-Encoding') == 'gzip':
@@ -38,6 +44,9 @@ def fetch_versions() -> Dict[str, Any]:
 
 class HotfixDowngradeTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 2
+    DISCARD_ON_TEARDOWN = True
+
     def _run_downgrades(self, node):
         major, feature, hotfix = node.version
         for i in range(hotfix - 1, -1, -1):
@@ -50,28 +59,27 @@ class HotfixDowngradeTest(NodeProvider, unittest.TestCase):
 
                 with connect(node.http_url, error_trace=True) as conn:
                     c = conn.cursor()
-                    wait_for_active_shards(c, 8)
+                    wait_for_active_shards(c, NUM_SHARDS)
                     c.execute('SELECT x FROM tbl')
                     xs = [row[0] for row in c.fetchall()]
                     self.assertEqual(xs, [10])
 
-    def test_can_downgrade_latest_testing_within_hotfix_versions(self):
-        cluster = self._new_cluster('latest-testing', 2)
+    def _start_with_data(self, version: str):
+        cluster = self._new_cluster(version, 2, template=HOTFIX_DATA)
         cluster.start()
         node = cluster.node()
         with connect(node.http_url, error_trace=True) as conn:
-            init_data(conn.cursor())
+            wait_for_active_shards(conn.cursor(), NUM_SHARDS)
+        return cluster, node
 
+    def test_can_downgrade_latest_testing_within_hotfix_versions(self):
+        cluster, node = self._start_with_data('latest-testing')
         self._run_downgrades(node)
-        cluster.stop()
+        cluster.stop(discard=True)
 
     def test_can_downgrade_unreleased_testing_branch_within_hotfix_versions(self):
         versions = fetch_versions()
         version = versions["testing"]["version"]
         major, minor, hotfix = version.split(".", maxsplit=3)
-        cluster = self._new_cluster(f"{major}.{minor}", 2)
-        cluster.start()
-        node = cluster.node()
-        with connect(node.http_url, error_trace=True) as conn:
-            init_data(conn.cursor())
+        _, node = self._start_with_data(f"{major}.{minor}")
         self._run_downgrades(node)
@@ -44,6 +44,8 @@ def _fdt_size(data_path):
 
 class PartitionStorageTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 3
+
     def test_partition_formats_across_versions(self):
         with self.subTest(repr(UPGRADE_PATH)):
             try:
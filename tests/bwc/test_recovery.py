@@ -1,11 +1,10 @@
 import unittest
 
-from cr8.run_crate import get_crate, _extract_version
 from crate.client import connect
 import random
 from random import sample
 
-from crate.qa.tests import NodeProvider, insert_data, UpgradePath, assert_busy
+from crate.qa.tests import NodeProvider, insert_data, UpgradePath, assert_busy, crate_versions, prefetch_crates, resolve_crate
 
 UPGRADE_PATHS = [
     UpgradePath('4.2.x', '4.3.x'),
@@ -42,6 +41,12 @@ class RecoveryTest(NodeProvider, unittest.TestCase):
     """
 
     NUMBER_OF_NODES = 3
+    NUM_NODES = NUMBER_OF_NODES
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        prefetch_crates(crate_versions(UPGRADE_PATHS, UPGRADE_PATHS_FROM_43))
 
     def _assert_num_docs_by_node_id(self, conn, schema, table_name, node_id, expected_count):
         c = conn.cursor()
@@ -85,8 +90,7 @@ class RecoveryTest(NodeProvider, unittest.TestCase):
             self.assertEqual(local_checkpoint, max_seq_no)
 
     def _fetch_version_tuple(self, version: str) -> tuple:
-        crate_dir = get_crate(version)
-        return _extract_version(crate_dir)
+        return resolve_crate(version).version
 
     def _upgrade_cluster(self, cluster, version: str, nodes: int) -> None:
         assert nodes <= len(cluster._nodes)
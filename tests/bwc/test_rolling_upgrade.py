@@ -7,7 +7,21 @@ from crate.client.exceptions import ProgrammingError
 from cr8.run_crate import CrateNode, wait_until
 from crate.qa.minio_svr import MinioServer, _is_up
 
-from crate.qa.tests import NodeProvider, insert_data, wait_for_active_shards, UpgradePath, assert_busy
+from crate.qa.tests import (
+    NodeProvider,
+    NodeConnections,
+    PortBlock,
+    insert_data,
+    copy_data,
+    UPGRADE_DATASET_ROWS,
+    wait_for_active_shards,
+    wait_for_cluster,
+    UpgradePath,
+    assert_busy,
+    subtest_shard,
+    crate_versions,
+    prefetch_crates,
+)
 
 ROLLING_UPGRADES_V5 = (
     UpgradePath('5.9.x', '5.10.x'),
@@ -34,6 +48,16 @@ ROLLING_UPGRADES_V6 = (
 
 class RollingUpgradeTest(NodeProvider, unittest.TestCase):
 
+    # 3 nodes plus the remote cluster
+    NUM_NODES = 4
+    SUBTEST_SHARDS = {'test_rolling_upgrade_5_to_6': 5}
+    PROFILE = 'fast'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        prefetch_crates(crate_versions(ROLLING_UPGRADES_V5, ROLLING_UPGRADES_V6))
+
     def test_rolling_upgrade_5_to_5(self):
         print("")  # force newline for first print
         for path in ROLLING_UPGRADES_V5:
@@ -47,7 +71,7 @@ class RollingUpgradeTest(NodeProvider, unittest.TestCase):
 
     def test_rolling_upgrade_5_to_6(self):
         print("")  # force newline for first print
-        for path in ROLLING_UPGRADES_V6:
+        for path in subtest_shard(ROLLING_UPGRADES_V6):
             print(f"From {path.from_version}")
             with self.subTest(repr(path)):
                 try:
@@ -94,42 +118,40 @@ class RollingUpgradeTest(NodeProvider, unittest.TestCase):
                 remote_cluster.start()
                 remote_node = remote_cluster.node()
                 with connect(remote_node.http_url, error_trace=True) as remote_conn:
-                    new_shards = init_foreign_data_wrapper_data(conn, remote_conn, node.addresses.psql.port, remote_node.addresses.psql.port)
+                    new_shards = init_foreign_data_wrapper_data(conn, remote_conn, node.addresses.psql.port, remote_node.addresses.psql.port, cluster.ports, remote_cluster.ports)
                     expected_active_shards += new_shards
                     if node.version >= (5, 10, 0):
-                        new_shards = init_logical_replication_data(self, conn, remote_conn, node.addresses.transport.port, remote_node.addresses.transport.port, expected_active_shards)
+                        new_shards = init_logical_replication_data(self, conn, remote_conn, node.addresses.transport.port, remote_node.addresses.transport.port, cluster.ports, remote_cluster.ports, expected_active_shards)
                         expected_active_shards += new_shards
 
         for idx, node in enumerate(cluster):
             # Enforce an old version node be a handler to make sure that an upgraded node can serve 'select *' from an old version node.
             # Otherwise upgraded node simply requests N-1 columns from old version with N columns and it always works.
             # Was a regression for 5.7 <-> 5.8
-            with connect(node.http_url, error_trace=True) as old_node_conn:
-                c = old_node_conn.cursor()
-                c.execute("SELECT * from sys.nodes")
-                res = c.fetchall()
-                self.assertEqual(len(res), 3)
+            c = self.connections.http(node).cursor()
+            c.execute("SELECT * from sys.nodes")
+            res = c.fetchall()
+            self.assertEqual(len(res), 3)
 
             print(f"    upgrade node {idx} to {path.to_version}")
             new_node = self.upgrade_node(node, path.to_version)
+            # Before picking a node of the cluster, the stopped one must be replaced
+            cluster[idx] = new_node
 
             # Connect with crate user first and wait for shards to ensure recovery is finished
-            with connect(cluster.node().http_url, error_trace=True) as conn:
-                c = conn.cursor()
-                wait_for_active_shards(c)
+            c = self.connections.http(cluster.node()).cursor()
+            wait_for_cluster(c)
 
             # Run a query as a user created on an older version (ensure user is read correctly from cluster state, auth works, etc)
-            with connect(cluster.node().http_url, username='arthur', password='secret', error_trace=True) as custom_user_conn:
-                c = custom_user_conn.cursor()
-                wait_for_active_shards(c)
-                c.execute("SELECT 1")
-                # has no privilege
-                with self.assertRaises(ProgrammingError):
-                    c.execute("EXPLAIN SELECT * FROM doc.t1")
-                # has privilege
-                c.execute("EXPLAIN SELECT * FROM doc.v1")
+            c = self.connections.http(cluster.node(), username='arthur', password='secret').cursor()
+            wait_for_active_shards(c)
+            c.execute("SELECT 1")
+            # has no privilege
+            with self.assertRaises(ProgrammingError):
+                c.execute("EXPLAIN SELECT * FROM doc.t1")
+            # has privilege
+            c.execute("EXPLAIN SELECT * FROM doc.v1")
 
-            cluster[idx] = new_node
             with connect(new_node.http_url, error_trace=True) as conn:
                 c = conn.cursor()
                 new_shards = self._test_queries_on_new_node(idx, c, node, new_node, nodes, shards, expected_active_shards)
@@ -357,6 +379,8 @@ def init_data(conn: Connection, version: tuple[int, int, int], shards: int, repl
     c.execute("deny dql on table doc.t1 to arthur")
     c.execute("CREATE VIEW doc.v1 AS SELECT type, title, value FROM doc.t1")
     insert_data(conn, 'doc', 't1', 1000)
+    if UPGRADE_DATASET_ROWS:
+        copy_data(conn, 'doc', 't1', UPGRADE_DATASET_ROWS, seed=1)
     c.execute("INSERT INTO doc.t1 (type, value, title, author) VALUES (1, 1, 'matchMe title', {name='no match name'})")
     c.execute("INSERT INTO doc.t1 (type, value, title, author) VALUES (2, 2, 'no match title', {name='matchMe name'})")
     c.execute("INSERT INTO doc.t1 (title, author, o) VALUES ('prefix_check', {\"dyn_empty_array\" = []}, {\"dyn_ignored_subcol\" = 'hello'})")
@@ -402,8 +426,8 @@ def init_data(conn: Connection, version: tuple[int, int, int], shards: int, repl
     return new_shards
 
 
-def init_foreign_data_wrapper_data(local_conn: Connection, remote_conn: Connection, local_psql_port: int, remote_psql_port: int) -> int:
-    assert 5430 <= local_psql_port <= 5440 and 5430 <= remote_psql_port <= 5440
+def init_foreign_data_wrapper_data(local_conn: Connection, remote_conn: Connection, local_psql_port: int, remote_psql_port: int, local_ports: PortBlock, remote_ports: PortBlock) -> int:
+    assert local_psql_port in local_ports.node_ports('psql') and remote_psql_port in remote_ports.node_ports('psql')
 
     c = local_conn.cursor()
     rc = remote_conn.cursor()
@@ -443,8 +467,8 @@ def test_foreign_data_wrapper(self, local_conn: Connection, remote_conn: Connect
     self.assertEqual(c.fetchall()[0][0], count + 1)
 
 
-def init_logical_replication_data(self, local_conn: Connection, remote_conn: Connection, local_transport_port: int, remote_transport_port: int, local_active_shards: int) -> int:
-    assert 4300 <= local_transport_port <= 4310 and 4300 <= remote_transport_port <= 4310
+def init_logical_replication_data(self, local_conn: Connection, remote_conn: Connection, local_transport_port: int, remote_transport_port: int, local_ports: PortBlock, remote_ports: PortBlock, local_active_shards: int) -> int:
+    assert local_transport_port in local_ports.node_ports('transport') and remote_transport_port in remote_ports.node_ports('transport')
 
     c = local_conn.cursor()
     c.execute("create table doc.x (a int) clustered into 1 shards with (number_of_replicas=0)")
@@ -499,6 +523,9 @@ def num_docs_rx(cursor):
 
 class RollingUpgradeOidTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 4
+    EXCLUSIVE_RESOURCES = ('minio',)
+
     def setUp(self):
         super().setUp()
         self.minio = MinioServer()
@@ -530,9 +557,9 @@ class RollingUpgradeOidTest(NodeProvider, unittest.TestCase):
             remote_cluster.start()
             remote_node = remote_cluster.node()
             with connect(remote_node.http_url, error_trace=True) as remote_conn:
-                new_shards = init_foreign_data_wrapper_data(conn, remote_conn, node.addresses.psql.port, remote_node.addresses.psql.port)
+                new_shards = init_foreign_data_wrapper_data(conn, remote_conn, node.addresses.psql.port, remote_node.addresses.psql.port, cluster.ports, remote_cluster.ports)
                 expected_active_shards += new_shards
-                new_shards = init_logical_replication_data(self, conn, remote_conn, node.addresses.transport.port, remote_node.addresses.transport.port, expected_active_shards)
+                new_shards = init_logical_replication_data(self, conn, remote_conn, node.addresses.transport.port, remote_node.addresses.transport.port, cluster.ports, remote_cluster.ports, expected_active_shards)
                 expected_active_shards += new_shards
 
         with connect(node.http_url, error_trace=True) as conn:
@@ -557,39 +584,37 @@ class RollingUpgradeOidTest(NodeProvider, unittest.TestCase):
             new_node = self.upgrade_node(node, path.to_version)
             cluster_nodes[idx] = new_node
 
-            with connect(new_node.http_url, error_trace=True) as conn:
-                c = conn.cursor()
-                wait_for_active_shards(c)
+            wait_for_active_shards(self.connections.http(new_node).cursor())
 
-                test_snapshot_oids(self, cluster_nodes)
-                test_table_oids(self, cluster_nodes)
+            test_snapshot_oids(self, cluster_nodes)
+            test_table_oids(self, cluster_nodes)
 
 
 def test_snapshot_oids(self, cluster):
     expected_oid = -1439880087
-    is_master_on_6_3 = master_on_6_3(cluster)
+    is_master_on_6_3 = master_on_6_3(cluster, self.connections)
 
     for idx, node in enumerate(cluster):
-        with connect(node.http_url, error_trace=True) as conn:
-            c = conn.cursor()
+        conn = self.connections.http(node)
+        c = conn.cursor()
 
-            restored_table_name = "s1"
-            c.execute("RESTORE SNAPSHOT repo.snapshot ALL WITH (wait_for_completion = true)")
-            c.execute("SELECT oid FROM pg_catalog.pg_class WHERE relname = ?", [restored_table_name])
-            restored_oid = c.fetchone()[0]
+        restored_table_name = "s1"
+        c.execute("RESTORE SNAPSHOT repo.snapshot ALL WITH (wait_for_completion = true)")
+        c.execute("SELECT oid FROM pg_catalog.pg_class WHERE relname = ?", [restored_table_name])
+        restored_oid = c.fetchone()[0]
 
-            if node.version >= (6, 3, 0) and is_master_on_6_3:
-                self.assertTrue(
-                    restored_oid != 0 and restored_oid != expected_oid,
-                    f"When the master node and the current node is upgraded, restored table '{restored_table_name}' is expected to be assigned and diff from legacy OidHash but got '{restored_oid}'"
-                )
-            else:
-                self.assertEqual(
-                    restored_oid, expected_oid,
-                    f"When the master node or the current node is not upgraded, restored table '{restored_table_name}' is expected to return '{expected_oid}', but got '{restored_oid}'"
-                )
+        if node.version >= (6, 3, 0) and is_master_on_6_3:
+            self.assertTrue(
+                restored_oid != 0 and restored_oid != expected_oid,
+                f"When the master node and the current node is upgraded, restored table '{restored_table_name}' is expected to be assigned and diff from legacy OidHash but got '{restored_oid}'"
+            )
+        else:
+            self.assertEqual(
+                restored_oid, expected_oid,
+                f"When the master node or the current node is not upgraded, restored table '{restored_table_name}' is expected to return '{expected_oid}', but got '{restored_oid}'"
+            )
 
-            c.execute(f"DROP TABLE doc.{restored_table_name}")
+        c.execute(f"DROP TABLE doc.{restored_table_name}")
 
 
 def test_table_oids(self, cluster):
@@ -608,47 +633,49 @@ def test_table_oids(self, cluster):
         'q2': 1473960846,
     }
 
-    is_master_on_6_3 = master_on_6_3(cluster)
-
-    for idx, node in enumerate(cluster):
-        with connect(node.http_url, error_trace=True) as conn:
-            current_oids_dict = get_table_oids(conn)
+    is_master_on_6_3 = master_on_6_3(cluster, self.connections)
 
-            # Test tables created before 6.3
-            for table_name, actual_oid in current_oids_dict.items():
-                expected_oid = table_oid_hash.get(table_name)
-                self.assertEqual(
-                    actual_oid, expected_oid,
-                    f"Table '{table_name}' created before 6.3 expected to return {expected_oid}, got {actual_oid}"
-                )
+    # Reading the OIDs of the tables created before 6.3 doesn't change anything, do it on all nodes at once
+    oids_by_node = self.connections.on_all(cluster, lambda node, conn: get_table_oids(conn))
 
-            # Test tables created on 6.3
-            c = conn.cursor()
-            table_name = f"q{idx}"
-            c.execute(f"CREATE TABLE {table_name} (a int)")
-            c.execute("SELECT oid FROM pg_catalog.pg_class WHERE relname = ?", [table_name])
-            new_oid = c.fetchone()[0]
+    for idx, node in enumerate(cluster):
+        conn = self.connections.http(node)
+        current_oids_dict = oids_by_node[idx]
 
+        # Test tables created before 6.3
+        for table_name, actual_oid in current_oids_dict.items():
             expected_oid = table_oid_hash.get(table_name)
+            self.assertEqual(
+                actual_oid, expected_oid,
+                f"Table '{table_name}' created before 6.3 expected to return {expected_oid}, got {actual_oid}"
+            )
 
-            if node.version >= (6, 3, 0) and is_master_on_6_3:
-                self.assertTrue(
-                    new_oid != 0 and new_oid != expected_oid,
-                    f"When the master node and the current node is upgraded, table '{table_name}' created on 6.3 is expected to be assigned and diff from legacy OidHash but got '{new_oid}'"
-                )
-            else:
-                self.assertEqual(
-                    new_oid, expected_oid,
-                    f"When the master node or the current node is not upgraded, table '{table_name}' created on 6.3 is expected to return '{expected_oid}', but got '{new_oid}'"
-                )
-
-            c.execute(f"DROP TABLE {table_name}")
-
-
-def master_on_6_3(cluster) -> bool:
-    with connect(cluster[0].http_url, error_trace=True) as conn:
+        # Test tables created on 6.3
         c = conn.cursor()
-        c.execute("SELECT version['number'] FROM sys.nodes WHERE is_master = TRUE")
-        master_version_str = c.fetchone()[0]
-        master_version = tuple(map(int, master_version_str.split('.')))
-        return (6, 3, 0) <= master_version
+        table_name = f"q{idx}"
+        c.execute(f"CREATE TABLE {table_name} (a int)")
+        c.execute("SELECT oid FROM pg_catalog.pg_class WHERE relname = ?", [table_name])
+        new_oid = c.fetchone()[0]
+
+        expected_oid = table_oid_hash.get(table_name)
+
+        if node.version >= (6, 3, 0) and is_master_on_6_3:
+            self.assertTrue(
+                new_oid != 0 and new_oid != expected_oid,
+                f"When the master node and the current node is upgraded, table '{table_name}' created on 6.3 is expected to be assigned and diff from legacy OidHash but got '{new_oid}'"
+            )
+        else:
+            self.assertEqual(
+                new_oid, expected_oid,
+                f"When the master node or the current node is not upgraded, table '{table_name}' created on 6.3 is expected to return '{expected_oid}', but got '{new_oid}'"
+            )
+
+        c.execute(f"DROP TABLE {table_name}")
+
+
+def master_on_6_3(cluster, connections: NodeConnections) -> bool:
+    c = connections.http(cluster[0]).cursor()
+    c.execute("SELECT version['number'] FROM sys.nodes WHERE is_master = TRUE")
+    master_version_str = c.fetchone()[0]
+    master_version = tuple(map(int, master_version_str.split('.')))
+    return (6, 3, 0) <= master_version
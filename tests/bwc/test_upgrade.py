@@ -1,10 +1,11 @@
 import os
+import time
 import shutil
 import threading
 import unittest
 from datetime import datetime, UTC
 from uuid import uuid4
-from typing import NamedTuple, Iterable, Tuple
+from typing import Any, Dict, List, NamedTuple, Iterable, Optional, Tuple
 from io import BytesIO
 
 from cr8.run_crate import wait_until
@@ -15,14 +16,23 @@ from crate.qa.tests import (
     VersionDef,
     CrateCluster,
     NodeProvider,
-    wait_for_active_shards,
+    wait_for_cluster,
     insert_data,
+    copy_data,
+    UPGRADE_DATASET_ROWS,
+    STALL_TIMEOUT,
+    Watchdog,
     gen_id,
-    prepare_env, timeout, assert_busy,
+    prepare_env, assert_busy, subtest_shard,
+    crate_versions, prefetch_crates,
 )
 
 from crate.qa.minio_svr import MinioServer, _is_up
 
+# Seconds every upgrade path may take from its first version to its end,
+# steps shared by several paths count for each of them
+UPGRADE_PATH_TIMEOUT = 1800
+
 UPGRADE_PATHS = (
     (
         VersionDef('5.2.x', []),
@@ -159,29 +169,65 @@ def get_test_paths():
             yield versions
 
 
+class UpgradeStep:
+    """ A version hop in the upgrade tree.
+
+    All upgrade paths that start with the same sequence of versions share the
+    steps for that sequence, so that it only needs to be run once.
+    """
+
+    def __init__(self, version_def: VersionDef):
+        self.version_def = version_def
+        self.children: Dict[str, 'UpgradeStep'] = {}
+        self.is_path_end = False
+
+
+def get_test_tree() -> List[UpgradeStep]:
+    """
+    Merge the upgrade paths from `get_test_paths` into one tree per start version.
+    """
+    roots: Dict[str, UpgradeStep] = {}
+    for versions in get_test_paths():
+        step = roots.setdefault(versions[0].version, UpgradeStep(versions[0]))
+        for version_def in versions[1:]:
+            step = step.children.setdefault(version_def.version, UpgradeStep(version_def))
+        step.is_path_end = True
+    return list(roots.values())
+
+
 class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 3
+    SUBTEST_SHARDS = {'test_upgrade_paths': 4}
+    PROFILE = 'fast'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        prefetch_crates(crate_versions(UPGRADE_PATHS))
+
     CLUSTER_SETTINGS = {
         'cluster.name': gen_id(),
         "transport.netty.worker_count": 16,
     }
 
     def test_upgrade_paths(self):
-        for path in get_test_paths():
+        for root in subtest_shard(get_test_tree()):
             try:
                 self.setUp()
-                self._test_upgrade_path(path, nodes=3)
+                self._test_upgrade_tree(root, nodes=3)
             finally:
                 self.tearDown()
 
-    def _test_upgrade_path(self, versions: Tuple[VersionDef, ...], nodes: int):
-        """ Test upgrade path across specified versions.
+    def _test_upgrade_tree(self, root: UpgradeStep, nodes: int):
+        """ Test all upgrade paths starting with the version of `root`.
 
         Creates a blob and regular table in first version and inserts a record,
         then goes through all subsequent versions - each time verifying that a
-        few simple selects work.
+        few simple selects work. Where upgrade paths diverge, the data paths of
+        the cluster are snapshotted, so that the common prefix is only run once.
         """
-        version_def = versions[0]
+        version_def = root.version_def
         timestamp = datetime.now(UTC).isoformat(timespec='seconds')
         print(f"\n{timestamp} Start version: {version_def.version}")
         env = prepare_env(version_def.java_home)
@@ -189,20 +235,12 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
             version_def.version, nodes, settings=self.CLUSTER_SETTINGS, env=env)
         paths = [node.data_path for node in cluster.nodes()]
         try:
-            self._do_upgrade(cluster, nodes, paths, versions)
+            digest, elapsed = self._path_step(0, f'{version_def.version} setup', self._create_data, cluster, nodes, root)
+            self._upgrade_along_tree(root, 0, nodes, digest, paths, [], elapsed)
         except Exception as e:
-            msg = ""
             msg = "\nLogs\n"
             msg += "==============\n"
-            for i, node in enumerate(cluster.nodes()):
-                msg += f"-------------- node: {i}\n"
-                logs_path = node.logs_path
-                cluster_name = node.cluster_name
-                logfile = os.path.join(logs_path, cluster_name + ".log")
-                with open(logfile, "r") as f:
-                    logs = f.read()
-                    msg += logs
-                msg += "\n"
+            msg += self._crate_logs()
             raise Exception(msg).with_traceback(e.__traceback__)
         finally:
             cluster_name = cluster.nodes()[0].cluster_name
@@ -213,16 +251,23 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
                     f.truncate()
                     f.close()
 
-    @timeout(1800)
-    def _do_upgrade(self,
-                    cluster: CrateCluster,
-                    nodes: int,
-                    paths: list[str],
-                    versions: Tuple[VersionDef, ...]):
+    def _path_step(self, elapsed: float, name: str, step, *args, **kwargs) -> Tuple[Any, float]:
+        """ Run one step of the upgrade paths passing through it
+
+        The step may take what is left of `UPGRADE_PATH_TIMEOUT` after the
+        `elapsed` seconds of the previous steps. Returns the result of the
+        step and the seconds elapsed including it.
+        """
+        started = time.monotonic()
+        with Watchdog(UPGRADE_PATH_TIMEOUT - elapsed, STALL_TIMEOUT, self._test_nodes, name=name):
+            result = step(*args, **kwargs)
+        return result, elapsed + time.monotonic() - started
+
+    def _create_data(self, cluster: CrateCluster, nodes: int, root: UpgradeStep) -> str:
         cluster.start()
         with connect(cluster.node().http_url, error_trace=True) as conn:
-            assert_busy(lambda: self.assert_nodes(conn, nodes))
             c = conn.cursor()
+            wait_for_cluster(c, num_nodes=nodes)
 
             c.execute(CREATE_ANALYZER)
             c.execute(CREATE_DOC_TABLE)
@@ -237,24 +282,60 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
                     INSERT INTO t1 (id, text) VALUES (0, 'Phase queue is foo!')
                 ''')
             insert_data(conn, 'doc', 't1', 10)
+            if UPGRADE_DATASET_ROWS:
+                copy_data(conn, 'doc', 't1', UPGRADE_DATASET_ROWS, seed=1)
             c.execute(CREATE_BLOB_TABLE)
             assert_busy(lambda: self.assert_green(conn, 'blob', 'b1'))
-            run_selects(c, versions[0].version)
+            run_selects(c, root.version_def.version)
             container = conn.get_blob_container('b1')
             digest = container.put(BytesIO(b'sample data'))
 
             assert_busy(lambda: self.assert_green(conn, 'blob', 'b1'))
             self.assertIsNotNone(container.get(digest))
 
-        accumulated_dynamic_column_names: list[str] = []
         self._process_on_stop()
-        for idx, version_def in enumerate(versions[1:]):
+        return digest
+
+    def _upgrade_along_tree(self,
+                            step: UpgradeStep,
+                            idx: int,
+                            nodes: int,
+                            digest: str,
+                            paths: list[str],
+                            accumulated_dynamic_column_names: list[str],
+                            elapsed: float):
+        """ Continue all upgrade paths passing through `step`.
+
+        `paths` hold the data of the stopped cluster after upgrading to the
+        version of `step`. Every branch except the last one continues on a
+        snapshot of the data paths, the last one re-uses them. `elapsed` is
+        the time the paths spent to get there.
+        """
+        branches: list[Optional[UpgradeStep]] = list(step.children.values())
+        if step.is_path_end:
+            branches.insert(0, None)
+        for i, branch in enumerate(branches):
+            if i < len(branches) - 1:
+                branch_paths = self._snapshot_data_paths(paths)
+                branch_column_names = list(accumulated_dynamic_column_names)
+            else:
+                branch_paths = paths
+                branch_column_names = accumulated_dynamic_column_names
             timestamp = datetime.now(UTC).isoformat(timespec='seconds')
-            print(f"{timestamp} Upgrade to: {version_def.version}")
-            self.assert_data_persistence(idx, version_def, nodes, digest, paths, accumulated_dynamic_column_names)
-
-        # restart with latest version
-        self.assert_data_persistence(idx, version_def, nodes, digest, paths, accumulated_dynamic_column_names)
+            if branch is None:
+                # restart with latest version
+                print(f"{timestamp} Restart: {step.version_def.version}")
+                # Nothing continues on these data paths, the nodes can be killed
+                self._path_step(
+                    elapsed, f'{step.version_def.version} restart', self.assert_data_persistence,
+                    idx - 1, step.version_def, nodes, digest, branch_paths, branch_column_names, discard=True)
+            else:
+                print(f"{timestamp} Upgrade {step.version_def.version} to: {branch.version_def.version}")
+                _, branch_elapsed = self._path_step(
+                    elapsed, f'upgrade to {branch.version_def.version}', self.assert_data_persistence,
+                    idx, branch.version_def, nodes, digest, branch_paths, branch_column_names)
+                self._upgrade_along_tree(
+                    branch, idx + 1, nodes, digest, branch_paths, branch_column_names, branch_elapsed)
 
     def assert_data_persistence(self,
                                 idx: int,
@@ -262,15 +343,15 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
                                 nodes: int,
                                 digest: str,
                                 paths: list[str],
-                                accumulated_dynamic_column_names: list[str]):
+                                accumulated_dynamic_column_names: list[str],
+                                discard: bool = False):
         env = prepare_env(version_def.java_home)
         version = version_def.version
         cluster = self._new_cluster(version, nodes, data_paths=paths, settings=self.CLUSTER_SETTINGS, env=env)
         cluster.start()
         with connect(cluster.node().http_url, error_trace=True) as conn:
-            assert_busy(lambda: self.assert_nodes(conn, nodes))
             cursor = conn.cursor()
-            wait_for_active_shards(cursor, 0)
+            wait_for_cluster(cursor, num_nodes=nodes)
             version = version_def.version.replace(".", "_")
             cursor.execute(CREATE_DOC_TABLE.replace(
                 "CREATE TABLE t1 (",
@@ -315,7 +396,7 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
                     'INSERT INTO doc.parted (id, version, cols) values (?, ?, ?)',
                     args
                 )
-        self._process_on_stop()
+        self._process_on_stop(discard=discard)
 
     def assert_green(self, conn: Connection, schema: str, table_name: str):
         c = conn.cursor()
@@ -324,14 +405,11 @@ class StorageCompatibilityTest(NodeProvider, unittest.TestCase):
         self.assertNotIsInstance(response, type(None))
         self.assertEqual(response[0], 'GREEN')
 
-    def assert_nodes(self, conn: Connection, num_nodes: int):
-        c = conn.cursor()
-        c.execute("select count(*) from sys.nodes")
-        self.assertEqual(c.fetchone()[0], num_nodes)
-
 
 class MetaDataCompatibilityTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 3
+
     CLUSTER_SETTINGS = {
         'license.enterprise': 'true',
         'lang.js.enabled': 'true',
@@ -416,6 +494,7 @@ class MetaDataCompatibilityTest(NodeProvider, unittest.TestCase):
 
 
 class DefaultTemplateMetaDataCompatibilityTest(NodeProvider, unittest.TestCase):
+    NUM_NODES = 3
     CLUSTER_ID = gen_id()
 
     CLUSTER_SETTINGS = {
@@ -485,6 +564,9 @@ class DefaultTemplateMetaDataCompatibilityTest(NodeProvider, unittest.TestCase):
 
 class SnapshotCompatibilityTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 3
+    EXCLUSIVE_RESOURCES = ('minio',)
+
     CREATE_REPOSITORY = '''
 CREATE REPOSITORY r1 TYPE S3
 WITH (access_key = 'minio',
@@ -553,6 +635,8 @@ protocol = 'http')
 
 class PreOidsFetchValueTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 3
+
     def test_pre_oid_references(self):
         cluster = self._new_cluster('5.4.x', 3)
         cluster.start()
@@ -37,8 +37,7 @@ class PyODBCTestCase(NodeProvider, unittest.TestCase):
         super().tearDown()
 
     def test_basic_statements(self):
-        (node, _) = self._new_node(self.CRATE_VERSION)
-        node.start()
+        node = self._lease_node()
 
         with open_db_connection(self.connection_str(node)) as cursor:
             cursor.execute("SELECT name FROM sys.cluster")
@@ -23,7 +23,7 @@ option which goes along like this::
 import os
 import asyncpg
 import unittest
-from crate.qa.tests import NodeProvider
+from crate.qa.aio import AsyncNodeProvider
 
 
 async def basic_queries(test, conn):
@@ -103,17 +103,18 @@ async def exec_queries_pooled(test, uri):
     await pool.close()
 
 
-class AsyncpgTestCase(NodeProvider, unittest.IsolatedAsyncioTestCase):
+class AsyncpgTestCase(AsyncNodeProvider, unittest.IsolatedAsyncioTestCase):
+
+    SHARED_CLUSTER = None if "CRATEDB_URI" in os.environ else 'class'
 
     def ensure_cratedb(self):
         if "CRATEDB_URI" in os.environ:
             crate_psql_url = os.environ["CRATEDB_URI"]
         else:
-            (node, _) = self._new_node(self.CRATE_VERSION)
-            node.start()
-            psql_addr = node.addresses.psql
+            psql_addr = self.cluster.node().addresses.psql
             crate_address = f'{psql_addr.host}:{psql_addr.port}'
-            crate_psql_url = f'postgres://crate@{crate_address}/doc'
+            # The database is the default schema
+            crate_psql_url = f'postgres://crate@{crate_address}/{self.schema}'
         return crate_psql_url
 
     def setUp(self):
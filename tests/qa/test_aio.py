@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+import threading
+
+from crate.qa.aio import assert_busy, poll_until
+from crate.qa.tests import wait_stats
+
+
+class PollUntilTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coroutine_conditions_run_on_the_loop(self):
+        threads = []
+        results = iter([False, False, 'ready'])
+
+        async def condition():
+            threads.append(threading.get_ident())
+            return next(results)
+
+        self.assertEqual(await poll_until(condition, timeout=5, interval=0.001), 'ready')
+        self.assertEqual(set(threads), {threading.get_ident()})
+        self.assertTrue(wait_stats.records[-1].caller.startswith('test_aio.py:'))
+
+    async def test_blocking_conditions_run_in_executor(self):
+        threads = []
+
+        def condition():
+            threads.append(threading.get_ident())
+            return len(threads) == 2
+
+        self.assertTrue(await poll_until(condition, timeout=5, interval=0.001))
+        self.assertNotIn(threading.get_ident(), threads)
+
+    async def test_waits_concurrently(self):
+        started = asyncio.get_running_loop().time()
+        deadline = started + 0.3
+
+        async def later():
+            return asyncio.get_running_loop().time() >= deadline
+
+        await asyncio.gather(*(poll_until(later, timeout=5, interval=0.05, max_interval=0.05) for _ in range(5)))
+        self.assertLess(asyncio.get_running_loop().time() - started, 1)
+
+    async def test_timeout(self):
+        async def never():
+            return None
+
+        with self.assertRaisesRegex(TimeoutError, 'within 0.1s'):
+            await poll_until(never, timeout=0.1, interval=0.01)
+
+    async def test_assert_busy_raises_last_assertion(self):
+        calls = []
+
+        def assertion():
+            calls.append(1)
+            assert len(calls) > 100, f'only {len(calls)} calls'
+
+        with self.assertRaisesRegex(AssertionError, 'only'):
+            await assert_busy(assertion, timeout=0.3)
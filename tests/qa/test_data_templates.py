@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import functools
+import unittest
+
+from crate.qa.tests import DataTemplate
+
+
+def seed_rows(conn, rows=10):
+    conn.cursor().execute('INSERT INTO t (x) SELECT * FROM generate_series(1, ?)', (rows, ))
+
+
+def seeding(rows):
+    def seed(conn):
+        seed_rows(conn, rows)
+    return seed
+
+
+class DigestTest(unittest.TestCase):
+
+    def test_nodes_and_settings_count(self):
+        template = DataTemplate('rows', seed_rows)
+        digest = template.digest(1, {'a': 1})
+        self.assertEqual(digest, DataTemplate('rows', seed_rows).digest(1, {'a': 1}))
+        self.assertNotEqual(digest, template.digest(2, {'a': 1}))
+        self.assertNotEqual(digest, template.digest(1, {'a': 2}))
+        self.assertNotEqual(digest, DataTemplate('other', seed_rows).digest(1, {'a': 1}))
+
+    def test_seed_arguments_count(self):
+        self.assertEqual(DataTemplate('rows', seeding(5)).digest(1, {}), DataTemplate('rows', seeding(5)).digest(1, {}))
+        self.assertNotEqual(DataTemplate('rows', seeding(5)).digest(1, {}), DataTemplate('rows', seeding(6)).digest(1, {}))
+        partial = DataTemplate('rows', functools.partial(seed_rows, rows=5))
+        self.assertEqual(partial.digest(1, {}), DataTemplate('rows', functools.partial(seed_rows, rows=5)).digest(1, {}))
+        self.assertNotEqual(partial.digest(1, {}), DataTemplate('rows', functools.partial(seed_rows, rows=6)).digest(1, {}))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tarfile
+import unittest
+import tempfile
+import subprocess
+from pathlib import Path
+from unittest import mock
+
+from crate.qa.tests import CrateDist, _keep_branch_build, resolve_crate
+
+
+class BranchBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.crates = Path(tmp.name).resolve()
+        patcher = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': str(self.crates)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self) -> str:
+        src_repo = self.crates / 'sources_tmp'
+        src_repo.mkdir()
+        run = {'cwd': src_repo, 'check': True, 'capture_output': True}
+        subprocess.run(['git', 'init', '-q'], **run)
+        subprocess.run(['git', '-c', 'user.name=qa', '-c', 'user.email=qa@localhost',
+                        'commit', '-q', '--allow-empty', '-m', 'build'], **run)
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], encoding='utf-8', **run).stdout.strip()
+        (self.crates / 'builds').mkdir()
+        with tarfile.open(self.crates / 'builds' / f'{revision}.tar.gz', 'w:gz') as t:
+            folder = tarfile.TarInfo('crate-6.2.0-SNAPSHOT')
+            folder.type = tarfile.DIRTYPE
+            folder.mode = 0o755
+            t.addfile(folder)
+            content = b'#!/bin/sh\n'
+            info = tarfile.TarInfo('crate-6.2.0-SNAPSHOT/bin/crate')
+            info.size = len(content)
+            t.addfile(info, io.BytesIO(content))
+        return str(src_repo / 'app' / 'build' / 'distributions' / 'crate-6.2.0-SNAPSHOT')
+
+    def test_build_is_extracted_out_of_the_checkout(self):
+        crate_dir = _keep_branch_build(self.build())
+        self.assertEqual(crate_dir, str(self.crates / 'builds' / 'crate-6.2.0-SNAPSHOT'))
+        self.assertTrue(os.path.isfile(os.path.join(crate_dir, 'bin', 'crate')))
+
+    def test_cached_builds_are_kept(self):
+        crate_dir = str(self.crates / 'builds' / 'crate-6.2.0-SNAPSHOT')
+        self.assertEqual(_keep_branch_build(crate_dir), crate_dir)
+
+
+class ResolveCrateTest(unittest.TestCase):
+
+    def test_removed_distribution_is_fetched_again(self):
+        gone = CrateDist('6.2', '/nonexistent/crate-6.2.0', (6, 2, 0), 0.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            fetched = CrateDist('6.2', tmp, (6, 2, 0), 0.0)
+            with mock.patch.dict('crate.qa.tests._crate_dists', {'6.2': gone}), \
+                    mock.patch('crate.qa.tests._lookup_version_index', return_value=None), \
+                    mock.patch('crate.qa.tests._fetch_dist', return_value=fetched) as fetch_dist:
+                self.assertEqual(resolve_crate('6.2'), fetched)
+                self.assertEqual(resolve_crate('6.2'), fetched)
+        fetch_dist.assert_called_once_with('6.2', '6.2')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import json
+import unittest
+import tempfile
+from pathlib import Path
+
+from cr8.insert_fake_data import Column
+from crate.qa.fake_data import HAS_NUMPY, ColumnarGenerator, _csv_value, _generate_column, np, write_data_file
+
+
+def rows(offset, size):
+    return [[i, f'name {i}', i % 2 == 0] for i in range(offset, offset + size)]
+
+
+class WriteDataFileTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def test_json_lines(self):
+        path = os.path.join(self.tmp, 'data.json')
+        write_data_file(path, 'json', ['id', 'name', 'flag'], rows, offset=5, size=7, batch_size=3)
+        with open(path) as f:
+            written = [json.loads(line) for line in f]
+        self.assertEqual([r['id'] for r in written], list(range(5, 12)))
+        self.assertEqual(written[0], {'id': 5, 'name': 'name 5', 'flag': False})
+        self.assertEqual(os.listdir(self.tmp), ['data.json'])
+
+    def test_csv(self):
+        path = os.path.join(self.tmp, 'data.csv')
+        write_data_file(path, 'csv', ['id', 'name', 'flag'], rows, offset=0, size=2)
+        with open(path, newline='') as f:
+            self.assertEqual(list(csv.reader(f)), [
+                ['id', 'name', 'flag'],
+                ['0', 'name 0', 'true'],
+                ['1', 'name 1', 'false'],
+            ])
+
+    def test_csv_rejects_nested_values(self):
+        self.assertEqual(_csv_value(3), 3)
+        with self.assertRaisesRegex(ValueError, 'use JSON'):
+            _csv_value({'a': 1})
+
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy is not installed')
+class ColumnarGeneratorTest(unittest.TestCase):
+
+    COLUMNS = [
+        Column('id', 'bigint', None),
+        Column('x', 'integer', None),
+        Column('ts', 'timestamp with time zone', None),
+        Column('flag', 'boolean', None),
+    ]
+
+    def test_seed_determines_rows(self):
+        first = ColumnarGenerator(self.COLUMNS, seed=1).batch(100, 50)
+        self.assertEqual(first, ColumnarGenerator(self.COLUMNS, seed=1).batch(100, 50))
+        self.assertNotEqual(first, ColumnarGenerator(self.COLUMNS, seed=2).batch(100, 50))
+        self.assertEqual([r[0] for r in first], list(range(101, 151)))
+
+    def test_cached_batches_are_reused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = Path(tmp)
+            generated = ColumnarGenerator(self.COLUMNS, seed=1, cache_dir=cache_dir).batch(0, 20)
+            [key_dir] = list(cache_dir.iterdir())
+            self.assertTrue((key_dir / '0-20' / 'columns.json').exists())
+            self.assertEqual(ColumnarGenerator(self.COLUMNS, seed=1, cache_dir=cache_dir).batch(0, 20), generated)
+
+    def test_timestamp_arrays_are_generated_per_cell(self):
+        rng = np.random.default_rng(1)
+        self.assertIsNone(_generate_column(Column('ts', 'timestamp with time zone_array', None), rng, 0, 10))
+        self.assertEqual(len(_generate_column(Column('ts', 'timestamp without time zone', None), rng, 0, 10)), 10)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from crate.client.exceptions import ConnectionError as ClientConnectionError, ProgrammingError
+from crate.qa.tests import _insert_batch
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ReadTimeoutError
+
+SHARDS_UNAVAILABLE = 'UnavailableShardsException[[doc][1] primary shard is not active]'
+DUPLICATE_KEY = 'DuplicateKeyException[A document with the same primary key exists already]'
+
+
+def connection_error(reason):
+    """The error the crate client raises once the last server failed with `reason`"""
+    error = ClientConnectionError('No more Servers available')
+    error.__context__ = MaxRetryError(None, '/_sql', reason)
+    return error
+
+
+def refused():
+    return connection_error(NewConnectionError(None, 'Connection refused'))
+
+
+def timed_out():
+    return connection_error(ReadTimeoutError(None, '/_sql', 'Read timed out'))
+
+
+class Cursor:
+    """Answers bulk requests with the prepared responses, recording the sent rows"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def executemany(self, stmt, rows):
+        self.requests.append(list(rows))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class Connection:
+
+    def __init__(self, *responses):
+        self.cursor_ = Cursor(responses)
+
+    def cursor(self):
+        return self.cursor_
+
+
+@mock.patch('crate.qa.tests.time.sleep')
+class InsertBatchTest(unittest.TestCase):
+
+    def test_transient_rejections_are_retried(self, sleep):
+        conn = Connection(
+            [{'rowcount': 1}, {'rowcount': -2, 'error_message': SHARDS_UNAVAILABLE}, {'rowcount': 1}],
+            [{'rowcount': 1}])
+        self.assertEqual(_insert_batch(conn, 'INSERT', [1, 2, 3]), (1, 0))
+        self.assertEqual(conn.cursor_.requests, [[1, 2, 3], [2]])
+
+    def test_duplicate_keys_fail_at_once(self, sleep):
+        conn = Connection([
+            {'rowcount': -2, 'error': {'code': 4091, 'message': DUPLICATE_KEY}},
+            {'rowcount': -2},
+            {'rowcount': 1},
+        ])
+        self.assertEqual(_insert_batch(conn, 'INSERT', [1, 2, 3]), (0, 2))
+        self.assertEqual(len(conn.cursor_.requests), 1)
+        sleep.assert_not_called()
+
+    def test_rows_failing_until_the_last_retry(self, sleep):
+        rejected = [{'rowcount': -2, 'error_message': SHARDS_UNAVAILABLE}]
+        conn = Connection(*[rejected] * 3)
+        self.assertEqual(_insert_batch(conn, 'INSERT', [1], retries=2), (2, 1))
+
+    def test_request_errors(self, sleep):
+        conn = Connection(refused(), ProgrammingError(SHARDS_UNAVAILABLE), [{'rowcount': 1}])
+        self.assertEqual(_insert_batch(conn, 'INSERT', [1]), (2, 0))
+
+        conn = Connection(ProgrammingError('SQLParseException[line 1:1: mismatched input]'))
+        with self.assertRaises(ProgrammingError):
+            _insert_batch(conn, 'INSERT', [1])
+
+        conn = Connection(*[refused()] * 2)
+        with self.assertRaises(ClientConnectionError):
+            _insert_batch(conn, 'INSERT', [1], retries=1)
+
+    def test_received_requests_are_not_sent_again(self, sleep):
+        for error in (timed_out(), ClientConnectionError('503 Server Error')):
+            conn = Connection(error, [{'rowcount': 1}])
+            with self.assertRaises(ClientConnectionError):
+                _insert_batch(conn, 'INSERT', [1])
+            self.assertEqual(len(conn.cursor_.requests), 1)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import unittest
+import tempfile
+
+from crate.qa.tests import LogBuffer
+
+
+class LogBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'logs', 'node.log.gz')
+
+    def read(self):
+        with gzip.open(self.path, 'rt') as f:
+            return f.read().splitlines()
+
+    def test_tail_is_bounded(self):
+        buffer = LogBuffer(self.path, max_lines=3)
+        for i in range(5):
+            buffer.append(f'line {i}\n')
+        self.assertEqual(buffer.tail(), ['line 2', 'line 3', 'line 4'])
+
+    def test_archive_contains_all_lines_in_order(self):
+        buffer = LogBuffer(self.path, max_lines=3)
+        for i in range(5):
+            buffer.append(f'line {i}\n')
+        self.assertEqual(buffer.archive(), self.path)
+        self.assertEqual(self.read(), [f'line {i}' for i in range(5)])
+
+        # Lines of a restarted node are appended to the archive
+        buffer.append('line 5\n')
+        buffer.archive()
+        self.assertEqual(self.read(), [f'line {i}' for i in range(6)])
+
+    def test_discard_removes_spilled_lines(self):
+        buffer = LogBuffer(self.path, max_lines=2)
+        for i in range(4):
+            buffer.append(f'line {i}\n')
+        self.assertTrue(os.path.exists(self.path))
+        buffer.discard()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_nothing_is_written_for_short_output(self):
+        buffer = LogBuffer(self.path, max_lines=10)
+        buffer.append('only line\n')
+        buffer.discard()
+        self.assertFalse(os.path.exists(os.path.dirname(self.path)))
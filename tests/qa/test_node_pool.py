@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import unittest
+from threading import Event
+from unittest import mock
+
+from crate.client.exceptions import ProgrammingError
+from crate.qa.tests import NodePool, NodePoolKey, _reset_cluster
+
+KEY = NodePoolKey('5.10.1', (), 'default', 'disk', '1024m')
+
+
+class FakeNode:
+    """Stands in for a _PooledNode
+
+    `start` of all but the first node blocks until the test lets it finish.
+    """
+
+    instances: list = []
+
+    def __init__(self, key):
+        self.key = key
+        self.leases = 0
+        self.started = Event()
+        self.proceed = Event()
+        self.discarded = False
+        self.aborted = False
+        if not FakeNode.instances:
+            self.proceed.set()
+        FakeNode.instances.append(self)
+
+    def start(self):
+        self.started.set()
+        self.proceed.wait(10)
+        if self.aborted:
+            raise SystemExit("CrateDB didn't start in time or couldn't form a cluster.")
+
+    def abort(self):
+        self.aborted = True
+        self.proceed.set()
+
+    def discard(self):
+        self.discarded = True
+
+    def is_alive(self):
+        return not self.discarded
+
+
+class NodePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeNode.instances = []
+        patcher = mock.patch('crate.qa.tests._PooledNode', FakeNode)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = NodePool(size=1)
+        self.addCleanup(self.pool.close)
+
+    def lease_pristine(self):
+        pooled = self.pool.lease(KEY, pristine=True)
+        self.assertIs(pooled, FakeNode.instances[0])
+        return pooled
+
+    def test_replacement_is_started_in_background(self):
+        self.lease_pristine()
+        warming = FakeNode.instances[-1]
+        self.assertTrue(warming.started.wait(5))
+        warming.proceed.set()
+        pooled = self.pool.lease(KEY, pristine=True)
+        self.assertIs(pooled, warming)
+        self.assertFalse(warming.discarded)
+
+    def test_cancel_warming_aborts_replacement(self):
+        self.lease_pristine()
+        warming = FakeNode.instances[-1]
+        self.assertTrue(warming.started.wait(5))
+        self.pool.cancel_warming()
+        self.pool._executor.shutdown(wait=True)
+        self.assertTrue(warming.aborted)
+        self.assertEqual(self.pool._idle, [])
+        self.assertEqual(self.pool._warming, {})
+
+    def test_close_aborts_replacement(self):
+        self.lease_pristine()
+        warming = FakeNode.instances[-1]
+        self.assertTrue(warming.started.wait(5))
+        self.pool.close()
+        self.assertTrue(warming.aborted)
+        self.assertEqual(self.pool._idle, [])
+
+
+class Cursor:
+
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self._rows = []
+
+    def execute(self, stmt):
+        self.statements.append(stmt)
+        result = next((r for prefix, r in self.results.items() if stmt.startswith(prefix)), [])
+        if isinstance(result, Exception):
+            raise result
+        self._rows = result
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0]
+
+
+class ResetClusterTest(unittest.TestCase):
+
+    def test_drops_users_repositories_and_changed_settings(self):
+        settings = {
+            'stats.enabled': True,
+            'stats.jobs_log_size': 10000,
+            'logger': [{'name': 'root', 'level': 'INFO'}],
+        }
+        cursor = Cursor({
+            'SELECT name FROM sys.users': [('arthur', )],
+            'SELECT name FROM sys.roles': [('readers', )],
+            'SELECT name FROM sys.repositories': [('backups', )],
+            'SELECT settings FROM sys.cluster': [({
+                'stats': {'enabled': True, 'jobs_log_size': 0},
+                'indices': {'recovery': {'max_bytes_per_sec': '1mb'}},
+                'logger': [{'name': 'root', 'level': 'INFO'}, {'name': 'action', 'level': 'DEBUG'}],
+            }, )],
+        })
+        _reset_cluster(cursor, settings)
+        self.assertEqual([s for s in cursor.statements if not s.startswith('SELECT')], [
+            'DROP USER "arthur"',
+            'DROP ROLE "readers"',
+            'DROP REPOSITORY "backups"',
+            'RESET GLOBAL "stats.jobs_log_size"',
+            'RESET GLOBAL "indices.recovery.max_bytes_per_sec"',
+            'RESET GLOBAL "logger.action"',
+        ])
+
+    def test_versions_without_user_management(self):
+        cursor = Cursor({
+            'SELECT name FROM sys.users': ProgrammingError('RelationUnknown[Relation \'sys.users\' unknown]'),
+            'SELECT settings FROM sys.cluster': [({}, )],
+        })
+        _reset_cluster(cursor, {})
+        self.assertFalse([s for s in cursor.statements if not s.startswith('SELECT')])
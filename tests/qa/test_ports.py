@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import socket
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from crate.qa.tests import PORTS_PER_PROTOCOL, NodeProvider, PortBlock, lease_ports, release_ports
+
+
+class PortBlockTest(unittest.TestCase):
+
+    def test_node_ports(self):
+        block = PortBlock(20000)
+        self.assertEqual(block.node_settings(2), {
+            'http.port': 20002,
+            'transport.tcp.port': 20000 + PORTS_PER_PROTOCOL + 2,
+            'psql.port': 20000 + 2 * PORTS_PER_PROTOCOL + 2,
+        })
+        self.assertIn(block.psql + 2, block.node_ports('psql'))
+        self.assertNotIn(block.psql + 2, block.node_ports('transport'))
+        self.assertEqual(len(block.ports()), 4 * PORTS_PER_PROTOCOL)
+        with self.assertRaises(AssertionError):
+            block.node_settings(PORTS_PER_PROTOCOL)
+
+
+class PortLeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.registry = Path(tmp.name) / 'ports.json'
+        # A range with room for three blocks
+        for name, value in (('PORT_REGISTRY', self.registry),
+                            ('PORT_RANGE_START', 29000),
+                            ('PORT_RANGE_END', 29000 + 12 * PORTS_PER_PROTOCOL)):
+            patcher = mock.patch(f'crate.qa.tests.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def leases(self):
+        with open(self.registry) as f:
+            return json.load(f)
+
+    def test_lease_and_release(self):
+        first = lease_ports()
+        second = lease_ports()
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.leases(), {str(first.start): os.getpid(), str(second.start): os.getpid()})
+        release_ports(first)
+        self.assertEqual(self.leases(), {str(second.start): os.getpid()})
+        self.assertEqual(lease_ports(), first)
+
+    def test_leases_of_dead_processes_are_dropped(self):
+        with open(self.registry, 'w') as f:
+            json.dump({'29000': 2 ** 22 + 1}, f)
+        with mock.patch('crate.qa.tests._is_process_alive', return_value=False):
+            self.assertEqual(lease_ports(), PortBlock(29000))
+
+    def test_blocks_with_bound_ports_are_skipped(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 29000 + 3))
+            self.assertEqual(lease_ports(), PortBlock(29000 + 4 * PORTS_PER_PROTOCOL))
+
+    def test_no_free_block(self):
+        for _ in range(3):
+            lease_ports()
+        with self.assertRaisesRegex(RuntimeError, 'No free port block'):
+            lease_ports()
+
+
+class ClusterPortsTest(unittest.TestCase):
+
+    def test_nodes_keep_leased_transport_ports(self):
+        class SettingsProvider(NodeProvider, unittest.TestCase):
+            """Creates the settings of the nodes instead of the nodes"""
+
+            def _lease_ports(self):
+                return PortBlock(29000)
+
+            def _new_node(self, version, settings=None, env=None):
+                return settings, (6, 0, 0)
+
+            def runTest(self):
+                pass
+
+        provider = SettingsProvider()
+        seed_hosts = ','.join(f'127.0.0.1:{29000 + PORTS_PER_PROTOCOL + i}' for i in range(3))
+        for cluster in (provider._new_cluster('6.0.0', 3, explicit_discovery=False),
+                        provider._new_heterogeneous_cluster(['5.10.0', '6.0.0', '6.0.0'])):
+            settings = cluster.nodes()
+            self.assertEqual([s['transport.tcp.port'] for s in settings], [29000 + PORTS_PER_PROTOCOL + i for i in range(3)])
+            self.assertEqual({s['discovery.seed_hosts'] for s in settings}, {seed_hosts})
+        self.assertNotIn('cluster.initial_master_nodes', provider._new_cluster('6.0.0', 3, explicit_discovery=False).node())
+        self.assertNotIn('discovery.seed_hosts', provider._new_cluster('6.0.0', 1, explicit_discovery=False).node())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import unittest
+import contextlib
+import tempfile
+from pathlib import Path
+from unittest import mock
+from xml.etree import ElementTree
+
+from crate.qa.runner import Job, Scheduler, create_jobs, parse_size_mb, write_junit_report, write_spans_report
+from crate.qa.tests import NodeProvider
+
+
+class SingleNode(unittest.TestCase):
+
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+
+
+class ThreeNodes(unittest.TestCase):
+
+    NUM_NODES = 3
+    EXCLUSIVE_RESOURCES = ('minio', )
+    SUBTEST_SHARDS = {'test_sharded': 2}
+
+    def test_sharded(self):
+        pass
+
+    def test_plain(self):
+        pass
+
+
+@unittest.skip('not run')
+class Skipped(unittest.TestCase):
+
+    NUM_NODES = 4
+    SUBTEST_SHARDS = {'test_sharded': 2}
+
+    def test_sharded(self):
+        pass
+
+
+class ModuleClusterA(unittest.TestCase):
+
+    SHARED_CLUSTER = 'module'
+    NUM_NODES = 1
+
+    def test_a(self):
+        pass
+
+
+class ModuleClusterB(unittest.TestCase):
+
+    SHARED_CLUSTER = 'module'
+    NUM_NODES = 2
+    EXCLUSIVE_RESOURCES = ('minio', )
+
+    def test_b(self):
+        pass
+
+
+def scheduler(jobs, memory_mb=4096, cores=4, node_memory_mb=1024, max_workers=4):
+    return Scheduler(jobs, '.', Path('test-reports'), memory_mb, cores, node_memory_mb, max_workers)
+
+
+def run(s: Scheduler, job: Job):
+    s.pending.remove(job)
+    s.running.append((job, None, 0.0))  # type: ignore
+
+
+class CreateJobsTest(unittest.TestCase):
+
+    def test_jobs_per_class_and_shard(self):
+        loader = unittest.TestLoader()
+        suite = unittest.TestSuite([
+            loader.loadTestsFromTestCase(SingleNode),
+            loader.loadTestsFromTestCase(ThreeNodes),
+            loader.loadTestsFromTestCase(Skipped),
+        ])
+        jobs, unloadable = create_jobs(suite)
+        self.assertEqual(unloadable, [])
+        by_name = {j.name: j for j in jobs}
+        prefix = f'{__name__}.'
+        self.assertEqual(by_name[prefix + 'SingleNode'], Job(
+            prefix + 'SingleNode', (prefix + 'SingleNode.test_a', prefix + 'SingleNode.test_b'), 1, ()))
+        self.assertEqual(by_name[prefix + 'ThreeNodes'].test_ids, (prefix + 'ThreeNodes.test_plain', ))
+        shards = [j for j in jobs if j.shard]
+        self.assertEqual([j.shard for j in shards], ['0/2', '1/2'])
+        self.assertEqual({(j.num_nodes, j.resources) for j in shards}, {(3, ('minio', ))})
+        # Skipped classes don't claim any nodes and aren't sharded
+        self.assertEqual(by_name[prefix + 'Skipped'].num_nodes, 0)
+        self.assertEqual(len(jobs), 5)
+
+    def test_node_pool_is_budgeted(self):
+        # Not at module level, discovery would run it
+        class Pooled(NodeProvider, unittest.TestCase):
+
+            def test_lease(self):
+                pass
+
+        class Cluster(Pooled):
+            NUM_NODES = 3
+
+        suite = unittest.TestSuite([Pooled('test_lease'), Cluster('test_lease')])
+        with mock.patch('crate.qa.runner.NODE_POOL_SIZE', 2):
+            jobs, _ = create_jobs(suite)
+        self.assertEqual([j.num_nodes for j in jobs], [3, 3])
+        with mock.patch('crate.qa.runner.NODE_POOL_SIZE', 0):
+            jobs, _ = create_jobs(suite)
+        self.assertEqual([j.num_nodes for j in jobs], [1, 3])
+
+    def test_module_shared_clusters_are_one_job(self):
+        loader = unittest.TestLoader()
+        suite = unittest.TestSuite([
+            loader.loadTestsFromTestCase(ModuleClusterA),
+            loader.loadTestsFromTestCase(SingleNode),
+            loader.loadTestsFromTestCase(ModuleClusterB),
+        ])
+        jobs, _ = create_jobs(suite)
+        prefix = f'{__name__}.'
+        self.assertEqual(jobs, [
+            Job(prefix + 'SingleNode', (prefix + 'SingleNode.test_a', prefix + 'SingleNode.test_b'), 1, ()),
+            Job(__name__, (prefix + 'ModuleClusterA.test_a', prefix + 'ModuleClusterB.test_b'), 2, ('minio', )),
+        ])
+
+    def test_import_errors_are_run_in_the_runner(self):
+        suite = unittest.TestLoader().loadTestsFromName('no_such_module_for_crate_qa')
+        jobs, unloadable = create_jobs(suite)
+        self.assertEqual(jobs, [])
+        self.assertEqual(len(unloadable), 1)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_largest_jobs_first(self):
+        s = scheduler([Job('a', ('a', ), 1, ()), Job('b', ('b', ), 3, ()), Job('c', ('c', ), 2, ())])
+        self.assertEqual([j.name for j in s.pending], ['b', 'c', 'a'])
+
+    def test_first_job_always_fits(self):
+        job = Job('huge', ('huge', ), 10, ())
+        s = scheduler([job], memory_mb=1024, cores=1)
+        self.assertTrue(s._fits(job))
+
+    def test_memory_budget(self):
+        big, small, tiny = Job('big', (), 3, ()), Job('small', (), 2, ()), Job('tiny', (), 1, ())
+        s = scheduler([big, small, tiny], memory_mb=4096, cores=16)
+        run(s, big)
+        self.assertFalse(s._fits(small))
+        self.assertTrue(s._fits(tiny))
+        run(s, tiny)
+        self.assertFalse(s._fits(Job('one-more', (), 1, ())))
+        self.assertTrue(s._fits(Job('no-nodes', (), 0, ())))
+
+    def test_core_budget(self):
+        first, second = Job('first', (), 2, ()), Job('second', (), 2, ())
+        s = scheduler([first, second], memory_mb=100000, cores=3)
+        run(s, first)
+        self.assertFalse(s._fits(second))
+        self.assertTrue(s._fits(Job('single', (), 1, ())))
+
+    def test_max_workers(self):
+        jobs = [Job(str(i), (), 0, ()) for i in range(3)]
+        s = scheduler(jobs, max_workers=2)
+        run(s, jobs[0])
+        run(s, jobs[1])
+        self.assertFalse(s._fits(jobs[2]))
+
+    def test_exclusive_resources(self):
+        first, second = Job('first', (), 1, ('minio', )), Job('second', (), 1, ('minio', 'kafka'))
+        s = scheduler([first, second])
+        run(s, first)
+        self.assertFalse(s._fits(second))
+        self.assertTrue(s._fits(Job('kafka', (), 1, ('kafka', ))))
+
+    def test_worker_without_results_is_an_error(self):
+        class Proc:
+            returncode = -9
+
+        with tempfile.TemporaryDirectory() as tmp:
+            job = Job('crashed.Test', ('crashed.Test', ), 1, ())
+            s = Scheduler([job], '.', Path(tmp), 4096, 4, 1024, 4)
+            with contextlib.redirect_stdout(io.StringIO()):
+                s._finish(job, Proc(), 0.0)  # type: ignore
+        [record] = s.records
+        self.assertEqual(record['id'], 'crashed.Test')
+        self.assertEqual(record['outcome'], 'error')
+        self.assertIn('exited with -9', record['details'])
+
+
+class ReportTest(unittest.TestCase):
+
+    def test_junit_report(self):
+        records = [
+            {'id': 'm.A.test_ok', 'outcome': 'success', 'duration': 1.5, 'details': None},
+            {'id': 'm.A.test_sub (version=1)', 'outcome': 'failure', 'duration': 0.5, 'details': 'boom'},
+            {'id': 'm.B.test_skip', 'outcome': 'skipped', 'duration': 0, 'details': 'why', 'log': 'b.log'},
+            {'id': 'm.B.test_error', 'outcome': 'error', 'duration': 2, 'details': 'trace'},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'junit.xml'
+            write_junit_report(records, path)
+            root = ElementTree.parse(path).getroot()
+        suites = {s.get('name'): s for s in root}
+        self.assertEqual(
+            {name: (s.get('tests'), s.get('failures'), s.get('errors'), s.get('skipped')) for name, s in suites.items()},
+            {'m.A': ('2', '1', '0', '0'), 'm.B': ('2', '0', '1', '1')})
+        sub = suites['m.A'].find("testcase[@name='test_sub (version=1)']")
+        assert sub is not None
+        self.assertEqual(sub.findtext('failure'), 'boom')
+        skipped = suites['m.B'].find("testcase[@name='test_skip']")
+        assert skipped is not None
+        self.assertEqual(skipped.findtext('system-out'), 'b.log')
+
+    def test_spans_of_all_workers_are_merged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            report_dir = Path(tmp)
+            (report_dir / 'spans').mkdir()
+            for name, durations in (('a', [1.0, 3.0]), ('b', [2.0])):
+                with open(report_dir / 'spans' / f'{name}.jsonl', 'w') as f:
+                    for duration in durations:
+                        f.write(json.dumps({'phase': 'start', 'duration': duration}) + '\n')
+                    f.write('\n')
+            phases = write_spans_report(report_dir)
+            with open(report_dir / 'spans.json') as f:
+                report = json.load(f)
+        self.assertEqual(phases['start']['count'], 3)
+        self.assertEqual(phases['start']['total'], 6.0)
+        self.assertEqual(phases['start']['max'], 3.0)
+        self.assertEqual(len(report['spans']), 3)
+        self.assertEqual(report['phases'], phases)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size_mb('1g'), 1024)
+        self.assertEqual(parse_size_mb('512M'), 512)
+        self.assertEqual(parse_size_mb(str(256 * 1024 * 1024)), 256)
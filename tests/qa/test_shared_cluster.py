@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from crate.qa.tests import NodeProvider
+
+
+class FakeSharedCluster:
+
+    def __init__(self, provider_cls):
+        self.cluster = mock.MagicMock()
+        self.cluster.__iter__.return_value = iter([])
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SharedClusterTest(unittest.TestCase):
+
+    def run_class(self, cls):
+        created = []
+
+        def shared_cluster(provider_cls):
+            created.append(FakeSharedCluster(provider_cls))
+            return created[-1]
+
+        result = unittest.TestResult()
+        with mock.patch('crate.qa.tests.shared_cluster', shared_cluster), \
+                mock.patch('crate.qa.tests.reset_node') as reset_node:
+            unittest.TestSuite([cls('test_a'), cls('test_b')]).run(result)
+        self.assertEqual(result.errors + result.failures, [])
+        return created, reset_node
+
+    def test_overrides_without_super(self):
+        class Overriding(NodeProvider, unittest.TestCase):
+            SHARED_CLUSTER = 'class'
+            clusters = []
+
+            @classmethod
+            def setUpClass(cls):
+                pass
+
+            @classmethod
+            def tearDownClass(cls):
+                pass
+
+            def test_a(self):
+                self.clusters.append(self.cluster)
+
+            def test_b(self):
+                self.clusters.append(self.cluster)
+
+        created, reset_node = self.run_class(Overriding)
+        self.assertEqual(len(created), 1)
+        self.assertTrue(created[0].closed)
+        self.assertEqual(Overriding.clusters, [created[0].cluster] * 2)
+        self.assertEqual(reset_node.call_count, 2)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+from unittest import mock
+
+from crate.qa.tests import Poll, poll_until, wait_stats
+
+
+class PollTest(unittest.TestCase):
+
+    def test_interval_grows_up_to_max(self):
+        poll = Poll(60, 'test', 0.1, 0.3, 2, 'here')
+        delays = [poll.next_delay(None, None) for _ in range(4)]
+        self.assertEqual(delays, [0.1, 0.2, 0.3, 0.3])
+        self.assertIsNone(poll.next_delay('ready', None))
+        self.assertEqual(poll.polls, 5)
+
+    def test_last_delay_is_cut_at_deadline(self):
+        with mock.patch('crate.qa.tests.time.monotonic', return_value=100.0):
+            poll = Poll(1, 'test', 5, 5, 1.5, 'here')
+        with mock.patch('crate.qa.tests.time.monotonic', return_value=100.75):
+            self.assertAlmostEqual(poll.next_delay(None, None), 0.25)
+
+    def test_timeout_raises_last_assertion_error(self):
+        poll = Poll(0, 'test', 0.1, 1, 1.5, 'here')
+        error = AssertionError('not yet')
+        with self.assertRaises(AssertionError) as cm:
+            poll.next_delay(None, error)
+        self.assertIs(cm.exception, error)
+
+    def test_timeout_without_error(self):
+        poll = Poll(0, 'timeout-test', 0.1, 1, 1.5, 'here')
+        with self.assertRaisesRegex(TimeoutError, 'timeout-test did not succeed within 0s'):
+            poll.next_delay(None, None)
+        self.assertFalse(wait_stats.records[-1].succeeded)
+
+
+class PollUntilTest(unittest.TestCase):
+
+    def test_returns_first_truthy_result(self):
+        results = iter([None, 0, AssertionError('later'), 'done'])
+
+        def condition():
+            result = next(results)
+            if isinstance(result, AssertionError):
+                raise result
+            return result
+
+        self.assertEqual(poll_until(condition, timeout=5, interval=0.001), 'done')
+        record = wait_stats.records[-1]
+        self.assertEqual(record.polls, 4)
+        self.assertTrue(record.succeeded)
+        self.assertTrue(record.caller.startswith('test_waits.py:'), record.caller)
+
+    def test_condition_is_checked_at_deadline(self):
+        started = time.monotonic()
+        calls = []
+
+        def condition():
+            calls.append(time.monotonic())
+            assert False, 'never ready'
+
+        with self.assertRaisesRegex(AssertionError, 'never ready'):
+            poll_until(condition, timeout=0.3, interval=0.2, max_interval=1)
+        self.assertGreaterEqual(calls[-1] - started, 0.3)
+        self.assertLess(calls[-1] - started, 0.5)
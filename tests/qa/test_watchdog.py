@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+from threading import Thread
+from unittest import mock
+
+from crate.qa.tests import (
+    FunctionTimeoutError,
+    PumpedOutputMonitor,
+    Watchdog,
+    _copy_progress,
+    log_pump,
+    progress_muted,
+    report_progress,
+)
+
+MASTER_NOT_DISCOVERED = (
+    '[2025-01-01T10:00:{:02d},123][WARN ][o.e.c.c.ClusterFormationFailureHelper] [node-1] master not '
+    'discovered yet, this node has not previously joined a bootstrapped cluster, term {}\n')
+
+
+class Node:
+    pass
+
+
+class Copy:
+    """ A connection whose shards' sequence numbers grow by `step` per check """
+
+    def __init__(self, step):
+        self.step = step
+        self.seq_no = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, stmt, args):
+        self.seq_no += self.step
+
+    def fetchone(self):
+        return [self.seq_no]
+
+
+class ProgressTest(unittest.TestCase):
+
+    def test_repeated_warnings_are_no_progress(self):
+        monitor = PumpedOutputMonitor(log_pump)
+        self.assertTrue(monitor._is_progress(MASTER_NOT_DISCOVERED.format(1, 1)))
+        self.assertTrue(monitor._is_progress('\tat org.elasticsearch.Foo.bar(Foo.java:1)\n'))
+        self.assertFalse(monitor._is_progress(MASTER_NOT_DISCOVERED.format(11, 2)))
+        self.assertFalse(monitor._is_progress('\tat org.elasticsearch.Foo.bar(Foo.java:1)\n'))
+        self.assertTrue(monitor._is_progress('[2025-01-01T10:00:21,123][INFO ][o.e.n.Node] [node-1] started\n'))
+        self.assertTrue(monitor._is_progress(
+            '[2025-01-01T10:00:22,123][ERROR][o.e.b.Bootstrap] [node-1] something else\n'))
+
+    def test_progress_of_other_nodes_is_ignored(self):
+        watched, other = Node(), Node()
+        with Watchdog(60, 60, lambda: [watched]) as watchdog:
+            watchdog._last_progress = 0
+            report_progress('log', other)
+            self.assertEqual(watchdog._last_progress, 0)
+            with progress_muted():
+                report_progress('span:start')
+            self.assertEqual(watchdog._last_progress, 0)
+            report_progress('log', watched)
+            self.assertEqual(watchdog._last_source, 'log')
+            self.assertGreater(watchdog._last_progress, 0)
+            watchdog._last_progress = 0
+            report_progress('query')
+            self.assertEqual(watchdog._last_source, 'query')
+            self.assertGreater(watchdog._last_progress, 0)
+
+    @mock.patch('crate.qa.tests.print_error')
+    @mock.patch('crate.qa.tests.faulthandler.dump_traceback')
+    def test_stalled_block_is_aborted(self, dump_traceback, print_error):
+        def report_from_other_node():
+            while not stop:
+                report_progress('log', Node())
+                time.sleep(0.01)
+
+        stop = False
+        reporter = Thread(target=report_from_other_node)
+        reporter.start()
+        try:
+            with self.assertRaisesRegex(FunctionTimeoutError, 'made no progress'):
+                with Watchdog(30, 0.3, name='stalled'):
+                    deadline = time.monotonic() + 10
+                    while time.monotonic() < deadline:
+                        time.sleep(0.01)
+        finally:
+            stop = True
+            reporter.join()
+        dump_traceback.assert_called_once()
+
+
+class CopyProgressTest(unittest.TestCase):
+
+    def test_running_copy_is_progress(self):
+        with Watchdog(30, 0.3, name='copy'):
+            with _copy_progress(Copy(step=100), 'doc', 't', interval=0.05):
+                time.sleep(1)
+
+    @mock.patch('crate.qa.tests.print_error')
+    @mock.patch('crate.qa.tests.faulthandler.dump_traceback')
+    def test_stuck_copy_is_aborted(self, dump_traceback, print_error):
+        with self.assertRaisesRegex(FunctionTimeoutError, 'made no progress'):
+            with Watchdog(30, 0.3, name='copy'):
+                with _copy_progress(Copy(step=0), 'doc', 't', interval=0.05):
+                    deadline = time.monotonic() + 10
+                    while time.monotonic() < deadline:
+                        time.sleep(0.01)
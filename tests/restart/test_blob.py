@@ -9,9 +9,10 @@ from crate.qa.tests import NodeProvider, wait_for_active_shards
 
 class BlobTestCase(NodeProvider, unittest.TestCase):
 
+    STORAGE_CLASS = 'memory'
+
     def test_blob_index(self):
-        (node, _) = self._new_node(self.CRATE_VERSION)
-        node.start()
+        node = self._lease_node(reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
@@ -36,8 +37,7 @@ class BlobTestCase(NodeProvider, unittest.TestCase):
             self.assertEqual(result[2], '0')
 
     def test_blob_record(self):
-        (node, _) = self._new_node(self.CRATE_VERSION)
-        node.start()
+        node = self._lease_node(reuse=False)
         digest = ''
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
@@ -7,14 +7,15 @@ from crate.qa.tests import NodeProvider
 
 class MetadataTestCase(NodeProvider, unittest.TestCase):
 
+    STORAGE_CLASS = 'memory'
+
     CRATE_SETTINGS = {
         'license.enterprise': True,
         'lang.js.enabled': True
     }
 
     def test_udf(self):
-        (node, _) = self._new_node(self.CRATE_VERSION, settings=self.CRATE_SETTINGS)
-        node.start()
+        node = self._lease_node(settings=self.CRATE_SETTINGS, reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
@@ -36,8 +37,7 @@ class MetadataTestCase(NodeProvider, unittest.TestCase):
             self.assertEqual(result[0], 'subtract')
 
     def test_user_information(self):
-        (node, _) = self._new_node(self.CRATE_VERSION, settings=self.CRATE_SETTINGS)
-        node.start()
+        node = self._lease_node(settings=self.CRATE_SETTINGS, reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("CREATE USER user_a")
@@ -55,8 +55,7 @@ class MetadataTestCase(NodeProvider, unittest.TestCase):
             self.assertFalse(result[1][1])
 
     def test_user_privileges(self):
-        (node, _) = self._new_node(self.CRATE_VERSION, settings=self.CRATE_SETTINGS)
-        node.start()
+        node = self._lease_node(settings=self.CRATE_SETTINGS, reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("CREATE USER user_a")
@@ -89,8 +88,7 @@ class MetadataTestCase(NodeProvider, unittest.TestCase):
             self.assertEqual(result, expected)
 
     def test_views(self):
-        (node, _) = self._new_node(self.CRATE_VERSION, settings=self.CRATE_SETTINGS)
-        node.start()
+        node = self._lease_node(settings=self.CRATE_SETTINGS, reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
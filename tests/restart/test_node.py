@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import unittest
+from crate.client import connect
+from crate.qa.tests import NodeProvider
+
+
+class NodeRestartTestCase(NodeProvider, unittest.TestCase):
+
+    STORAGE_CLASS = 'memory'
+
+    def test_output_is_read_across_restarts(self):
+        # node.stop() and node.start() are called directly, like the other
+        # restart tests do. The output of every run must reach the consumers:
+        # `start` learns the HTTP address of the node from it.
+        node = self._lease_node(reuse=False)
+        for _ in range(3):
+            lines = []
+            node.monitor.consumers.append(lines.append)
+            process = node.process
+            node.stop()
+            self.assertTrue(process.stdout.closed)
+            self.assertTrue(any('stopped' in line for line in lines), lines[-20:])
+
+            node.start()
+            node.monitor.consumers.remove(lines.append)
+            with connect(node.http_url, error_trace=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT count(*) FROM sys.nodes")
+                self.assertEqual(cursor.fetchone()[0], 1)
@@ -6,9 +6,10 @@ from crate.qa.tests import NodeProvider, wait_for_active_shards
 
 class PartitionTestCase(NodeProvider, unittest.TestCase):
 
+    STORAGE_CLASS = 'memory'
+
     def test_query_partitioned_table(self):
-        (node, _) = self._new_node(self.CRATE_VERSION)
-        node.start()
+        node = self._lease_node(reuse=False)
         with connect(node.http_url, error_trace=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
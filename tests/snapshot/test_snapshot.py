@@ -11,6 +11,10 @@ from crate.qa.tests import NodeProvider, insert_data, wait_for_active_shards, ge
 
 class SnapshotOperationTest(NodeProvider, unittest.TestCase):
 
+    NUM_NODES = 5
+    EXCLUSIVE_RESOURCES = ('minio',)
+    DISCARD_ON_TEARDOWN = True
+
     def _assert_num_docs(self, conn, expected_count):
         c = conn.cursor()
         c.execute('SELECT COUNT(*) FROM doc.test')
@@ -73,4 +77,4 @@ class SnapshotOperationTest(NodeProvider, unittest.TestCase):
 
                 assert_busy(lambda: self._assert_num_docs(conn, num_docs))
 
-            cluster.stop()
+            cluster.stop(discard=True)
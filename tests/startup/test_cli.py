@@ -14,6 +14,7 @@ def randbool():
 
 
 class StartupTest(NodeProvider, unittest.TestCase):
+    STORAGE_CLASS = 'memory'
     fake = Faker(random.choice(list(AVAILABLE_LOCALES)))
 
     def test_name_settings(self):
@@ -10,6 +10,8 @@ from faker.generator import random
 
 class StartupTest(NodeProvider, unittest.TestCase):
 
+    STORAGE_CLASS = 'memory'
+
     fake = Faker(random.choice(list(AVAILABLE_LOCALES)))
 
     def test_read_crate_yml(self):
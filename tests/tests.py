@@ -1,5 +1,9 @@
+import os
+import sys
 import unittest
 
+from crate.qa import runner
+
 
 def suite():
     """
@@ -11,5 +15,9 @@ def suite():
 if __name__ == '__main__':
     """
     To be executed from anywhere using `python path/to/tests.py`.
+
+    Runs the test classes in parallel worker processes, see
+    `python path/to/tests.py --help` for the options.
     """
-    unittest.TextTestRunner(verbosity=2).run(suite())
+    sys.argv[1:1] = ['--start-dir', os.path.dirname(os.path.abspath(__file__))]
+    runner.main()